@@ -6,10 +6,18 @@ Usa ClientManager de core/ para la lógica de negocio compartida con el servidor
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
+import os
 import threading
+import time
 import re
+from urllib.parse import urlparse, parse_qs
 
 from core import ClientManager
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, route_label
+from core.telemetry import TELEMETRY_HEADER
+from core.traffic import TrafficRecorder
+from core.profiling import (Profiler, FOLDED_CONTENT_TYPE,
+                            DEFAULT_SAMPLE_SECONDS, DEFAULT_SAMPLE_INTERVAL_MS)
 
 
 # ============== SINGLETON DEL MANAGER ==============
@@ -18,13 +26,21 @@ _manager_instance = None
 _manager_lock = threading.Lock()
 
 
+# Perfilado bajo demanda: apagado salvo CIBERMONDAY_PROFILING=1 o set_profiling_enabled()
+_profiler = Profiler.from_env()
+
+# Grabación del tráfico: apagada salvo CIBERMONDAY_TRAFFIC_LOG o set_traffic_recording()
+_recorder = TrafficRecorder.from_env()
+
+
 def get_manager():
     """Obtiene la instancia singleton del ClientManager."""
     global _manager_instance
     if _manager_instance is None:
         with _manager_lock:
             if _manager_instance is None:
-                _manager_instance = ClientManager()
+                _manager_instance = ClientManager(
+                    commands_path=ClientManager.default_commands_path(5000))
     return _manager_instance
 
 
@@ -116,6 +132,34 @@ def set_server_config(broadcast_interval):
     return json.dumps(result)
 
 
+def set_profiling_enabled(enabled):
+    """Habilita o deshabilita las rutas /api/profile (apagado por defecto)."""
+    _profiler.enabled = bool(enabled)
+    if not _profiler.enabled:
+        _profiler.sampler.stop()
+        _profiler.memory.stop()
+    print(f"[Profiling] {'Habilitado' if _profiler.enabled else 'Deshabilitado'}")
+    return json.dumps({'success': True, 'enabled': _profiler.enabled})
+
+
+def set_traffic_recording(path=None):
+    """Empieza a grabar el tráfico de la API en `path` (None la detiene)."""
+    global _recorder
+    previous, _recorder = _recorder, None
+    if previous is not None:
+        previous.close()
+    if path:
+        try:
+            _recorder = TrafficRecorder(path)
+        except OSError as e:
+            return json.dumps({'success': False, 'message': f'No se pudo abrir {path}: {e}'})
+        print(f"[Tráfico] Grabando requests en {_recorder.path}")
+    else:
+        print("[Tráfico] Grabación detenida")
+    return json.dumps({'success': True, 'recording': _recorder is not None,
+                       'path': _recorder.path if _recorder else None})
+
+
 def register_server_manual(server_url, server_ip=None, server_port=None):
     """Registra un servidor manualmente desde la UI."""
     mgr = get_manager()
@@ -133,11 +177,53 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
     """Handler HTTP para la API de CiberMonday."""
     
     manager = None
+    profiler = _profiler
+    # Orígenes admitidos en las rutas de admin (igual que ADMIN_ALLOWED_IPS en Flask)
+    LOOPBACK_ADDRESSES = ('127.0.0.1', '::1')
     
     def log_message(self, format, *args):
         """Log de requests."""
         print(f"[CiberMonday HTTP] {args[0]}")
     
+    def send_response(self, code, message=None):
+        # Guardar el status para las métricas del request
+        self._status = code
+        super().send_response(code, message)
+    
+    def _timed(self, route_handler):
+        """Atiende el request con route_handler y registra su latencia en las métricas."""
+        started = time.perf_counter()
+        started_at = time.time()
+        self._status = None
+        self._raw_body = b''
+        self._response_data = None
+        # cProfile solo si el perfilado está habilitado y el request local lo pide
+        profile_token = None
+        if self.profiler.enabled and self._is_local_request() and \
+                self.profiler.wants_request_profile(self.headers, parse_qs(urlparse(self.path).query)):
+            profile_token = self.profiler.begin_request()
+        try:
+            route_handler()
+        finally:
+            if profile_token is not None:
+                # Los headers ya se enviaron: el perfil se consulta en /api/profile/requests
+                self.profiler.end_request(profile_token, self.command,
+                                          self.path.split('?')[0], self._status or 500)
+            route = route_label(self.path.split('?')[0])
+            if self._status == 404 and not route.startswith('/api/client/<client_id>'):
+                route = 'other'
+            elapsed = time.perf_counter() - started
+            self.manager.metrics.observe_request(self.command, route, self._status or 500, elapsed)
+            recorder = _recorder
+            if recorder is not None and recorder.should_record(self.path):
+                client_id = None
+                if self.path == '/api/register' and isinstance(self._response_data, dict):
+                    # El replay sigue al cliente nuevo con el ID que le asignó el servidor
+                    client_id = self._response_data.get('client_id')
+                recorder.record(self.command, self.path, self._raw_body, self._status or 500,
+                                elapsed, headers=self.headers, started_at=started_at,
+                                client_id=client_id)
+    
     def _set_headers(self, status=200, content_type='application/json'):
         self.send_response(status)
         self.send_header('Content-Type', content_type)
@@ -147,13 +233,41 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
         self.end_headers()
     
     def _send_json(self, data, status=200):
+        self._response_data = data
         self._set_headers(status)
         self.wfile.write(json.dumps(data).encode('utf-8'))
     
+    def _send_text(self, text, content_type, status=200):
+        self._set_headers(status, content_type)
+        self.wfile.write(text.encode('utf-8'))
+    
+    def _is_local_request(self):
+        """Verifica si la request viene del propio dispositivo."""
+        return self.client_address[0] in self.LOOPBACK_ADDRESSES
+    
+    def _admin_only(self):
+        """True si la request es local; si no, responde 403."""
+        if self._is_local_request():
+            return True
+        self._send_json({
+            'success': False,
+            'message': 'Acceso denegado. Solo disponible desde el servidor.'
+        }, 403)
+        return False
+    
+    def _profiling_enabled(self):
+        """True si la request es local y el perfilado está habilitado; si no, responde 403."""
+        if not self._admin_only():
+            return False
+        if self.profiler.enabled:
+            return True
+        self._send_json(self.profiler.disabled_result(), 403)
+        return False
+    
     def _read_body(self):
         content_length = int(self.headers.get('Content-Length', 0))
         if content_length > 0:
-            body = self.rfile.read(content_length)
+            body = self._raw_body = self.rfile.read(content_length)
             return json.loads(body.decode('utf-8'))
         return {}
     
@@ -205,6 +319,18 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
     
     def do_GET(self):
         """Handle GET requests."""
+        self._timed(self._route_get)
+    
+    def do_POST(self):
+        """Handle POST requests."""
+        self._timed(self._route_post)
+    
+    def do_DELETE(self):
+        """Handle DELETE requests."""
+        self._timed(self._route_delete)
+    
+    def _route_get(self):
+        """Despacha los endpoints GET."""
         path = self.path.split('?')[0]
         
         if path == '/' or path == '/status':
@@ -306,9 +432,30 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
             self._send_json({
                 'status': 'ok',
                 'active_clients': stats['active_clients'],
-                'total_clients': stats['total_clients']
+                'total_clients': stats['total_clients'],
+                'epoch': self.manager.recovery_epoch,
+                'recovery': self.manager.get_recovery_status(),
+                'replication': True,
+                'leader': self.manager.get_leader_status(),
+                'server_time': time.time()
             })
         
+        elif path == '/api/metrics':
+            self._send_text(self.manager.metrics.render(), METRICS_CONTENT_TYPE)
+        
+        elif path == '/api/profile':
+            if self._admin_only():
+                self._send_json(self.profiler.status())
+        
+        elif path == '/api/profile/flamegraph':
+            if self._profiling_enabled():
+                self._send_text(self.profiler.sampler.folded(), FOLDED_CONTENT_TYPE)
+        
+        elif path == '/api/profile/requests':
+            if self._profiling_enabled():
+                self._send_json({'success': True,
+                                 'profiles': self.profiler.get_request_profiles()})
+        
         elif path == '/api/clients':
             self._send_json({
                 'success': True,
@@ -339,9 +486,24 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
                 'config': self.manager.get_server_config()
             })
         
+        elif path == '/api/replication-status':
+            self._send_json({
+                'success': True,
+                'replication': self.manager.get_replication_status()
+            })
+        
+        elif path == '/api/fleet-health':
+            query = parse_qs(urlparse(self.path).query)
+            result = self.manager.get_fleet_health(query.get('client', [None])[0])
+            self._send_json(result, 200 if result['success'] else 404)
+        
         elif path.startswith('/api/client/') and path.endswith('/status'):
             client_id = path.split('/')[3]
-            client = self.manager.get_client_status(client_id)
+            query = parse_qs(urlparse(self.path).query)
+            client = self.manager.get_client_status(client_id,
+                                                    ack_seq=query.get('ack', [None])[0],
+                                                    ack_queue=query.get('queue', [None])[0],
+                                                    telemetry=self.headers.get(TELEMETRY_HEADER))
             if client:
                 self._send_json({
                     'success': True,
@@ -351,6 +513,14 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
             else:
                 self._send_json({'success': False, 'message': 'Cliente no encontrado'}, 404)
         
+        elif path.startswith('/api/client/') and path.endswith('/history'):
+            client_id = path.split('/')[3]
+            history = self.manager.get_client_history(client_id)
+            if history is not None:
+                self._send_json({'success': True, 'history': history})
+            else:
+                self._send_json({'success': False, 'message': 'Cliente no encontrado'}, 404)
+        
         elif path.startswith('/api/client/') and path.endswith('/config'):
             client_id = path.split('/')[3]
             config = self.manager.get_client_config(client_id)
@@ -362,8 +532,8 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
         else:
             self._send_json({'error': 'Not found'}, 404)
     
-    def do_POST(self):
-        """Handle POST requests."""
+    def _route_post(self):
+        """Despacha los endpoints POST."""
         path = self.path.split('?')[0]
         data = self._read_body()
         
@@ -410,7 +580,8 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
                 custom_name=data.get('custom_name'),
                 max_server_timeouts=data.get('max_server_timeouts'),
                 lock_recheck_interval=data.get('lock_recheck_interval'),
-                notify_client=not from_client
+                notify_client=not from_client,
+                version=data.get('version') if from_client else None
             )
             self._send_json(result, 200 if result['success'] else 400)
         
@@ -419,10 +590,17 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
             result = self.manager.report_session(
                 client_id,
                 data.get('remaining_seconds', 0),
-                data.get('time_limit_seconds')
+                data.get('time_limit_seconds'),
+                data.get('end_ts'),
+                data.get('version')
             )
             self._send_json(result, 200 if result['success'] else 400)
         
+        elif path.startswith('/api/client/') and path.endswith('/report-batch'):
+            client_id = path.split('/')[3]
+            result = self.manager.ingest_events(client_id, data.get('events', []))
+            self._send_json(result, 200 if result['success'] else 404)
+        
         elif path.startswith('/api/client/') and path.endswith('/stop'):
             client_id = path.split('/')[3]
             result = self.manager.stop_client_session(client_id)
@@ -464,9 +642,25 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
                 'known_servers': known_servers
             }, 200)
         
+        elif path == '/api/replicate':
+            if not self.manager.is_replication_peer(
+                    self.client_address[0], self.headers.get(self.manager.MESH_SECRET_HEADER)):
+                self._send_json({
+                    'success': False,
+                    'message': 'Acceso denegado. Solo servidores de la malla pueden replicar.'
+                }, 403)
+                return
+            result = self.manager.apply_replication(
+                data.get('origin'),
+                data.get('epoch'),
+                data.get('entries', []),
+                claimed_leader=data.get('leader')
+            )
+            self._send_json(result, 200)
+        
         elif path == '/api/force-sync':
             try:
-                self.manager._sync_with_other_servers()
+                self.manager._sync_with_other_servers(force=True)
                 self._send_json({
                     'success': True,
                     'message': 'Sincronización forzada completada',
@@ -479,17 +673,44 @@ class CiberMondayHandler(BaseHTTPRequestHandler):
                     'message': f'Error durante sincronización: {str(e)}'
                 }, 500)
         
+        elif path == '/api/profile/start':
+            if self._profiling_enabled():
+                result = self.profiler.sampler.start(
+                    seconds=data.get('seconds', DEFAULT_SAMPLE_SECONDS),
+                    interval_ms=data.get('interval_ms', DEFAULT_SAMPLE_INTERVAL_MS)
+                )
+                self._send_json(result, 200 if result['success'] else 400)
+        
+        elif path == '/api/profile/stop':
+            if self._profiling_enabled():
+                self.profiler.sampler.stop()
+                self._send_text(self.profiler.sampler.folded(), FOLDED_CONTENT_TYPE)
+        
+        elif path == '/api/profile/memory/snapshot':
+            if self._profiling_enabled():
+                result = self.profiler.memory.snapshot(limit=data.get('limit', 20))
+                self._send_json(result, 200 if result['success'] else 400)
+        
+        elif path == '/api/profile/memory/stop':
+            if self._profiling_enabled():
+                self._send_json(self.profiler.memory.stop())
+        
         elif path == '/api/server-config':
             result = self.manager.set_server_config(
-                broadcast_interval=data.get('broadcast_interval')
+                broadcast_interval=data.get('broadcast_interval'),
+                broadcast_max_interval=data.get('broadcast_max_interval'),
+                discovery_mode=data.get('discovery_mode'),
+                multicast_group=data.get('multicast_group'),
+                multicast_ttl=data.get('multicast_ttl'),
+                replication_factor=data.get('replication_factor')
             )
             self._send_json(result, 200 if result['success'] else 400)
         
         else:
             self._send_json({'error': 'Not found'}, 404)
     
-    def do_DELETE(self):
-        """Handle DELETE requests."""
+    def _route_delete(self):
+        """Despacha los endpoints DELETE."""
         path = self.path.split('?')[0]
         
         match = re.match(r'^/api/client/([^/]+)$', path)
@@ -532,6 +753,15 @@ def broadcast_server_presence(server_port=5000):
     get_manager().start_broadcast(
         stop_check=lambda: not _server_running
     )
+    get_manager().start_discovery_responder(
+        stop_check=lambda: not _server_running
+    )
+    get_manager().start_replication(
+        stop_check=lambda: not _server_running
+    )
+    get_manager().start_expiry_scheduler(
+        stop_check=lambda: not _server_running
+    )
 
 
 def start_server(host='0.0.0.0', port=5000, data_dir=None):
@@ -543,9 +773,13 @@ def start_server(host='0.0.0.0', port=5000, data_dir=None):
     try:
         print(f"[CiberMonday] Iniciando servidor HTTP en {host}:{port}")
         
-        # Crear manager con el puerto correcto
+        # Crear manager con el puerto correcto (la cola de comandos va en data_dir si se indica)
+        if data_dir:
+            commands_path = os.path.join(data_dir, f'commands-{port}.json')
+        else:
+            commands_path = ClientManager.default_commands_path(port)
         with _manager_lock:
-            _manager_instance = ClientManager(server_port=port)
+            _manager_instance = ClientManager(server_port=port, commands_path=commands_path)
         
         CiberMondayHandler.manager = get_manager()
         
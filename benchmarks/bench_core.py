@@ -0,0 +1,293 @@
+"""
+CiberMonday - Microbenchmarks de core/client_manager.py
+
+Mide los caminos calientes de ClientManager con 10, 100, 1k y 10k clientes y
+servidores, y compara contra un baseline guardado: si algún caso empeora más
+que la tolerancia, el script termina con código 1.
+
+Uso:
+    python benchmarks/bench_core.py                     # comparar contra el baseline
+    python benchmarks/bench_core.py --save-baseline     # guardar un baseline nuevo
+    python benchmarks/bench_core.py --sizes 10,100 --case report_session
+    python benchmarks/bench_core.py --tolerance 0.3 --json resultados.json
+
+El baseline depende de la máquina: guardarlo en la misma donde se compara (ej: el
+runner de CI) y regenerarlo cuando se acepta un cambio de rendimiento a propósito.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import ClientManager
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'core.json')
+# Fracción de empeoramiento tolerada antes de considerarlo regresión
+DEFAULT_TOLERANCE = 0.5
+# Veces que se re-mide un caso marcado como regresión antes de darlo por confirmado
+RECHECK_ROUNDS = 2
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silencia los print de ClientManager ([Registro], [Sesión], ...)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def server_list(count):
+    return [{'url': f"http://10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}:5000",
+             'ip': f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", 'port': 5000}
+            for i in range(count)]
+
+
+def build_manager(clients, servers=0):
+    """
+    Manager con `clients` clientes (60% con sesión activa, como load_fleet) y
+    `servers` servidores conocidos.
+    """
+    manager = ClientManager(server_port=5000)
+    with quiet():
+        for i in range(clients):
+            session = None
+            if i % 5 < 3:
+                session = {'remaining_seconds': 1800, 'time_limit_seconds': 3600,
+                           'end_ts': time.time() + 1800}
+            manager.register_client(name=f"pc-{i:05d}", client_id=f"client-{i:05d}",
+                                    session_data=session,
+                                    config={'sync_interval': 30, 'custom_name': f"pc-{i:05d}"},
+                                    client_ip='10.0.0.1', diagnostic_port=5002)
+        manager.sync_servers(server_list(servers))
+    return manager
+
+
+# ==================== CASOS ====================
+# Cada caso recibe n y devuelve la operación a medir (sin argumentos).
+
+def case_get_clients(n):
+    manager = build_manager(n)
+    return manager.get_clients
+
+
+def case_get_client_status(n):
+    manager = build_manager(n)
+    ids = list(manager.clients_db)
+    position = [0]
+
+    def op():
+        position[0] = (position[0] + 1) % len(ids)
+        manager.get_client_status(ids[position[0]])
+    return op
+
+
+def case_report_session(n):
+    manager = build_manager(n)
+    ids = list(manager.clients_db)
+    position = [0]
+
+    def op():
+        # Sesión nueva en cada reporte (otro time_limit): camino de escritura,
+        # no "sin cambios" ni divergencia contra el deadline conocido
+        position[0] += 1
+        client_id = ids[position[0] % len(ids)]
+        time_limit = 3600 + position[0] % 2
+        with quiet():
+            manager.report_session(client_id, 1200, time_limit, time.time() + 1200)
+    return op
+
+
+def case_register_client(n):
+    # Re-registro de un cliente que trae n servidores conocidos
+    manager = build_manager(n, n)
+    known_servers = server_list(n)
+    session = {'remaining_seconds': 1800, 'time_limit_seconds': 3600, 'end_ts': time.time() + 1800}
+
+    def op():
+        with quiet():
+            manager.register_client(name='pc-bench', client_id='client-00000',
+                                    session_data=session, known_servers=known_servers,
+                                    client_ip='10.0.0.1', diagnostic_port=5002)
+    return op
+
+
+def case_register_server(n):
+    manager = build_manager(0, n)
+    url = server_list(n)[n // 2]['url']
+    return lambda: manager.register_server(url)
+
+
+def case_sync_servers(n):
+    manager = build_manager(0, n)
+    servers = server_list(n)
+    return lambda: manager.sync_servers(servers)
+
+
+def case_to_json(n):
+    manager = build_manager(n, n)
+    return manager.to_json
+
+
+def case_from_json(n):
+    manager = build_manager(n, n)
+    state = manager.to_json()
+    return lambda: manager.from_json(state)
+
+
+CASES = {
+    'get_clients': case_get_clients,
+    'get_client_status': case_get_client_status,
+    'report_session': case_report_session,
+    'register_client': case_register_client,
+    'register_server': case_register_server,
+    'sync_servers': case_sync_servers,
+    'to_json': case_to_json,
+    'from_json': case_from_json,
+}
+
+
+# ==================== MEDICIÓN ====================
+
+def measure(op, repeat=5, min_time=0.2):
+    """
+    Segundos por llamada: el mínimo de `repeat` rondas (el mínimo es el menos
+    afectado por el ruido del sistema), cada ronda de al menos `min_time`.
+    """
+    timer = timeit.Timer(op)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(cases, sizes, repeat):
+    results = {}
+    for name in cases:
+        for n in sizes:
+            op = CASES[name](n)
+            key = f"{name}[{n}]"
+            results[key] = measure(op, repeat=repeat)
+            print(f"  {key:<28} {format_time(results[key]):>12}")
+    return results
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+def machine_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compara contra el baseline.
+
+    Returns:
+        lista de (caso, actual, baseline, ratio) que superan la tolerancia
+    """
+    regressions = []
+    print(f"\n  {'caso':<28} {'baseline':>12} {'actual':>12} {'ratio':>7}")
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            print(f"  {key:<28} {'-':>12} {format_time(current):>12} {'nuevo':>7}")
+            continue
+        ratio = current / reference
+        mark = ' REGRESIÓN' if ratio > 1 + tolerance else ''
+        print(f"  {key:<28} {format_time(reference):>12} {format_time(current):>12} {ratio:>6.2f}x{mark}")
+        if mark:
+            regressions.append((key, current, reference, ratio))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Microbenchmarks de ClientManager')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='Cantidades de clientes/servidores (default: 10,100,1000,10000)')
+    parser.add_argument('--case', action='append', choices=sorted(CASES),
+                        help='Caso a medir (se puede repetir; default: todos)')
+    parser.add_argument('--repeat', type=int, default=5, help='Rondas por caso (se toma el mínimo)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Archivo de baseline')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Guardar los resultados como baseline (se combinan con los existentes)')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Empeoramiento tolerado (0.5 = 50%% más lento)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    args.case = args.case or list(CASES)
+    return args
+
+
+def save_results(path, results):
+    with open(path, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"[Bench] ClientManager | Python {platform.python_version()} | tamaños {args.sizes}")
+    results = run(args.case, args.sizes, args.repeat)
+
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+
+    if args.save_baseline:
+        if args.json:
+            save_results(args.json, results)
+        stored['machine'] = machine_info()
+        stored['results'] = dict(stored.get('results', {}), **results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"\n[Bench] Baseline guardado en {args.baseline}")
+        return 0
+
+    if not stored:
+        if args.json:
+            save_results(args.json, results)
+        print(f"\n[Bench] No hay baseline en {args.baseline} (usar --save-baseline)")
+        return 0
+    if stored.get('machine') != machine_info():
+        print(f"\n[Bench] ATENCIÓN: el baseline es de otra máquina ({stored.get('machine')})")
+
+    regressions = compare(results, stored.get('results', {}), args.tolerance)
+    if regressions:
+        # Confirmar: un caso marcado se vuelve a medir y se queda el mejor tiempo,
+        # para no fallar por un pico de ruido del sistema
+        print("\n[Bench] Re-midiendo los casos marcados...")
+        for _ in range(RECHECK_ROUNDS):
+            for key, _, _, _ in regressions:
+                name, n = key[:-1].split('[')
+                results[key] = min(results[key], measure(CASES[name](int(n)), repeat=args.repeat))
+            regressions = compare({key: results[key] for key, _, _, _ in regressions},
+                                  stored.get('results', {}), args.tolerance)
+            if not regressions:
+                break
+    if args.json:
+        save_results(args.json, results)
+    if regressions:
+        print(f"\n[Bench] {len(regressions)} regresión(es) sobre la tolerancia de {args.tolerance:.0%}")
+        return 1
+    print("\n[Bench] Sin regresiones")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,378 @@
+"""
+CiberMonday - Utilidades compartidas por los benchmarks
+Cliente HTTP asyncio mínimo, arranque de servidores locales (Flask o el
+servidor de Android) y muestreo de CPU/RSS de un proceso.
+Solo usa la biblioteca estándar (psutil es opcional).
+"""
+
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANDROID_PYTHON = os.path.join(ROOT, 'android', 'app', 'src', 'main', 'python')
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+
+# ==================== HTTP ====================
+
+def _decode_chunked(body):
+    """Decodifica un body con Transfer-Encoding: chunked."""
+    result = b''
+    while body:
+        size_line, _, body = body.partition(b'\r\n')
+        size = int(size_line.split(b';')[0] or b'0', 16)
+        if size == 0:
+            break
+        result += body[:size]
+        body = body[size + 2:]
+    return result
+
+
+async def http_request(host, port, method, path, body=None, timeout=10, headers=None):
+    """
+    Hace UN request HTTP/1.1 con una conexión nueva (igual que el cliente real,
+    que usa requests sin Session).
+
+    Args:
+        body: objeto a mandar como JSON, o bytes que se mandan tal cual
+        headers: dict de headers extra
+
+    Returns:
+        (status, data) con data ya parseado como JSON (None si no es JSON)
+    """
+    if isinstance(body, bytes):
+        payload = body
+    else:
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    extra = ''.join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        head = (f"{method} {path} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                f"Connection: close\r\n"
+                f"Content-Type: application/json\r\n"
+                f"{extra}"
+                f"Content-Length: {len(payload)}\r\n\r\n")
+        writer.write(head.encode('utf-8') + payload)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+
+    header_block, _, data = raw.partition(b'\r\n\r\n')
+    lines = header_block.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        data = _decode_chunked(data)
+    try:
+        return status, json.loads(data.decode('utf-8')) if data else None
+    except ValueError:
+        return status, None
+
+
+async def read_http_request(reader):
+    """
+    Lee un request HTTP de un StreamReader (servidores falsos de los benchmarks).
+
+    Returns:
+        (method, path, data) o None si la conexión se cerró
+    """
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    content_length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            content_length = int(value.strip())
+    body = await reader.readexactly(content_length) if content_length else b''
+    try:
+        data = json.loads(body.decode('utf-8')) if body else None
+    except ValueError:
+        data = None
+    return method, path, data
+
+
+async def write_json_response(writer, data, status=200):
+    """Escribe una respuesta JSON y cierra la conexión."""
+    payload = json.dumps(data).encode('utf-8')
+    writer.write((f"HTTP/1.1 {status} OK\r\n"
+                  f"Content-Type: application/json\r\n"
+                  f"Content-Length: {len(payload)}\r\n"
+                  f"Connection: close\r\n\r\n").encode('ascii') + payload)
+    await writer.drain()
+    writer.close()
+
+
+def get_json(url, timeout=5, headers=None):
+    """GET sincrónico que devuelve el JSON de la respuesta."""
+    request = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+# ==================== ESTADÍSTICAS ====================
+
+def percentile(values, p):
+    """Percentil p (0-100) por vecino más cercano. None si no hay valores."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def fmt_ms(seconds):
+    """Formatea segundos como milisegundos para las tablas."""
+    return '-' if seconds is None else f"{seconds * 1000:.1f}"
+
+
+# ==================== TRÁFICO HTTP ====================
+
+# Ruta que expone los contadores (no se cuenta a sí misma)
+TRAFFIC_PATH = '/__traffic'
+# Header de los requests del propio benchmark (sondeos): no se cuentan
+BENCH_PROBE_HEADER = 'X-Bench-Probe'
+
+_CLIENT_PATH = re.compile(r'^/api/client/[^/]+')
+
+
+def _traffic_origin(environ):
+    """Quién hizo el request: el cliente usa requests, los servidores urllib."""
+    agent = environ.get('HTTP_USER_AGENT', '')
+    if agent.startswith('python-requests'):
+        return 'cliente'
+    if agent.startswith('Python-urllib'):
+        return 'servidor'
+    return 'otro'
+
+
+def install_flask_traffic_counter():
+    """
+    Cuenta requests y bytes (headers + body, ida y vuelta) de cada app Flask del
+    proceso, por origen y ruta, y los expone en GET TRAFFIC_PATH.
+    Se instala antes de importar server/app.py (ver ServerProcess(traffic=True)).
+    """
+    import threading
+    import flask
+
+    lock = threading.Lock()
+    counts = {}
+    original_wsgi_app = flask.Flask.wsgi_app
+
+    def wsgi_app(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == TRAFFIC_PATH:
+            with lock:
+                payload = json.dumps(counts).encode('utf-8')
+            start_response('200 OK', [('Content-Type', 'application/json'),
+                                      ('Content-Length', str(len(payload)))])
+            return [payload]
+        if environ.get('HTTP_' + BENCH_PROBE_HEADER.upper().replace('-', '_')):
+            return original_wsgi_app(self, environ, start_response)
+
+        key = f"{_traffic_origin(environ)} {environ.get('REQUEST_METHOD')} {_CLIENT_PATH.sub('/api/client/<id>', path)}"
+        bytes_in = len(environ.get('REQUEST_METHOD', '')) + len(path) + 12
+        bytes_in += sum(len(name) - 5 + len(value) + 4 for name, value in environ.items()
+                        if name.startswith('HTTP_'))
+        bytes_in += int(environ.get('CONTENT_LENGTH') or 0)
+        head = [0]
+
+        def counting_start_response(status, headers, exc_info=None):
+            head[0] = len(status) + 11 + sum(len(n) + len(v) + 4 for n, v in headers)
+            return start_response(status, headers, exc_info)
+
+        def counted(body):
+            sent = 0
+            try:
+                for chunk in body:
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+                with lock:
+                    entry = counts.setdefault(key, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0})
+                    entry['requests'] += 1
+                    entry['bytes_in'] += bytes_in
+                    entry['bytes_out'] += head[0] + sent
+
+        return counted(original_wsgi_app(self, environ, counting_start_response))
+
+    flask.Flask.wsgi_app = wsgi_app
+
+
+def diff_traffic(after, before):
+    """Contadores de after menos los de before (misma forma que TRAFFIC_PATH)."""
+    result = {}
+    for key, entry in after.items():
+        previous = before.get(key, {})
+        delta = {name: value - previous.get(name, 0) for name, value in entry.items()}
+        if delta['requests']:
+            result[key] = delta
+    return result
+
+
+# ==================== SERVIDORES LOCALES ====================
+
+# Arranque del servidor de Android fuera de Android: el mismo módulo que usa la app
+_ANDROID_BOOT = (
+    "import sys; sys.path[:0] = [sys.argv[3], sys.argv[4]]; "
+    "import cibermonday_android as a; a.start_server(sys.argv[1], int(sys.argv[2]))"
+)
+
+# server/app.py tal cual, con el contador de tráfico instalado antes
+_FLASK_TRAFFIC_BOOT = (
+    "import sys, runpy; sys.path.insert(0, sys.argv[1]); "
+    "import common; common.install_flask_traffic_counter(); "
+    "runpy.run_path(sys.argv[2], run_name='__main__')"
+)
+
+
+class ServerProcess:
+    """
+    Servidor CiberMonday en un subproceso: 'flask' (server/app.py) o 'android'
+    (CiberMondayHandler de cibermonday_android.py).
+
+    Con traffic=True (solo flask) el servidor cuenta su tráfico HTTP entrante
+    en GET /__traffic (ver install_flask_traffic_counter).
+    """
+
+    KINDS = ('flask', 'android')
+
+    def __init__(self, kind='flask', port=5000, host='127.0.0.1', log_path=None, env=None,
+                 traffic=False):
+        if kind not in self.KINDS:
+            raise ValueError(f"Tipo de servidor desconocido: {kind}")
+        if traffic and kind != 'flask':
+            raise ValueError("El contador de tráfico solo está disponible para el servidor flask")
+        self.kind = kind
+        self.port = port
+        self.host = host
+        self.log_path = log_path
+        self.env = env or {}
+        self.traffic = traffic
+        self.process = None
+        self._log = None
+
+    @property
+    def url(self):
+        host = '127.0.0.1' if self.host == '0.0.0.0' else self.host
+        return f"http://{host}:{self.port}"
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def start(self, timeout=20):
+        """Arranca el servidor y espera a que /api/health responda."""
+        # Sin cola de comandos en disco: cada corrida arranca limpia (env= puede activarla)
+        env = dict(os.environ, HOST=self.host, PORT=str(self.port), PYTHONUNBUFFERED='1',
+                   CIBERMONDAY_COMMANDS_FILE='off')
+        env.update(self.env)
+        if self.kind == 'flask' and self.traffic:
+            cmd = [sys.executable, '-c', _FLASK_TRAFFIC_BOOT,
+                   os.path.dirname(os.path.abspath(__file__)), os.path.join(ROOT, 'server', 'app.py')]
+        elif self.kind == 'flask':
+            cmd = [sys.executable, os.path.join(ROOT, 'server', 'app.py')]
+        else:
+            cmd = [sys.executable, '-c', _ANDROID_BOOT, self.host, str(self.port), ROOT, ANDROID_PYTHON]
+        self._log = open(self.log_path, 'w') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen(cmd, env=env, cwd=ROOT,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"El servidor {self.kind} terminó al arrancar (código {self.process.returncode})")
+            try:
+                get_json(f"{self.url}/api/health", timeout=1)
+                return self
+            except Exception:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"El servidor {self.kind} no respondió en {timeout}s")
+
+    def stop(self):
+        """Detiene el servidor (SIGTERM y, si no termina, SIGKILL)."""
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+        self.process = None
+
+    def kill(self):
+        """Mata el servidor sin aviso (simula una caída)."""
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.stop()
+
+
+class ProcessSampler:
+    """CPU y memoria residente de un proceso (psutil o /proc en Linux)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._proc = psutil.Process(pid) if (PSUTIL_AVAILABLE and pid) else None
+        self._last = None
+
+    def _read(self):
+        """(segundos de CPU, RSS en bytes) o None si no se puede medir."""
+        if not self.pid:
+            return None
+        try:
+            if self._proc:
+                cpu = self._proc.cpu_times()
+                return cpu.user + cpu.system, self._proc.memory_info().rss
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = os.sysconf('SC_CLK_TCK')
+            cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+            rss = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+            return cpu_seconds, rss
+        except Exception:
+            return None
+
+    def sample(self):
+        """
+        Uso desde la muestra anterior.
+
+        Returns:
+            dict con cpu_percent (None en la primera muestra) y rss_mb, o None
+        """
+        now = time.time()
+        reading = self._read()
+        if reading is None:
+            return None
+        cpu_seconds, rss = reading
+        cpu_percent = None
+        if self._last:
+            last_time, last_cpu = self._last
+            if now > last_time:
+                cpu_percent = round((cpu_seconds - last_cpu) / (now - last_time) * 100, 1)
+        self._last = (now, cpu_seconds)
+        return {'cpu_percent': cpu_percent, 'rss_mb': round(rss / (1024 * 1024), 1)}
@@ -0,0 +1,321 @@
+"""
+CiberMonday - Latencia de punta a punta: acción del admin → PC
+
+Mide lo que le importa al cibercafé: cuánto pasa desde que el admin aprieta
+"Detener" o asigna tiempo hasta que la PC lo refleja. Corre en localhost el
+servidor (Flask o Android), un cliente real sin Windows (headless_client: registro
+en memoria, bloqueo registrado) y los caminos push → cola de comandos → sync.
+
+Escenarios:
+    set-time            asignar tiempo → sesión nueva en el registro del cliente
+    stop                detener → sesión borrada del registro del cliente
+    expire              vencimiento del countdown → lock_workstation (monitor_time).
+                        Puede ser negativa: el cliente trunca los segundos restantes
+                        y bloquea cuando queda menos de 1s.
+    set-time-push-fail  como set-time, con el push descartado por el cliente
+    stop-push-fail      como stop, con el push descartado por el cliente
+
+Con el push descartado el comando queda en la cola del servidor y llega con el
+siguiente /status del SyncManager: la latencia pasa a depender de sync_interval.
+Con --servers N > 1 también se mide cuándo TODOS los servidores ven el cambio.
+
+Uso:
+    python benchmarks/e2e_latency.py
+    python benchmarks/e2e_latency.py --trials 50 --sync-interval 10 --json e2e.json
+    python benchmarks/e2e_latency.py --server-kind android --servers 2
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import ROOT, ServerProcess, get_json, percentile, fmt_ms
+
+SCENARIOS = ('set-time', 'stop', 'expire', 'set-time-push-fail', 'stop-push-fail')
+
+# Espera para que monitor_time vea la sesión activa antes de simular el vencimiento
+EXPIRE_SETTLE_SECONDS = 1.5
+
+# Los push del admin que el cliente debe descartar en los escenarios *-push-fail
+_PUSH_HANDLERS = ('_handle_push_session', '_handle_push_stop')
+
+
+def post_json(url, body, timeout=5):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def local_ip():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from core import ClientManager
+    return ClientManager.get_local_ip()
+
+
+class Harness:
+    """Servidores + cliente headless + inyección de fallas de push."""
+
+    def __init__(self, args):
+        self.args = args
+        self.servers = []
+        self.client = None
+        self.fail_pushes = threading.Event()
+        self.pushes_dropped = 0
+        self._time_limit = 0
+
+    # ==================== ARRANQUE ====================
+
+    def start(self):
+        args = self.args
+        # Con varios servidores escuchan en todas las interfaces: se conocen y
+        # replican por la IP local, igual que en la red del cibercafé
+        host = '0.0.0.0' if args.servers > 1 else '127.0.0.1'
+        for i in range(args.servers):
+            log_path = f"{args.server_log}.{i}" if args.server_log else None
+            server = ServerProcess(args.server_kind, port=args.port + i, host=host, log_path=log_path)
+            self.servers.append(server.start())
+        if args.servers > 1:
+            ip = local_ip()
+            urls = [f"http://{ip}:{s.port}" for s in self.servers]
+            for server in self.servers:
+                for url, peer in zip(urls, self.servers):
+                    if peer is not server:
+                        post_json(f"{server.url}/api/register-server",
+                                  {'url': url, 'ip': ip, 'port': peer.port})
+            client_server_url = urls[0]
+        else:
+            client_server_url = self.servers[0].url
+
+        import headless_client
+        self.client = headless_client.load(client_server_url, sync_interval=args.sync_interval,
+                                           quiet=not args.verbose)
+        self._install_push_fault()
+        self.client.start()
+        # Esperar a que todos los servidores conozcan al cliente
+        deadline = time.time() + 30
+        while time.time() < deadline and not all(self._server_status(s) for s in self.servers):
+            time.sleep(0.2)
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.stop()
+
+    def _install_push_fault(self):
+        """Los push de sesión/stop responden 503 mientras fail_pushes esté activo."""
+        handler_class = self.client.module.DiagnosticHandler
+        harness = self
+
+        def failing(original):
+            def handler(self):
+                if harness.fail_pushes.is_set():
+                    self._read_post_data()
+                    harness.pushes_dropped += 1
+                    self._send_json({'success': False, 'message': 'Push descartado (benchmark)'}, 503)
+                    return
+                return original(self)
+            return handler
+
+        for name in _PUSH_HANDLERS:
+            setattr(handler_class, name, failing(getattr(handler_class, name)))
+
+    # ==================== OBSERVACIÓN ====================
+
+    def _server_status(self, server):
+        try:
+            return get_json(f"{server.url}/api/client/{self.client.client_id}/status", timeout=2)['client']
+        except Exception:
+            return None
+
+    def _watch_servers(self, predicate, result):
+        """En background: guarda en result el momento en que todos los servidores cumplen predicate."""
+        def watch():
+            deadline = time.time() + self.args.timeout
+            while time.time() < deadline:
+                states = [self._server_status(s) for s in self.servers]
+                if all(state and predicate(state.get('session')) for state in states):
+                    result.append(time.time())
+                    return
+                time.sleep(0.01)
+        thread = threading.Thread(target=watch, daemon=True)
+        thread.start()
+        return thread
+
+    def _admin(self, action, body=None):
+        return post_json(f"{self.servers[0].url}/api/client/{self.client.client_id}/{action}", body or {})
+
+    def _next_time_limit(self):
+        # Un time_limit distinto en cada prueba para reconocer la sesión nueva
+        self._time_limit = self._time_limit % 50 + 1
+        return 10 + self._time_limit
+
+    def _ensure_session(self):
+        """Precondición (no medida): el cliente tiene una sesión activa."""
+        session = self.client.session()
+        if session and datetime_in_future(session.get('end_time')):
+            return True
+        minutes = self._next_time_limit()
+        self._admin('set-time', {'time': minutes, 'unit': 'minutes'})
+        return self.client.registry.wait_for(
+            lambda: (self.client.session() or {}).get('time_limit_seconds') == minutes * 60,
+            self.args.timeout) is not None
+
+    # ==================== ESCENARIOS ====================
+
+    def trial(self, scenario):
+        """
+        Una prueba del escenario.
+
+        Returns:
+            dict con client (latencia hasta el cliente) y servers (hasta que todos
+            los servidores lo ven, solo con varios servidores); None = timeout
+        """
+        push_fail = scenario.endswith('-push-fail')
+        action = scenario.replace('-push-fail', '')
+        client = self.client
+        multi = len(self.servers) > 1
+
+        if action in ('stop', 'expire') and not self._ensure_session():
+            return {'client': None, 'servers': None}
+
+        if action == 'expire':
+            # monitor_time solo bloquea si antes vio la sesión activa: dejar pasar
+            # un chequeo local (1s) y simular que el countdown llega a cero en 2s
+            time.sleep(EXPIRE_SETTLE_SECONDS)
+            session = client.session()
+            deadline = time.time() + 2
+            locks_before = len(client.locks)
+            client.module.save_session_to_registry(
+                time_limit_seconds=session['time_limit_seconds'],
+                start_time_iso=session['start_time'],
+                end_time_iso=datetime.fromtimestamp(deadline).isoformat())
+            locked_at = client.registry.wait_for(lambda: len(client.locks) > locks_before,
+                                                 self.args.timeout)
+            return {'client': locked_at - deadline if locked_at else None, 'servers': None}
+
+        if action == 'set-time':
+            minutes = self._next_time_limit()
+            expected = minutes * 60
+            applied = lambda: (client.session() or {}).get('time_limit_seconds') == expected
+            server_applied = lambda s: bool(s) and s.get('time_limit_seconds') == expected
+            body = {'time': minutes, 'unit': 'minutes'}
+        else:
+            applied = lambda: client.session() is None
+            server_applied = lambda s: s is None
+            body = {}
+
+        if push_fail:
+            self.fail_pushes.set()
+        converged = []
+        try:
+            started = time.time()
+            watcher = self._watch_servers(server_applied, converged) if multi else None
+            self._admin(action, body)
+            applied_at = client.registry.wait_for(applied, self.args.timeout)
+            if watcher:
+                watcher.join(self.args.timeout)
+        finally:
+            self.fail_pushes.clear()
+        return {
+            'client': applied_at - started if applied_at else None,
+            'servers': converged[0] - started if converged else None
+        }
+
+
+def datetime_in_future(iso_time):
+    try:
+        return datetime.fromisoformat(iso_time) > datetime.now()
+    except (TypeError, ValueError):
+        return False
+
+
+def summarize(values):
+    done = [v for v in values if v is not None]
+    return {
+        'trials': len(values),
+        'timeouts': len(values) - len(done),
+        'p50': percentile(done, 50),
+        'p90': percentile(done, 90),
+        'p99': percentile(done, 99),
+        'max': max(done) if done else None
+    }
+
+
+def run(args):
+    harness = Harness(args).start()
+    results = {}
+    try:
+        multi = args.servers > 1
+        print(f"[E2E] Servidor {args.server_kind} x{args.servers} | cliente {harness.client.client_id[:8]}... | "
+              f"sync_interval {args.sync_interval}s | {args.trials} pruebas por escenario")
+        header = f"{'escenario':<20} {'n':>4} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'timeouts':>8}"
+        if multi:
+            header += f" {'servers p50':>12} {'servers p99':>12}"
+        print(header)
+        for scenario in args.scenarios:
+            samples = []
+            for _ in range(args.trials):
+                samples.append(harness.trial(scenario))
+                # Separar las pruebas una fracción al azar de sync_interval, para no
+                # quedar en fase con el ciclo de sincronización
+                time.sleep(random.uniform(0.05, args.sync_interval if scenario.endswith('-push-fail') else 0.3))
+            client_stats = summarize([s['client'] for s in samples])
+            server_stats = summarize([s['servers'] for s in samples]) if multi else None
+            results[scenario] = {'client': client_stats, 'servers': server_stats}
+            line = (f"{scenario:<20} {client_stats['trials']:>4} {fmt_ms(client_stats['p50']):>9} "
+                    f"{fmt_ms(client_stats['p90']):>9} {fmt_ms(client_stats['p99']):>9} "
+                    f"{fmt_ms(client_stats['max']):>9} {client_stats['timeouts']:>8}")
+            if multi and scenario != 'expire':
+                line += f" {fmt_ms(server_stats['p50']):>12} {fmt_ms(server_stats['p99']):>12}"
+            print(line)
+        print(f"[E2E] Push descartados a propósito: {harness.pushes_dropped}")
+    finally:
+        harness.stop()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Latencia acción del admin → PC del cliente')
+    parser.add_argument('--server-kind', choices=ServerProcess.KINDS, default='flask')
+    parser.add_argument('--servers', type=int, default=1, help='Cantidad de servidores en malla')
+    parser.add_argument('--port', type=int, default=5061, help='Puerto del primer servidor')
+    parser.add_argument('--server-log', help='Prefijo de archivo para la salida de los servidores')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Escenarios separados por coma (default: todos: {','.join(SCENARIOS)})")
+    parser.add_argument('--trials', type=int, default=20, help='Pruebas por escenario')
+    parser.add_argument('--sync-interval', type=int, default=5, help='sync_interval del cliente (s)')
+    parser.add_argument('--timeout', type=float, default=30, help='Espera máxima por prueba (s)')
+    parser.add_argument('--verbose', action='store_true', help='Mostrar la salida del cliente')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'server_kind': args.server_kind, 'servers': args.servers,
+                       'sync_interval': args.sync_interval, 'results': results}, f, indent=2)
+        print(f"[E2E] Resultados guardados en {args.json}")
+    timeouts = sum(r['client']['timeouts'] for r in results.values())
+    return 1 if timeouts else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
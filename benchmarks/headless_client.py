@@ -0,0 +1,91 @@
+"""
+CiberMonday - Cliente Windows sin Windows (para benchmarks)
+
+Carga client/client.py en el proceso actual con el backend de plataforma
+simulado (CIBERMONDAY_BACKEND=sim, ver client/platform_backend.py): el registro
+es un archivo en un directorio temporal y lock_workstation queda registrado en
+vez de bloquear, así un benchmark puede medir cuándo se habría bloqueado la PC.
+
+Solo puede haber un cliente por proceso (client.py usa estado global). Para
+muchos clientes, lanzar `client/client.py --service` como procesos aparte.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_DIR = os.path.join(ROOT, 'client')
+
+
+class HeadlessClient:
+    """
+    client.py cargado con el backend simulado.
+
+    Attributes:
+        module: el módulo client ya importado
+        backend: SimBackend del proceso
+        registry: SimRegistry con los valores del registro (wait_for para esperar cambios)
+        locks: time.time() de cada llamada a lock_workstation
+    """
+
+    def __init__(self, module):
+        self.module = module
+        self.backend = module.backend
+        self.registry = self.backend.registry
+        self.locks = self.backend.locks
+        self.client_id = None
+
+    def session(self):
+        """Sesión guardada en el registro (None si no hay)."""
+        return self.module.get_session_from_registry()
+
+    def start(self):
+        """Obtiene el client_id (registrándose) y arranca monitor_time en un thread."""
+        self.client_id = self.module.get_client_id()
+        threading.Thread(target=self.module.monitor_time, args=(self.client_id,),
+                         daemon=True).start()
+        return self.client_id
+
+
+def load(server_url, sync_interval=5, quiet=True):
+    """
+    Importa client.py con el backend simulado y la config apuntando a server_url.
+
+    Args:
+        sync_interval: Intervalo de sincronización del SyncManager (s)
+        quiet: Descartar los print del cliente
+
+    Returns:
+        HeadlessClient (todavía sin arrancar)
+    """
+    if 'client' in sys.modules:
+        raise RuntimeError("client.py ya está cargado en este proceso")
+
+    os.environ['CIBERMONDAY_BACKEND'] = 'sim'
+    os.environ['CIBERMONDAY_SIM_DIR'] = tempfile.mkdtemp(prefix='cibermonday-bench-')
+    if CLIENT_DIR not in sys.path:
+        sys.path.insert(0, CLIENT_DIR)
+
+    from platform_backend import get_backend
+    registry = get_backend().registry
+    registry.SetValueEx(None, 'Config', 0, registry.REG_SZ, json.dumps({
+        'server_url': server_url, 'sync_interval': sync_interval, 'check_interval': 1}))
+
+    # Modo servicio: sin GUI de configuración
+    argv, sys.argv = sys.argv, ['service.py', '--service']
+    stdout = sys.stdout
+    try:
+        if quiet:
+            sys.stdout = open(os.devnull, 'w')
+        import client
+    finally:
+        sys.argv = argv
+    if quiet:
+        # Los print del cliente (threads incluidos) siguen descartándose
+        client.print = lambda *args, **kwargs: None
+        sys.modules['platform_backend'].print = client.print
+        sys.stdout = stdout
+    return HeadlessClient(client)
@@ -0,0 +1,420 @@
+"""
+CiberMonday - Generador de carga: flota sintética de clientes
+
+Levanta miles de clientes virtuales en un solo proceso (asyncio) que repiten el
+protocolo real del SyncManager contra un servidor local:
+
+    POST /api/register              (sesión, config y known_servers)
+    cada sync_interval:
+        GET  /api/health
+        GET  /api/client/<id>/status      (con ack/queue de la cola de comandos)
+        POST /api/client/<id>/report-session   (solo si difiere de la del servidor)
+        POST /api/client/<id>/config      (from_client)
+        POST /api/sync-servers
+
+Un puerto de diagnóstico falso (compartido por toda la flota) acepta los
+/api/push/* que el servidor envía a los clientes.
+
+Por cada tamaño de flota reporta RPS, latencia p50/p99, tasa de error y CPU/RSS
+del proceso servidor.
+
+Uso:
+    python benchmarks/load_fleet.py --spawn flask --sizes 100,500,1000
+    python benchmarks/load_fleet.py --spawn android --sizes 1000 --duration 60
+    python benchmarks/load_fleet.py --server http://127.0.0.1:5000 --server-pid 1234
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (ServerProcess, ProcessSampler, http_request, read_http_request,
+                    write_json_response, percentile, fmt_ms)
+
+
+class FleetStats:
+    """Latencias y errores por endpoint dentro de una ventana de medición."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.pushes = collections.Counter()
+
+    def record(self, endpoint, seconds, ok):
+        self.latencies[endpoint].append(seconds)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def summary(self):
+        """Totales de la ventana actual."""
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        all_latencies = [s for values in self.latencies.values() for s in values]
+        total = len(all_latencies)
+        errors = sum(self.errors.values())
+        return {
+            'elapsed': round(elapsed, 2),
+            'requests': total,
+            'rps': round(total / elapsed, 1),
+            'p50': percentile(all_latencies, 50),
+            'p99': percentile(all_latencies, 99),
+            'error_rate': round(errors / total * 100, 2) if total else 0.0,
+            'pushes': sum(self.pushes.values()),
+            'endpoints': {
+                endpoint: {
+                    'requests': len(values),
+                    'p50': percentile(values, 50),
+                    'p99': percentile(values, 99),
+                    'errors': self.errors[endpoint]
+                }
+                for endpoint, values in sorted(self.latencies.items())
+            }
+        }
+
+
+class Fleet:
+    """Estado compartido por los clientes virtuales: servidor, límites y métricas."""
+
+    def __init__(self, server_url, sync_interval, active_ratio, max_concurrency, timeout):
+        parsed = urlparse(server_url)
+        self.server_url = server_url.rstrip('/')
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.sync_interval = sync_interval
+        self.active_ratio = active_ratio
+        self.timeout = timeout
+        self.push_port = None
+        self.stats = FleetStats()
+        self.clients = []
+        self.stop_event = asyncio.Event()
+        # Límite de conexiones simultáneas (descriptores de archivo del generador)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def request(self, endpoint, method, path, body=None):
+        """
+        Request al servidor registrado en las métricas bajo `endpoint`.
+        La latencia se mide desde que se obtiene un slot de conexión.
+
+        Returns:
+            (status, data); status 0 si hubo error de conexión o timeout
+        """
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                status, data = await http_request(self.host, self.port, method, path,
+                                                  body, timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                status, data = 0, None
+            # 404 de /status es parte del protocolo (el cliente se re-registra)
+            ok = 200 <= status < 300 or (status == 404 and endpoint == 'status')
+            self.stats.record(endpoint, time.perf_counter() - started, ok)
+            return status, data
+
+    # ==================== PUERTO DE DIAGNÓSTICO FALSO ====================
+
+    async def _handle_push(self, reader, writer):
+        try:
+            request = await read_http_request(reader)
+            if request is None:
+                writer.close()
+                return
+            method, path, _ = request
+            if method == 'POST' and path.startswith('/api/push/'):
+                self.stats.pushes[path.rsplit('/', 1)[1]] += 1
+                await write_json_response(writer, {'success': True})
+            else:
+                await write_json_response(writer, {'success': False, 'message': 'Not found'}, 404)
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            writer.close()
+
+    async def start_push_server(self, port=0):
+        """Escucha los /api/push/* del servidor. port=0 elige uno libre."""
+        server = await asyncio.start_server(self._handle_push, '127.0.0.1', port, backlog=1024)
+        self.push_port = server.sockets[0].getsockname()[1]
+        return server
+
+
+class VirtualClient:
+    """
+    Un cliente CiberMonday emulado. Guarda en memoria lo que el cliente real
+    guarda en el registro: sesión, config, versiones y el ack de la cola de comandos.
+    """
+
+    def __init__(self, fleet, index):
+        self.fleet = fleet
+        self.index = index
+        self.name = f"vpc-{index:05d}"
+        self.client_id = None
+        self.session = None  # {'time_limit_seconds', 'end_ts', 'version'}
+        # El servidor exige sync_interval >= 5; el ciclo real puede ser más corto
+        self.config = {'sync_interval': max(5, int(fleet.sync_interval)),
+                       'alert_thresholds': [600, 300, 120, 60],
+                       'custom_name': self.name}
+        self.config_version = None
+        self.command_seq = None
+        self.command_queue = None
+        if random.random() < fleet.active_ratio:
+            time_limit = random.choice([1800, 3600, 7200])
+            self.session = {'time_limit_seconds': time_limit,
+                            'end_ts': time.time() + random.randint(60, time_limit),
+                            'version': None}
+
+    # ==================== PAYLOADS ====================
+
+    def _session_payload(self):
+        if not self.session:
+            return None
+        return {
+            'remaining_seconds': max(0, int(self.session['end_ts'] - time.time())),
+            'time_limit_seconds': self.session['time_limit_seconds'],
+            'end_ts': self.session['end_ts'],
+            'version': self.session['version']
+        }
+
+    def _config_payload(self):
+        return dict(self.config, version=self.config_version)
+
+    def _known_servers(self):
+        return [{'url': self.fleet.server_url, 'ip': self.fleet.host, 'port': self.fleet.port}]
+
+    # ==================== PROTOCOLO ====================
+
+    async def register(self):
+        body = {
+            'name': self.name,
+            'client_id': self.client_id,
+            'client_ip': '127.0.0.1',
+            'diagnostic_port': self.fleet.push_port,
+            'config': self._config_payload(),
+            'known_servers': self._known_servers()
+        }
+        session = self._session_payload()
+        if session:
+            body['session'] = session
+        status, data = await self.fleet.request('register', 'POST', '/api/register', body)
+        if status == 201 and data and data.get('success'):
+            self.client_id = data['client_id']
+            return True
+        return False
+
+    def _apply_commands(self, client_info):
+        """Aplica los comandos pendientes en orden, como apply_server_commands."""
+        queue_id = client_info.get('command_queue')
+        if queue_id and queue_id != self.command_queue:
+            self.command_queue, self.command_seq = queue_id, 0
+        for command in client_info.get('commands') or []:
+            if command['seq'] <= (self.command_seq or 0):
+                continue
+            data = command.get('data') or {}
+            if command['type'] == 'session':
+                self.session = {'time_limit_seconds': data.get('time_limit_seconds', 0),
+                                'end_ts': data.get('end_ts') or time.time() + data.get('remaining_seconds', 0),
+                                'version': data.get('version')}
+            elif command['type'] in ('stop', 'lock'):
+                self.session = None
+            elif command['type'] == 'config':
+                self.config.update({k: data[k] for k in self.config if k in data})
+                self.config_version = data.get('version')
+            self.command_seq = command['seq']
+
+    def _session_matches(self, server_session):
+        """Mismo criterio que server_session_matches del cliente real."""
+        if not self.session:
+            return server_session is None
+        if not server_session:
+            return False
+        return (server_session.get('time_limit_seconds') == self.session['time_limit_seconds']
+                and abs((server_session.get('end_ts') or 0) - self.session['end_ts']) <= 2)
+
+    async def cycle(self):
+        """Un ciclo de sincronización del SyncManager."""
+        fleet = self.fleet
+        status, _ = await fleet.request('health', 'GET', '/api/health')
+        if status != 200:
+            return
+
+        path = f"/api/client/{self.client_id}/status"
+        if self.command_queue:
+            path += f"?ack={self.command_seq or 0}&queue={self.command_queue}"
+        status, data = await fleet.request('status', 'GET', path)
+        if status == 404:
+            await self.register()
+            return
+        if status != 200 or not data:
+            return
+        client_info = data.get('client') or {}
+        self._apply_commands(client_info)
+
+        server_session = client_info.get('session')
+        if server_session and self.session:
+            self.session['version'] = server_session.get('version', self.session['version'])
+        session = self._session_payload()
+        if session and not self._session_matches(server_session):
+            status, result = await fleet.request(
+                'report-session', 'POST', f"/api/client/{self.client_id}/report-session", session)
+            if status == 200 and result:
+                if result.get('lock'):
+                    self.session = None
+                elif result.get('stale'):
+                    self.session = None
+                    if result.get('session'):
+                        self.session = {'time_limit_seconds': result['session'].get('time_limit_seconds', 0),
+                                        'end_ts': result['session'].get('end_ts'),
+                                        'version': result.get('version')}
+
+        status, result = await fleet.request(
+            'config', 'POST', f"/api/client/{self.client_id}/config",
+            dict(self._config_payload(), from_client=True))
+        if status == 200 and result and result.get('stale'):
+            self.config_version = result.get('version')
+
+        await fleet.request('sync-servers', 'POST', '/api/sync-servers',
+                            {'servers': self._known_servers()})
+
+    async def run(self):
+        """Registro y ciclos cada sync_interval (con arranque escalonado)."""
+        fleet = self.fleet
+        await asyncio.sleep(random.uniform(0, fleet.sync_interval))
+        while not fleet.stop_event.is_set() and not self.client_id:
+            if not await self.register():
+                await asyncio.sleep(fleet.sync_interval)
+        while not fleet.stop_event.is_set():
+            started = time.monotonic()
+            await self.cycle()
+            elapsed = time.monotonic() - started
+            try:
+                await asyncio.wait_for(fleet.stop_event.wait(),
+                                       max(0.0, fleet.sync_interval - elapsed))
+            except asyncio.TimeoutError:
+                pass
+
+
+async def admin_loop(fleet, rate):
+    """Acciones del admin (set-time / stop) a `rate` por segundo para generar pushes."""
+    while not fleet.stop_event.is_set():
+        registered = [c for c in fleet.clients if c.client_id]
+        if registered:
+            client = random.choice(registered)
+            if random.random() < 0.8:
+                await fleet.request('admin', 'POST', f"/api/client/{client.client_id}/set-time",
+                                    {'time': random.choice([15, 30, 60]), 'unit': 'minutes'})
+            else:
+                await fleet.request('admin', 'POST', f"/api/client/{client.client_id}/stop", {})
+        try:
+            await asyncio.wait_for(fleet.stop_event.wait(), 1.0 / rate)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_fleet(args, server_pid):
+    fleet = Fleet(args.server, args.sync_interval, args.active_ratio,
+                  args.max_concurrency, args.timeout)
+    push_server = await fleet.start_push_server(args.push_port)
+    sampler = ProcessSampler(server_pid)
+    tasks = []
+    if args.admin_rate > 0:
+        tasks.append(asyncio.create_task(admin_loop(fleet, args.admin_rate)))
+
+    results = []
+    print(f"[Fleet] Servidor: {fleet.server_url} | push: 127.0.0.1:{fleet.push_port} | "
+          f"sync_interval: {args.sync_interval}s")
+    print(f"{'flota':>7} {'requests':>9} {'rps':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'err %':>6} {'cpu %':>6} {'rss MB':>7} {'pushes':>7}")
+    try:
+        for size in args.sizes:
+            # La flota crece: los clientes de pasos anteriores siguen corriendo
+            while len(fleet.clients) < size:
+                client = VirtualClient(fleet, len(fleet.clients))
+                fleet.clients.append(client)
+                tasks.append(asyncio.create_task(client.run()))
+            # Calentamiento: un sync_interval para que los nuevos se registren
+            await asyncio.sleep(args.sync_interval)
+            fleet.stats.reset()
+            sampler.sample()
+            await asyncio.sleep(args.duration)
+            summary = fleet.stats.summary()
+            usage = sampler.sample() or {}
+            summary.update(fleet_size=size,
+                           registered=sum(1 for c in fleet.clients if c.client_id),
+                           cpu_percent=usage.get('cpu_percent'),
+                           rss_mb=usage.get('rss_mb'))
+            results.append(summary)
+            print(f"{size:>7} {summary['requests']:>9} {summary['rps']:>8} "
+                  f"{fmt_ms(summary['p50']):>8} {fmt_ms(summary['p99']):>8} "
+                  f"{summary['error_rate']:>6} {str(summary['cpu_percent'] or '-'):>6} "
+                  f"{str(summary['rss_mb'] or '-'):>7} {summary['pushes']:>7}")
+    finally:
+        fleet.stop_event.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        push_server.close()
+        await push_server.wait_closed()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Flota sintética de clientes CiberMonday')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--server', help='URL de un servidor ya corriendo (ej: http://127.0.0.1:5000)')
+    target.add_argument('--spawn', choices=ServerProcess.KINDS,
+                        help='Arrancar un servidor local: flask (server/app.py) o android')
+    parser.add_argument('--port', type=int, default=5055, help='Puerto del servidor con --spawn')
+    parser.add_argument('--server-pid', type=int, help='PID del servidor para medir CPU/RSS (con --server)')
+    parser.add_argument('--server-log', help='Archivo para la salida del servidor con --spawn')
+    parser.add_argument('--sizes', default='100,500,1000',
+                        help='Tamaños de flota separados por coma (default: 100,500,1000)')
+    parser.add_argument('--duration', type=float, default=30, help='Segundos de medición por tamaño')
+    parser.add_argument('--sync-interval', type=float, default=30, help='sync_interval de los clientes')
+    parser.add_argument('--active-ratio', type=float, default=0.6,
+                        help='Fracción de clientes con sesión activa (default: 0.6)')
+    parser.add_argument('--admin-rate', type=float, default=0,
+                        help='Acciones de admin por segundo (set-time/stop) para generar pushes')
+    parser.add_argument('--max-concurrency', type=int, default=256,
+                        help='Conexiones simultáneas máximas del generador')
+    parser.add_argument('--timeout', type=float, default=10, help='Timeout por request (s)')
+    parser.add_argument('--push-port', type=int, default=0, help='Puerto de diagnóstico falso (0 = libre)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args(argv)
+    args.sizes = sorted(int(s) for s in args.sizes.split(',') if s.strip())
+    if not args.server and not args.spawn:
+        args.spawn = 'flask'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        server = ServerProcess(args.spawn, port=args.port, log_path=args.server_log).start()
+        args.server = server.url
+        server_pid = server.pid
+        print(f"[Fleet] Servidor {args.spawn} arrancado (pid {server_pid})")
+    try:
+        results = asyncio.run(run_fleet(args, server_pid))
+    except KeyboardInterrupt:
+        results = []
+    finally:
+        if server:
+            server.stop()
+
+    if args.json and results:
+        with open(args.json, 'w') as f:
+            json.dump({'server': args.spawn or args.server, 'sync_interval': args.sync_interval,
+                       'results': results}, f, indent=2)
+        print(f"[Fleet] Resultados guardados en {args.json}")
+    return 0 if results and all(r['error_rate'] < 1 for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
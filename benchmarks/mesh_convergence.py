@@ -0,0 +1,470 @@
+"""
+CiberMonday - Convergencia de la malla de descubrimiento
+
+Levanta N servidores locales (puertos distintos) y M clientes reales con el
+backend simulado (client/client.py, CIBERMONDAY_BACKEND=sim) y mide:
+
+- Cuánto tarda la malla en cerrarse: cada servidor conoce a todos los
+  servidores y a todos los clientes, y cada cliente conoce a todos los servidores
+  (anuncios UDP, probes, /api/register-server, /api/sync-servers, replicación).
+- Cuántos mensajes y bytes costó: HTTP entrante de cada servidor (contado en el
+  propio servidor, por origen y ruta) y UDP de descubrimiento (test_broadcast.py).
+- Estabilidad tras matar un servidor (por defecto el líder): tiempo hasta que los
+  sobrevivientes acuerdan un líder nuevo, clientes que siguen conectados y tráfico
+  por segundo antes y después de la caída.
+
+Cada cliente usa su propio puerto de descubrimiento, así recibe las ofertas
+unicast de sus probes; los anuncios de los servidores (puerto 5001) se cuentan
+pero ningún cliente los escucha. En una LAN real cada PC tiene su IP.
+
+Uso:
+    python benchmarks/mesh_convergence.py                           # 3 servidores, 5 clientes
+    python benchmarks/mesh_convergence.py --servers 5 --clients 50 --seed round-robin
+    python benchmarks/mesh_convergence.py --kill follower --stability 60 --json malla.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import (ROOT, BENCH_PROBE_HEADER, TRAFFIC_PATH, ServerProcess, diff_traffic,
+                    get_json, percentile)
+
+sys.path.insert(0, ROOT)
+
+from core import ClientManager
+from test_broadcast import DiscoveryTrafficCounter
+
+PROBE_HEADERS = {BENCH_PROBE_HEADER: '1'}
+CLIENT_SCRIPT = os.path.join(ROOT, 'client', 'client.py')
+
+MILESTONES = ('servidores se conocen', 'servidores conocen clientes',
+              'clientes conocen servidores', 'malla completa')
+
+
+class SimClient:
+    """client/client.py --service con el backend simulado, en un subproceso."""
+
+    def __init__(self, index, server_url, diagnostic_port, discovery_port, sync_interval,
+                 data_dir, log_path=None):
+        self.index = index
+        self.server_url = server_url
+        self.diagnostic_port = diagnostic_port
+        self.discovery_port = discovery_port
+        self.sync_interval = sync_interval
+        self.data_dir = data_dir
+        self.log_path = log_path
+        self.process = None
+        self._log = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.diagnostic_port}"
+
+    def start(self):
+        env = dict(os.environ,
+                   CIBERMONDAY_BACKEND='sim',
+                   CIBERMONDAY_SIM_DIR=self.data_dir,
+                   CIBERMONDAY_SERVER_URL=self.server_url,
+                   CIBERMONDAY_SYNC_INTERVAL=str(self.sync_interval),
+                   CIBERMONDAY_DIAGNOSTIC_PORT=str(self.diagnostic_port),
+                   CIBERMONDAY_DISCOVERY_PORT=str(self.discovery_port),
+                   PYTHONUNBUFFERED='1')
+        self._log = open(self.log_path, 'w') if self.log_path else subprocess.DEVNULL
+        self.process = subprocess.Popen([sys.executable, CLIENT_SCRIPT, '--service'], env=env,
+                                        cwd=os.path.dirname(CLIENT_SCRIPT),
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+        return self
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self._log not in (None, subprocess.DEVNULL):
+            self._log.close()
+        self.process = None
+
+
+# ==================== SONDEO ====================
+
+def _fetch(url):
+    try:
+        return get_json(url, timeout=2, headers=PROBE_HEADERS)
+    except Exception:
+        return None
+
+
+def poll(pool, servers, clients):
+    """
+    Estado visto desde afuera (los sondeos llevan BENCH_PROBE_HEADER y no se
+    cuentan como tráfico). Un nodo que no responde queda en None.
+    """
+    urls = []
+    for server in servers:
+        urls += [f"{server.url}/api/servers", f"{server.url}/api/clients", f"{server.url}/api/health"]
+    urls += [f"{client.url}/api/diagnostic" for client in clients]
+    results = dict(zip(urls, pool.map(_fetch, urls)))
+
+    state = {'servers': {}, 'clients': {}}
+    for server in servers:
+        known = results[f"{server.url}/api/servers"]
+        registered = results[f"{server.url}/api/clients"]
+        health = results[f"{server.url}/api/health"]
+        if not (known and registered and health):
+            state['servers'][server.mesh_url] = None
+            continue
+        state['servers'][server.mesh_url] = {
+            'servers': {s.get('url') for s in known.get('servers', [])},
+            'clients': {c.get('id') for c in registered.get('clients', [])},
+            'connected': sum(1 for c in registered.get('clients', []) if c.get('connected')),
+            'leader': (health.get('leader') or {}).get('leader')
+        }
+    for client in clients:
+        diagnostic = results[f"{client.url}/api/diagnostic"]
+        if not diagnostic:
+            state['clients'][client.index] = None
+            continue
+        discovery = diagnostic.get('discovery') or {}
+        state['clients'][client.index] = {
+            'id': diagnostic.get('client_id'),
+            'servers': {s.get('url') for s in diagnostic.get('known_servers') or []},
+            'probes_sent': discovery.get('probes_sent', 0),
+            'offers_received': discovery.get('offers_received', 0)
+        }
+    return state
+
+
+def http_traffic(servers):
+    """Contadores HTTP de cada servidor vivo: {mesh_url: {clave: {...}}}."""
+    result = {}
+    for server in servers:
+        data = _fetch(f"{server.url}{TRAFFIC_PATH}")
+        if data is not None:
+            result[server.mesh_url] = data
+    return result
+
+
+def traffic_delta(after, before):
+    """Diferencia por servidor, sumada por clave 'origen MÉTODO ruta'."""
+    total = {}
+    for mesh_url, counts in after.items():
+        for key, entry in diff_traffic(counts, before.get(mesh_url, {})).items():
+            summed = total.setdefault(key, {'requests': 0, 'bytes_in': 0, 'bytes_out': 0})
+            for name, value in entry.items():
+                summed[name] += value
+    return total
+
+
+def udp_delta(after, before):
+    return {kind: {'messages': entry['messages'] - before[kind]['messages'],
+                   'bytes': entry['bytes'] - before[kind]['bytes']}
+            for kind, entry in after.items()}
+
+
+# ==================== FASES ====================
+
+def wait_for_mesh(pool, servers, clients, expected_servers, t0, timeout, poll_interval):
+    """
+    Sondea hasta que la malla se cierra o vence el timeout.
+
+    Returns:
+        (hitos {nombre: segundos desde t0 o None}, nodos {('servidor'|'cliente', id): segundos},
+         último estado)
+    """
+    milestones = dict.fromkeys(MILESTONES)
+    nodes = {}
+    state = None
+    while time.time() - t0 < timeout:
+        state = poll(pool, servers, clients)
+        now = time.time() - t0
+        client_ids = {c['id'] for c in state['clients'].values() if c and c.get('id')}
+        ids_known = len(client_ids) == len(clients)
+
+        servers_ok = clients_ok = True
+        for mesh_url, view in state['servers'].items():
+            knows_servers = view is not None and expected_servers <= view['servers']
+            knows_clients = view is not None and ids_known and client_ids <= view['clients']
+            servers_ok = servers_ok and knows_servers
+            clients_ok = clients_ok and knows_clients
+            if knows_servers and knows_clients:
+                nodes.setdefault(('servidor', mesh_url), now)
+        client_side_ok = True
+        for index, view in state['clients'].items():
+            knows = view is not None and expected_servers <= view['servers']
+            client_side_ok = client_side_ok and knows
+            if knows:
+                nodes.setdefault(('cliente', index), now)
+
+        for name, reached in zip(MILESTONES, (servers_ok, clients_ok, client_side_ok,
+                                              servers_ok and clients_ok and client_side_ok)):
+            if reached and milestones[name] is None:
+                milestones[name] = now
+        if milestones['malla completa'] is not None:
+            break
+        time.sleep(poll_interval)
+    return milestones, nodes, state
+
+
+def observe_after_kill(pool, survivors, clients, victim_url, client_ids, seconds, poll_interval):
+    """
+    Sondea a los sobrevivientes durante `seconds` tras matar a victim_url.
+
+    Returns:
+        dict con el tiempo hasta un líder nuevo acordado, cambios de líder vistos,
+        mínimo de clientes conectados y sondeos fallidos
+    """
+    t_kill = time.time()
+    new_leader_at = None
+    new_leader = None
+    leader_changes = 0
+    previous_leaders = None
+    min_connected = None
+    missing_clients = 0
+    failed_polls = 0
+    while time.time() - t_kill < seconds:
+        state = poll(pool, survivors, clients)
+        now = time.time() - t_kill
+        views = list(state['servers'].values())
+        failed_polls += sum(1 for view in views if view is None)
+        failed_polls += sum(1 for view in state['clients'].values() if view is None)
+        views = [view for view in views if view is not None]
+        if views:
+            leaders = tuple(view['leader'] for view in views)
+            if previous_leaders is not None:
+                leader_changes += sum(1 for old, new in zip(previous_leaders, leaders) if old != new)
+            previous_leaders = leaders
+            agreed = len(set(leaders)) == 1 and leaders[0] not in (None, victim_url)
+            if agreed and new_leader_at is None:
+                new_leader_at, new_leader = now, leaders[0]
+            connected = min(view['connected'] for view in views)
+            min_connected = connected if min_connected is None else min(min_connected, connected)
+            missing_clients = max(missing_clients,
+                                  max(len(client_ids - view['clients']) for view in views))
+        time.sleep(poll_interval)
+    return {
+        'new_leader_seconds': new_leader_at,
+        'new_leader': new_leader,
+        'leader_changes': leader_changes,
+        'min_connected_clients': min_connected,
+        'max_missing_clients': missing_clients,
+        'failed_polls': failed_polls
+    }
+
+
+def measure_rate(servers, udp_counter, seconds):
+    """Tráfico por segundo con la malla quieta durante `seconds`."""
+    http_before = http_traffic(servers)
+    udp_before = udp_counter.snapshot() if udp_counter else None
+    time.sleep(seconds)
+    http = traffic_delta(http_traffic(servers), http_before)
+    udp = udp_delta(udp_counter.snapshot(), udp_before) if udp_counter else None
+    return summarize_traffic(http, udp, seconds)
+
+
+def summarize_traffic(http, udp, seconds=None):
+    """Totales por origen HTTP y tipo UDP (por segundo si se pasa `seconds`)."""
+    by_origin = {}
+    for key, entry in http.items():
+        origin = key.split(' ', 1)[0]
+        summed = by_origin.setdefault(origin, {'messages': 0, 'bytes': 0})
+        summed['messages'] += entry['requests']
+        summed['bytes'] += entry['bytes_in'] + entry['bytes_out']
+    rows = {f"http {origin}": values for origin, values in sorted(by_origin.items())}
+    for kind, entry in (udp or {}).items():
+        rows[f"udp {kind}"] = {'messages': entry['messages'], 'bytes': entry['bytes']}
+    if seconds:
+        rows = {name: {'messages': values['messages'] / seconds, 'bytes': values['bytes'] / seconds}
+                for name, values in rows.items()}
+    return rows
+
+
+# ==================== SALIDA ====================
+
+def fmt_s(seconds):
+    return '-' if seconds is None else f"{seconds:.2f}"
+
+
+def print_traffic(title, rows, per_second=False):
+    unit = '/s' if per_second else ''
+    print(f"\n{title}")
+    print(f"  {'tipo':<20} {'mensajes' + unit:>12} {'KB' + unit:>10}")
+    for name, values in rows.items():
+        messages = f"{values['messages']:.1f}" if per_second else str(values['messages'])
+        print(f"  {name:<20} {messages:>12} {values['bytes'] / 1024:>10.1f}")
+
+
+def print_top_paths(http, limit=8):
+    print(f"\n  {'ruta (origen)':<52} {'requests':>9} {'KB':>8}")
+    ordered = sorted(http.items(), key=lambda item: -item[1]['requests'])
+    for key, entry in ordered[:limit]:
+        origin, method, path = key.split(' ', 2)
+        print(f"  {method + ' ' + path + ' (' + origin + ')':<52} {entry['requests']:>9} "
+              f"{(entry['bytes_in'] + entry['bytes_out']) / 1024:>8.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convergencia de la malla de descubrimiento')
+    parser.add_argument('--servers', type=int, default=3, help='Cantidad de servidores')
+    parser.add_argument('--clients', type=int, default=5, help='Cantidad de clientes simulados')
+    parser.add_argument('--port', type=int, default=5700, help='Puerto del primer servidor')
+    parser.add_argument('--client-port', type=int, default=6700,
+                        help='Puerto de diagnóstico del primer cliente (descubrimiento: +1000)')
+    parser.add_argument('--seed', choices=('first', 'round-robin', 'none'), default='first',
+                        help='Servidor configurado en cada cliente: el primero, uno distinto por '
+                             'cliente, o ninguno válido (solo descubrimiento)')
+    parser.add_argument('--sync-interval', type=int, default=5, help='sync_interval de los clientes (s)')
+    parser.add_argument('--timeout', type=float, default=120, help='Espera máxima por la malla (s)')
+    parser.add_argument('--poll', type=float, default=0.25, help='Intervalo de sondeo (s)')
+    parser.add_argument('--kill', choices=('leader', 'follower', 'none'), default='leader',
+                        help='Servidor a matar una vez cerrada la malla')
+    parser.add_argument('--stability', type=float, default=30,
+                        help='Ventana de observación antes y después de la caída (s)')
+    parser.add_argument('--log-dir', help='Guardar la salida de servidores y clientes en este directorio')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    local_ip = ClientManager.get_local_ip()
+    if not local_ip or local_ip == '127.0.0.1':
+        print("[Malla] Se necesita una IP de red (no 127.0.0.1): los servidores anuncian esa IP")
+        return 1
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    log = lambda name: os.path.join(args.log_dir, name) if args.log_dir else None
+
+    udp_counter = DiscoveryTrafficCounter()
+    try:
+        udp_counter.start()
+    except OSError as e:
+        print(f"[Malla] Sin conteo UDP (no se pudieron abrir los puertos de descubrimiento: {e})")
+        udp_counter = None
+
+    servers = []
+    clients = []
+    data_root = tempfile.mkdtemp(prefix='cibermonday-mesh-')
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=32)
+    results = {'servers': args.servers, 'clients': args.clients, 'seed': args.seed,
+               'sync_interval': args.sync_interval}
+    exit_code = 0
+    try:
+        print(f"[Malla] {args.servers} servidor(es) flask | {args.clients} cliente(s) sim | "
+              f"seed {args.seed} | sync_interval {args.sync_interval}s")
+        for i in range(args.servers):
+            server = ServerProcess('flask', port=args.port + i, host='0.0.0.0',
+                                   log_path=log(f"server-{i}.log"), traffic=True)
+            server.mesh_url = f"http://{local_ip}:{server.port}"
+            servers.append(server.start())
+        expected_servers = {server.mesh_url for server in servers}
+
+        http_start = http_traffic(servers)
+        udp_start = udp_counter.snapshot() if udp_counter else None
+        t0 = time.time()
+        for i in range(args.clients):
+            if args.seed == 'first':
+                seed_url = servers[0].mesh_url
+            elif args.seed == 'round-robin':
+                seed_url = servers[i % len(servers)].mesh_url
+            else:
+                # Puerto sin servidor: el cliente depende solo del descubrimiento
+                seed_url = f"http://127.0.0.1:{args.port - 1}"
+            client = SimClient(i, seed_url, args.client_port + i, args.client_port + 1000 + i,
+                               args.sync_interval, os.path.join(data_root, str(i)),
+                               log_path=log(f"client-{i}.log"))
+            clients.append(client.start())
+
+        milestones, nodes, state = wait_for_mesh(pool, servers, clients, expected_servers,
+                                                 t0, args.timeout, args.poll)
+        converged_at = time.time()
+        http = traffic_delta(http_traffic(servers), http_start)
+        udp = udp_delta(udp_counter.snapshot(), udp_start) if udp_counter else None
+        client_views = [view for view in (state or {}).get('clients', {}).values() if view]
+        probes = sum(view['probes_sent'] for view in client_views)
+        offers = sum(view['offers_received'] for view in client_views)
+
+        print(f"\n  {'hito':<32} {'s':>8}")
+        for name in MILESTONES:
+            print(f"  {name:<32} {fmt_s(milestones[name]):>8}")
+        print(f"\n  {'nodos completos':<16} {'n':>4} {'p50 s':>8} {'max s':>8}")
+        for kind, total in (('servidor', len(servers)), ('cliente', len(clients))):
+            times = [t for (node_kind, _), t in nodes.items() if node_kind == kind]
+            print(f"  {kind:<16} {len(times):>2}/{total:<2} {fmt_s(percentile(times, 50)):>7} "
+                  f"{fmt_s(max(times) if times else None):>8}")
+        convergence = summarize_traffic(http, udp)
+        print_traffic(f"Tráfico hasta la malla completa ({converged_at - t0:.1f}s)", convergence)
+        print_top_paths(http)
+        print(f"\n  probes enviados por los clientes: {probes} | ofertas recibidas: {offers}")
+        results['convergence'] = {'milestones': milestones, 'seconds': converged_at - t0,
+                                  'nodes': {f"{kind} {name}": t for (kind, name), t in nodes.items()},
+                                  'traffic': convergence, 'http': http,
+                                  'probes_sent': probes, 'offers_received': offers}
+
+        if milestones['malla completa'] is None:
+            print(f"\n[Malla] La malla no se cerró en {args.timeout:.0f}s")
+            exit_code = 1
+        elif args.kill != 'none':
+            steady = measure_rate(servers, udp_counter, args.stability)
+            print_traffic(f"Malla quieta ({args.stability:.0f}s)", steady, per_second=True)
+
+            leaders = [view['leader'] for view in poll(pool, servers, [])['servers'].values() if view]
+            leader = max(set(leaders), key=leaders.count) if leaders else None
+            if args.kill == 'leader':
+                victim = next((s for s in servers if s.mesh_url == leader), servers[0])
+            else:
+                victim = next((s for s in servers if s.mesh_url != leader), servers[-1])
+            print(f"\n[Malla] Matando {victim.mesh_url} ({'líder' if victim.mesh_url == leader else 'seguidor'})")
+            victim.kill()
+            survivors = [s for s in servers if s is not victim]
+            client_ids = {view['id'] for view in client_views if view.get('id')}
+
+            http_before = http_traffic(survivors)
+            udp_before = udp_counter.snapshot() if udp_counter else None
+            started = time.time()
+            after = observe_after_kill(pool, survivors, clients, victim.mesh_url, client_ids,
+                                       args.stability, args.poll)
+            elapsed = time.time() - started
+            after_rate = summarize_traffic(
+                traffic_delta(http_traffic(survivors), http_before),
+                udp_delta(udp_counter.snapshot(), udp_before) if udp_counter else None, elapsed)
+
+            print(f"  líder nuevo acordado          {fmt_s(after['new_leader_seconds']):>8} s "
+                  f"({after['new_leader'] or '-'})")
+            print(f"  cambios de líder vistos       {after['leader_changes']:>8}")
+            print(f"  clientes conectados (mín.)    {after['min_connected_clients']!s:>8} / {len(client_ids)}")
+            print(f"  clientes faltantes (máx.)     {after['max_missing_clients']:>8}")
+            print(f"  sondeos fallidos              {after['failed_polls']:>8}")
+            print_traffic(f"Tras la caída ({elapsed:.0f}s)", after_rate, per_second=True)
+            results['kill'] = dict(after, victim=victim.mesh_url, was_leader=victim.mesh_url == leader,
+                                   steady_rate=steady, after_rate=after_rate)
+            if after['new_leader_seconds'] is None or after['max_missing_clients']:
+                print("\n[Malla] La malla no se estabilizó tras la caída")
+                exit_code = 1
+    finally:
+        for client in clients:
+            client.stop()
+        for server in servers:
+            server.stop()
+        if udp_counter:
+            udp_counter.stop()
+        pool.shutdown(wait=False)
+        shutil.rmtree(data_root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,495 @@
+"""
+CiberMonday - Replay del tráfico grabado
+
+Re-envía contra un servidor local el tráfico grabado por un servidor real
+(CIBERMONDAY_TRAFFIC_LOG, ver core/traffic.py) y compara latencias:
+
+- contra lo grabado: con --spawn el servidor local también graba, así se comparan
+  duraciones medidas igual (dentro del servidor) en producción y en esta versión
+- contra una corrida anterior (--save / --baseline), para comparar dos versiones
+  del código con el mismo tráfico: código 1 si alguna ruta empeora más que la tolerancia
+
+Cada cliente es una fila: sus requests salen en el orden grabado y recién cuando
+terminó el anterior. Los requests sin cliente (health, panel, servidores) salen
+sueltos a su hora (con --speed 0, en orden y de a uno). Los client_id se cambian por IDs nuevos; los clientes cuyo
+primer request no es un registro se registran antes de empezar; los que se
+registraron sin ID siguen con el que les asigna el servidor local.
+
+Para no tocar la red del ciber: client_ip/diagnostic_port apuntan a un puerto de
+diagnóstico falso local, las listas de servidores al servidor local y
+/api/replicate no se re-envía (trae estado de otros servidores; ver --include-replication).
+
+Uso:
+    python benchmarks/replay_traffic.py traffic.jsonl --spawn flask
+    python benchmarks/replay_traffic.py traffic.jsonl --spawn android --speed 10
+    python benchmarks/replay_traffic.py traffic.jsonl --spawn flask --speed 0 --save antes.json
+    python benchmarks/replay_traffic.py traffic.jsonl --spawn flask --speed 0 --baseline antes.json
+    python benchmarks/replay_traffic.py traffic.jsonl --server http://127.0.0.1:5000
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common import (ServerProcess, http_request, read_http_request, write_json_response,
+                    percentile)
+from core.metrics import route_label
+from core.traffic import TRAFFIC_LOG_ENV, client_id_of, read_log, rotated_paths
+
+# Fracción de empeoramiento tolerada antes de considerarlo regresión
+DEFAULT_TOLERANCE = 0.5
+# Diferencias menores a esto (ms) son ruido aunque el ratio sea grande
+MIN_DIFF_MS = 0.5
+# Rutas con menos requests no se comparan
+MIN_SAMPLES = 5
+# Listas de servidores del body: se reemplazan por el servidor local
+_SERVER_LIST_KEYS = ('known_servers', 'servers')
+
+
+def load_entries(paths, limit=None, duration=None):
+    """Entradas de los logs (los rotados incluidos) ordenadas por hora de inicio."""
+    files = []
+    for path in paths:
+        expanded = rotated_paths(path) if not path.endswith('.gz') else [path]
+        files.extend(p for p in expanded if p not in files)
+    entries = [e for e in read_log(files) if isinstance(e, dict) and 'm' in e and 'p' in e]
+    entries.sort(key=lambda e: e.get('t', 0))
+    if entries and duration:
+        end = entries[0].get('t', 0) + duration
+        entries = [e for e in entries if e.get('t', 0) <= end]
+    if limit:
+        entries = entries[:limit]
+    return files, entries
+
+
+class Replay:
+    """Reescritura de IDs, filas por cliente, envío y latencias por ruta."""
+
+    def __init__(self, server_url, speed, max_concurrency, timeout, include_replication):
+        parsed = urlparse(server_url)
+        self.server_url = server_url.rstrip('/')
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.speed = speed
+        self.timeout = timeout
+        self.include_replication = include_replication
+        self.push_port = None
+        self.ids = {}  # client_id grabado -> client_id nuevo
+        self.latencies = collections.defaultdict(list)
+        self.recorded = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.status_changed = collections.Counter()
+        self.skipped = collections.Counter()
+        self.lateness = []
+        self.pushes = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    # ==================== REESCRITURA ====================
+
+    def new_id(self, client_id):
+        if client_id not in self.ids:
+            self.ids[client_id] = str(uuid.uuid4())
+        return self.ids[client_id]
+
+    def rewrite_path(self, path):
+        client_id = client_id_of(path)
+        if client_id:
+            prefix = f"/api/client/{client_id}"
+            path = f"/api/client/{self.new_id(client_id)}" + path[len(prefix):]
+        return path
+
+    def rewrite_body(self, value):
+        """IDs nuevos (en valores y claves) y direcciones locales."""
+        if isinstance(value, dict):
+            result = {}
+            for key, item in value.items():
+                key = self.ids.get(key, key)
+                if key == 'client_ip':
+                    item = '127.0.0.1'
+                elif key == 'diagnostic_port':
+                    item = self.push_port
+                elif key == 'server_url':
+                    item = self.server_url
+                elif key in _SERVER_LIST_KEYS and isinstance(item, list):
+                    item = [{'url': self.server_url, 'ip': self.host, 'port': self.port}]
+                else:
+                    item = self.rewrite_body(item)
+                result[key] = item
+            return result
+        if isinstance(value, list):
+            return [self.rewrite_body(item) for item in value]
+        if isinstance(value, str):
+            return self.ids.get(value, value)
+        return value
+
+    def plan(self, entries):
+        """
+        Separa las entradas en filas por cliente y requests sueltos.
+
+        Returns:
+            (filas, sueltos, clientes a registrar antes)
+        """
+        lanes = collections.OrderedDict()
+        loose = []
+        for entry in entries:
+            path = entry['p'].split('?')[0]
+            if path == '/api/replicate' and not self.include_replication:
+                self.skipped[path] += 1
+                continue
+            client_id = entry.get('c')
+            if client_id:
+                self.new_id(client_id)
+                lanes.setdefault(client_id, []).append(entry)
+            else:
+                loose.append(entry)
+        preregister = [cid for cid, lane in lanes.items()
+                       if not (lane[0]['m'] == 'POST' and lane[0]['p'].startswith('/api/register'))]
+        return lanes, loose, preregister
+
+    # ==================== ENVÍO ====================
+
+    async def send(self, entry, due=None):
+        """Re-envía una entrada grabada y guarda su latencia bajo la ruta."""
+        if 'b' in entry:
+            body = self.rewrite_body(entry['b'])
+        elif 'braw' in entry:
+            body = entry['braw'].encode('utf-8')
+        else:
+            body = None
+        path = self.rewrite_path(entry['p'])
+        route = f"{entry['m']} {route_label(entry['p'].split('?')[0])}"
+        async with self._slots:
+            if due is not None:
+                self.lateness.append(max(0.0, time.monotonic() - due))
+            started = time.perf_counter()
+            try:
+                status, data = await http_request(self.host, self.port, entry['m'], path, body,
+                                                  timeout=self.timeout, headers=entry.get('h'))
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                status, data = 0, None
+            elapsed = time.perf_counter() - started
+        self.latencies[route].append(elapsed)
+        if entry.get('c') and isinstance(data, dict) and isinstance(data.get('client_id'), str) \
+                and entry['p'] == '/api/register' and isinstance(entry.get('b'), dict) \
+                and not entry['b'].get('client_id'):
+            # Registro de un cliente nuevo: sus requests siguientes usan el ID que asignó el servidor
+            self.ids[entry['c']] = data['client_id']
+        if 'd' in entry:
+            self.recorded[route].append(entry['d'] / 1000)
+        if status == 0 or status >= 500:
+            self.errors[route] += 1
+        elif status != entry.get('s'):
+            self.status_changed[route] += 1
+        return status
+
+    async def register(self, client_id):
+        body = {'name': f"replay {client_id[:8]}", 'client_id': self.ids[client_id],
+                'client_ip': '127.0.0.1', 'diagnostic_port': self.push_port}
+        try:
+            status, _ = await http_request(self.host, self.port, 'POST', '/api/register', body,
+                                           timeout=self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status = 0
+        return status == 201
+
+    def _due(self, start, origin, entry):
+        if not self.speed:
+            return None
+        return start + (entry.get('t', origin) - origin) / self.speed
+
+    async def _wait(self, due):
+        if due is not None:
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def run_lane(self, lane, start, origin):
+        for entry in lane:
+            due = self._due(start, origin, entry)
+            await self._wait(due)
+            await self.send(entry, due)
+
+    async def run_loose(self, entry, start, origin):
+        due = self._due(start, origin, entry)
+        await self._wait(due)
+        await self.send(entry, due)
+
+    # ==================== PUERTO DE DIAGNÓSTICO FALSO ====================
+
+    async def _handle_push(self, reader, writer):
+        try:
+            request = await read_http_request(reader)
+            if request is None:
+                writer.close()
+                return
+            self.pushes += 1
+            await write_json_response(writer, {'success': True})
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            writer.close()
+
+    async def start_push_server(self):
+        server = await asyncio.start_server(self._handle_push, '127.0.0.1', 0, backlog=1024)
+        self.push_port = server.sockets[0].getsockname()[1]
+        return server
+
+
+def count_lines(path):
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+async def run_replay(args, entries, server_log=None):
+    """
+    Returns:
+        (replay, segundos, líneas del log del servidor local previas al replay)
+    """
+    replay = Replay(args.server, args.speed, args.max_concurrency, args.timeout,
+                    args.include_replication)
+    push_server = await replay.start_push_server()
+    lanes, loose, preregister = replay.plan(entries)
+    try:
+        registered = await asyncio.gather(*(replay.register(cid) for cid in preregister))
+        if preregister:
+            print(f"[Replay] {sum(registered)}/{len(preregister)} cliente(s) registrados antes de empezar")
+        # El servidor de Android graba después de responder: esperar la última línea
+        await asyncio.sleep(0.2)
+        log_offset = count_lines(server_log)
+
+        origin = entries[0].get('t', 0) if entries else 0
+        start = time.monotonic()
+        tasks = [replay.run_lane(lane, start, origin) for lane in lanes.values()]
+        if args.speed:
+            tasks += [replay.run_loose(entry, start, origin) for entry in loose]
+        elif loose:
+            # Sin horario los sueltos saldrían todos juntos: van en orden, uno por vez
+            tasks.append(replay.run_lane(loose, start, origin))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    finally:
+        push_server.close()
+        await push_server.wait_closed()
+    return replay, elapsed, log_offset
+
+
+# ==================== RESULTADOS ====================
+
+def server_latencies(log_path, skip):
+    """Duraciones por ruta que grabó el servidor local (sin las `skip` líneas previas al replay)."""
+    result = collections.defaultdict(list)
+    for index, entry in enumerate(read_log(rotated_paths(log_path))):
+        if index < skip or 'd' not in entry:
+            continue
+        result[f"{entry['m']} {route_label(entry['p'].split('?')[0])}"].append(entry['d'] / 1000)
+    return result
+
+
+def summarize(values):
+    return {'n': len(values), 'p50': percentile(values, 50), 'p95': percentile(values, 95),
+            'p99': percentile(values, 99)}
+
+
+def ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.2f}"
+
+
+def print_table(results, recorded):
+    """Latencias por ruta: grabadas (servidor real) vs. esta corrida."""
+    has_server = any(r.get('server') for r in results.values())
+    local = 'servidor' if has_server else 'ida y vuelta'
+    print(f"\n  Latencia (ms): grabada en producción vs. local ({local})")
+    print(f"  {'ruta':<44} {'n':>6} {'grab p50':>9} {'grab p95':>9} {'loc p50':>9} "
+          f"{'loc p95':>9} {'ratio':>6} {'err':>4} {'≠st':>4}")
+    for route, result in sorted(results.items()):
+        mine = result.get('server') or result['client']
+        theirs = recorded.get(route) or {}
+        # La ida y vuelta incluye la conexión: solo se compara contra lo grabado del servidor
+        ratio = '-'
+        if result.get('server') and theirs.get('p50') and mine['p50'] is not None:
+            ratio = f"{mine['p50'] / theirs['p50']:.2f}x"
+        print(f"  {route:<44} {result['client']['n']:>6} {ms(theirs.get('p50')):>9} "
+              f"{ms(theirs.get('p95')):>9} {ms(mine['p50']):>9} {ms(mine['p95']):>9} "
+              f"{ratio:>6} {result['errors']:>4} {result['status_changed']:>4}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compara contra una corrida anterior, con la latencia del servidor si las dos
+    la tienen (si no, la de ida y vuelta).
+
+    Returns:
+        lista de (ruta, percentil, actual, baseline, ratio) que superan la tolerancia
+    """
+    regressions = []
+    print(f"\n  Contra el baseline (tolerancia {tolerance:.0%})")
+    print(f"  {'ruta':<44} {'base p50':>9} {'p50':>9} {'base p95':>9} {'p95':>9} {'ratio':>7}")
+    for route, result in sorted(results.items()):
+        reference = baseline.get(route)
+        if reference is None:
+            print(f"  {route:<44} {'-':>9} {ms(result['client']['p50']):>9} {'-':>9} "
+                  f"{ms(result['client']['p95']):>9} {'nueva':>7}")
+            continue
+        kind = 'server' if result.get('server') and reference.get('server') else 'client'
+        mine, theirs = result[kind], reference[kind]
+        if mine['n'] < MIN_SAMPLES or theirs['n'] < MIN_SAMPLES or not theirs['p50']:
+            print(f"  {route:<44} {ms(theirs['p50']):>9} {ms(mine['p50']):>9} "
+                  f"{ms(theirs['p95']):>9} {ms(mine['p95']):>9} {'pocos':>7}")
+            continue
+        worst = None
+        for key in ('p50', 'p95'):
+            ratio = mine[key] / theirs[key] if theirs[key] else 1.0
+            if ratio > 1 + tolerance and (mine[key] - theirs[key]) * 1000 > MIN_DIFF_MS:
+                regressions.append((route, key, mine[key], theirs[key], ratio))
+                worst = ratio if worst is None else max(worst, ratio)
+        ratio = mine['p50'] / theirs['p50']
+        mark = f"{worst:.2f}x REGRESIÓN" if worst else f"{ratio:.2f}x"
+        print(f"  {route:<44} {ms(theirs['p50']):>9} {ms(mine['p50']):>9} "
+              f"{ms(theirs['p95']):>9} {ms(mine['p95']):>9} {mark:>7}")
+    return regressions
+
+
+def machine_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'machine': platform.machine()}
+
+
+def parse_speed(value):
+    if value.lower() in ('max', '0'):
+        return 0.0
+    speed = float(value)
+    if speed < 0:
+        raise argparse.ArgumentTypeError('la velocidad no puede ser negativa')
+    return speed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Replay del tráfico grabado de un servidor CiberMonday')
+    parser.add_argument('logs', nargs='+',
+                        help='Logs grabados (se incluyen sus rotados .N.gz)')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--server', help='URL de un servidor ya corriendo (ej: http://127.0.0.1:5000)')
+    target.add_argument('--spawn', choices=ServerProcess.KINDS,
+                        help='Arrancar un servidor local: flask (server/app.py) o android')
+    parser.add_argument('--port', type=int, default=5066, help='Puerto del servidor con --spawn')
+    parser.add_argument('--server-log', help='Archivo para la salida del servidor con --spawn')
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help='1 = tiempo real, N = N veces más rápido, 0/max = lo más rápido posible')
+    parser.add_argument('--limit', type=int, help='Re-enviar solo las primeras N entradas')
+    parser.add_argument('--duration', type=float,
+                        help='Re-enviar solo los primeros N segundos grabados')
+    parser.add_argument('--max-concurrency', type=int, default=256,
+                        help='Conexiones simultáneas máximas')
+    parser.add_argument('--timeout', type=float, default=10, help='Timeout por request (s)')
+    parser.add_argument('--include-replication', action='store_true',
+                        help='Re-enviar también /api/replicate')
+    parser.add_argument('--save', help='Guardar esta corrida como baseline en este archivo')
+    parser.add_argument('--baseline', help='Comparar contra una corrida guardada con --save')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Empeoramiento tolerado contra el baseline (0.5 = 50%% más lento)')
+    parser.add_argument('--json', help='Guardar los resultados en este archivo JSON')
+    args = parser.parse_args(argv)
+    if not args.server and not args.spawn:
+        args.spawn = 'flask'
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files, entries = load_entries(args.logs, args.limit, args.duration)
+    if not entries:
+        print(f"[Replay] No hay entradas en {', '.join(args.logs)}")
+        return 1
+    span = entries[-1].get('t', 0) - entries[0].get('t', 0)
+    speed = f"{args.speed:g}x" if args.speed else 'máxima'
+    print(f"[Replay] {len(entries)} requests de {len(files)} archivo(s), {span:.0f}s grabados, "
+          f"velocidad {speed}")
+
+    server = None
+    log_dir = None
+    server_log = None
+    if args.spawn:
+        # El servidor local graba su propio tráfico: latencias medidas igual que en producción
+        log_dir = tempfile.mkdtemp(prefix='cibermonday-replay-')
+        server_log = os.path.join(log_dir, 'traffic.jsonl')
+        server = ServerProcess(args.spawn, port=args.port, log_path=args.server_log,
+                               env={TRAFFIC_LOG_ENV: server_log}).start()
+        args.server = server.url
+        print(f"[Replay] Servidor {args.spawn} arrancado (pid {server.pid})")
+    try:
+        replay, elapsed, log_offset = asyncio.run(run_replay(args, entries, server_log))
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        if server:
+            server.stop()
+
+    try:
+        server_side = server_latencies(server_log, log_offset) if server_log else {}
+    finally:
+        if log_dir:
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+    results = {}
+    for route, values in replay.latencies.items():
+        results[route] = {
+            'client': summarize(values),
+            'server': summarize(server_side[route]) if server_side.get(route) else None,
+            'errors': replay.errors[route],
+            'status_changed': replay.status_changed[route]
+        }
+    recorded = {route: summarize(values) for route, values in replay.recorded.items()}
+    sent = sum(len(v) for v in replay.latencies.values())
+    print(f"[Replay] {sent} requests en {elapsed:.1f}s ({sent / max(elapsed, 1e-6):.1f} rps) | "
+          f"{len(replay.ids)} cliente(s) | pushes recibidos: {replay.pushes}")
+    if replay.lateness:
+        print(f"[Replay] Atraso respecto de la hora grabada: p95 {ms(percentile(replay.lateness, 95))} ms")
+    for path, count in replay.skipped.items():
+        print(f"[Replay] {count} request(s) a {path} sin re-enviar")
+    print_table(results, recorded)
+
+    run_info = {'machine': machine_info(), 'server': args.spawn or args.server,
+                'logs': files, 'requests': sent, 'speed': args.speed, 'routes': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(run_info, recorded=recorded), f, indent=2)
+        print(f"\n[Replay] Resultados guardados en {args.json}")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(run_info, f, indent=2, sort_keys=True)
+        print(f"\n[Replay] Baseline guardado en {args.save}")
+
+    failed = sum(replay.errors.values())
+    if args.baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        if stored.get('machine') != machine_info():
+            print(f"\n[Replay] ATENCIÓN: el baseline es de otra máquina ({stored.get('machine')})")
+        if stored.get('logs') != files or stored.get('speed') != args.speed:
+            print("\n[Replay] ATENCIÓN: el baseline se grabó con otro tráfico o a otra velocidad")
+        regressions = compare(results, stored.get('routes', {}), args.tolerance)
+        if regressions:
+            print(f"\n[Replay] {len(regressions)} regresión(es) sobre la tolerancia de {args.tolerance:.0%}")
+            return 1
+        print("\n[Replay] Sin regresiones")
+    if failed:
+        print(f"\n[Replay] {failed} request(s) con error de conexión o 5xx")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
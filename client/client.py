@@ -4,17 +4,21 @@ Este script debe ejecutarse en la PC del cliente y se conecta al servidor
 para recibir el tiempo asignado y bloquear la PC cuando expire.
 """
 
-import requests
 import time
 import sys
 import os
+import hashlib
+import uuid
+import importlib
 from datetime import datetime, timedelta
-import ctypes
-from ctypes import wintypes
 import threading
 import socket
 import json
+import random
+import collections
+import concurrent.futures
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
 from urllib.parse import urlparse, parse_qs
 
 # Asegurar que stdout/stderr existan (PyInstaller --windowed los deja en None)
@@ -24,12 +28,65 @@ if sys.stdout is None:
 if sys.stderr is None:
     sys.stderr = open(os.devnull, 'w')
 
-# Importar protecciones
-try:
-    from protection import apply_protections
-    PROTECTION_AVAILABLE = True
-except ImportError:
-    PROTECTION_AVAILABLE = False
+# ==================== MEDICIÓN DE ARRANQUE ====================
+# Referencia para medir cuánto tarda cada fase del arranque (ver mark_startup_phase)
+_STARTUP_T0 = time.perf_counter()
+_startup_phases = {}
+
+def mark_startup_phase(phase):
+    """
+    Registra cuántos ms pasaron desde la carga del módulo hasta alcanzar una fase
+    del arranque. Solo se registra la primera vez. Se expone en /api/diagnostic.
+    """
+    if phase in _startup_phases:
+        return
+    elapsed_ms = round((time.perf_counter() - _STARTUP_T0) * 1000, 1)
+    _startup_phases[phase] = elapsed_ms
+    print(f"[Inicio] Fase '{phase}' a los {elapsed_ms} ms", flush=True)
+
+class _LazyModule:
+    """
+    Módulo importado de forma diferida: el import real ocurre en el primer acceso
+    a uno de sus atributos. Así los módulos pesados (ej: requests) no demoran el
+    primer chequeo de la sesión. El primer acceso toma un lock: el hilo de sync y
+    los del servidor de diagnóstico pueden llegar a la vez y ninguno debe ver el
+    módulo a medio cargar (importlib.util.LazyLoader no lo garantiza).
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        module = self._module
+        if module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+                module = self._module
+        return module
+    
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def _lazy_import(name):
+    """Módulo que se importa recién al usar uno de sus atributos (ver _LazyModule)."""
+    return _LazyModule(name)
+
+requests = _lazy_import('requests')
+
+# Backend de plataforma: APIs de Windows o simulación (CIBERMONDAY_BACKEND=sim)
+from platform_backend import get_backend
+
+backend = get_backend()
+
+# Spans de sincronización, registro, propagación y descubrimiento (ver /api/trace)
+from tracing import tracer, traced
+
+# Puertos locales del cliente (configurables para correr varias instancias por máquina)
+DIAGNOSTIC_PORT = int(os.getenv('CIBERMONDAY_DIAGNOSTIC_PORT', 5002))
+DISCOVERY_PORT = int(os.getenv('CIBERMONDAY_DISCOVERY_PORT', 5001))
 
 # Importar gestor de registro
 try:
@@ -64,6 +121,27 @@ try:
             pass
         def reset_server_timeout_count(server_url):
             pass
+    try:
+        from registry_manager import save_outbox_to_registry, get_outbox_from_registry
+    except ImportError:
+        def save_outbox_to_registry(entries):
+            return False
+        def get_outbox_from_registry():
+            return []
+    try:
+        from registry_manager import save_outbox_acked_to_registry, get_outbox_acked_from_registry
+    except ImportError:
+        def save_outbox_acked_to_registry(keys):
+            return False
+        def get_outbox_acked_from_registry():
+            return []
+    try:
+        from registry_manager import save_state_versions_to_registry, get_state_versions_from_registry
+    except ImportError:
+        def save_state_versions_to_registry(versions):
+            return False
+        def get_state_versions_from_registry():
+            return {}
 except ImportError:
     REGISTRY_AVAILABLE = False
     # Funciones dummy si no hay registro disponible
@@ -75,10 +153,25 @@ except ImportError:
         pass
     def reset_server_timeout_count(server_url):
         pass
+    def save_outbox_to_registry(entries):
+        return False
+    def get_outbox_from_registry():
+        return []
+    def save_outbox_acked_to_registry(keys):
+        return False
+    def get_outbox_acked_from_registry():
+        return []
+    def save_state_versions_to_registry(versions):
+        return False
+    def get_state_versions_from_registry():
+        return {}
 
 # Manejar rutas cuando se ejecuta como .exe (PyInstaller)
 def get_base_path():
     """Obtiene la ruta base del ejecutable o script"""
+    if backend.data_dir:
+        # Backend simulado: cada instancia guarda su estado en su propio directorio
+        return backend.data_dir
     if getattr(sys, 'frozen', False):
         # Ejecutándose como .exe compilado
         return os.path.dirname(sys.executable)
@@ -222,23 +315,12 @@ try:
                 CHECK_INTERVAL = config_data.get('check_interval', 5)
                 SYNC_INTERVAL_CONFIG = config_data.get('sync_interval', 30)
         else:
-            # Es servicio, usar configuración del registro directamente
+            # Es servicio, usar configuración del registro directamente.
+            # La lista de servidores se loguea en background (ver run_deferred_startup_tasks)
+            # para no demorar el primer chequeo de la sesión.
             SERVER_URL = config_data.get('server_url', 'http://localhost:5000')
             CHECK_INTERVAL = config_data.get('check_interval', 5)
             SYNC_INTERVAL_CONFIG = config_data.get('sync_interval', 30)
-            
-            # NOTA: La lista de servidores conocidos se resetea cuando se configura un nuevo servidor
-            # desde la GUI (ver config_gui.py). Aquí solo verificamos que el servidor principal esté.
-            # Los servidores se descubren automáticamente durante la sincronización.
-            if REGISTRY_AVAILABLE:
-                try:
-                    from registry_manager import get_servers_from_registry
-                    known_servers = get_servers_from_registry()
-                    print(f"[Inicio] Servidores conocidos en registro: {len(known_servers)}")
-                    if known_servers:
-                        print(f"[Inicio] Servidores: {', '.join([s.get('url', 'Unknown') for s in known_servers])}")
-                except Exception as e:
-                    print(f"[Inicio] [WARN]  Advertencia: No se pudo leer lista de servidores: {e}")
     
     CLIENT_ID_FILE = os.path.join(BASE_PATH, "client_id.txt")
     
@@ -249,12 +331,9 @@ except ImportError:
     SYNC_INTERVAL_CONFIG = 30
     CLIENT_ID_FILE = os.path.join(BASE_PATH, "client_id.txt")
 
-# Windows API para bloquear la pantalla
-user32 = ctypes.windll.user32
-kernel32 = ctypes.windll.kernel32
+mark_startup_phase('config')
 
 # Constantes de Windows API
-WTS_CURRENT_SERVER_HANDLE = 0
 WTS_SESSION_LOCK = 0x00000007
 WTS_SESSION_UNLOCK = 0x00000008
 
@@ -386,7 +465,7 @@ def show_time_alert(threshold, remaining_seconds):
         
         # Mostrar en un thread separado para no bloquear el monitoreo
         def show_message():
-            user32.MessageBoxW(0, message, title, flags)
+            backend.show_message(title, message, flags)
         
         alert_thread = threading.Thread(target=show_message, daemon=True)
         alert_thread.start()
@@ -400,99 +479,29 @@ def is_user_session_active():
     """
     Verifica si la sesión del usuario en la consola está activa (conectada).
     
-    Usa WTSQuerySessionInformationW para consultar el estado de la sesión.
-    Retorna True si el usuario está conectado al escritorio (WTSActive=0),
-    False si la sesión está desconectada o no hay sesión.
-    
     Útil para saber si ya bloqueamos/desconectamos y el usuario volvió a entrar.
     """
-    try:
-        wtsapi32 = ctypes.windll.wtsapi32
-        session_id = kernel32.WTSGetActiveConsoleSessionId()
-        if session_id == 0xFFFFFFFF:
-            return False  # No hay sesión de consola
-        
-        # WTSConnectState = 8 (clase de info para estado de conexión)
-        WTSConnectState = 8
-        buffer = ctypes.c_void_p()
-        bytes_returned = ctypes.c_ulong()
-        
-        result = wtsapi32.WTSQuerySessionInformationW(
-            WTS_CURRENT_SERVER_HANDLE,
-            session_id,
-            WTSConnectState,
-            ctypes.byref(buffer),
-            ctypes.byref(bytes_returned)
-        )
-        
-        if result and buffer.value is not None:
-            # El buffer contiene un INT con el estado de la sesión
-            # WTSActive = 0: usuario conectado al escritorio
-            # WTSDisconnected = 4: sesión desconectada (bloqueada por nosotros)
-            state = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_int)).contents.value
-            wtsapi32.WTSFreeMemory(buffer)
-            return state == 0  # Solo activa si WTSActive
-        
-        return True  # Asumir activa si no se pudo consultar
-    except Exception:
-        return True  # Asumir activa si hay error (mejor bloquear de más que de menos)
+    return backend.is_user_session_active()
 
 
 def lock_workstation():
-    """
-    Bloquea la estación de trabajo de Windows.
-    
-    Funciona tanto desde la sesión del usuario como desde Session 0 (servicios).
-    
-    Métodos (en orden de prioridad):
-    1. LockWorkStation() - funciona desde la sesión interactiva del usuario
-    2. WTSDisconnectSession() - funciona desde Session 0 (servicios de Windows)
-       Desconecta la sesión activa mostrando la pantalla de bloqueo.
-       Los programas del usuario siguen corriendo.
-    """
-    # Método 1: LockWorkStation() - solo funciona desde la sesión del usuario
-    try:
-        result = user32.LockWorkStation()
-        if result:
-            print("[Lock] PC bloqueada (LockWorkStation)", flush=True)
-            return True
-        else:
-            print("[Lock] LockWorkStation() fallo (retorno 0), intentando WTSDisconnectSession...", flush=True)
-    except Exception as e:
-        print(f"[Lock] Error en LockWorkStation: {e}", flush=True)
-    
-    # Método 2: WTSDisconnectSession - funciona desde Session 0 (servicios)
-    # Desconecta la sesión de consola activa, mostrando la pantalla de login/bloqueo
-    try:
-        wtsapi32 = ctypes.windll.wtsapi32
-        # Obtener la sesión de consola activa (donde el usuario está logueado)
-        session_id = kernel32.WTSGetActiveConsoleSessionId()
-        if session_id != 0xFFFFFFFF:  # 0xFFFFFFFF = no hay sesión activa
-            result = wtsapi32.WTSDisconnectSession(
-                WTS_CURRENT_SERVER_HANDLE,  # Servidor local
-                session_id,                  # Sesión del usuario
-                False                        # No esperar
-            )
-            if result:
-                print(f"[Lock] Sesion {session_id} desconectada (WTSDisconnectSession)", flush=True)
-                return True
-            else:
-                error_code = kernel32.GetLastError()
-                print(f"[Lock] WTSDisconnectSession fallo para sesion {session_id} (error: {error_code})", flush=True)
-        else:
-            print("[Lock] No se encontro sesion activa de consola", flush=True)
-    except Exception as e:
-        print(f"[Lock] Error en WTSDisconnectSession: {e}", flush=True)
-    
-    print("[Lock] ERROR: No se pudo bloquear la PC con ningun metodo", flush=True)
-    return False
+    """Bloquea la estación de trabajo (ver WindowsBackend.lock_workstation)."""
+    with tracer.span('lock') as span:
+        locked = backend.lock_workstation()
+        if not locked:
+            span.fail('No se pudo bloquear')
+        return locked
 
 
-def get_client_id():
+def get_client_id(allow_register=True):
     """
     Obtiene el ID del cliente desde registro, archivo, servidor o lo genera localmente.
     NUNCA retorna None - si no puede registrarse con un servidor, genera un ID local
     y lo intentará registrar más adelante durante la sincronización.
+    
+    Args:
+        allow_register: Si False, no contacta servidores (arranque rápido). Si no hay
+                        ID local se genera uno y el SyncManager lo registra en background.
     """
     # Intentar obtener del registro primero
     if REGISTRY_AVAILABLE:
@@ -512,15 +521,19 @@ def get_client_id():
                 return client_id
     
     # Intentar registrar con el servidor
-    client_id = register_new_client()
-    if client_id:
-        return client_id
+    if allow_register:
+        client_id = register_new_client()
+        if client_id:
+            return client_id
     
     # Si no se pudo registrar con ningún servidor, generar un ID local
     # El cliente se registrará con un servidor cuando uno esté disponible
     import uuid
     client_id = str(uuid.uuid4())
-    print(f"[Inicio] No se pudo contactar ningún servidor. Generando ID local: {client_id}")
+    if allow_register:
+        print(f"[Inicio] No se pudo contactar ningún servidor. Generando ID local: {client_id}")
+    else:
+        print(f"[Inicio] Sin ID guardado. Generando ID local: {client_id}")
     print(f"[Inicio] El cliente se registrará con un servidor cuando uno esté disponible.")
     
     # Guardar el ID local
@@ -610,6 +623,7 @@ def find_available_server(servers_list=None):
     
     return None
 
+@traced('register')
 def register_new_client(existing_client_id=None):
     """
     Registra un nuevo cliente en el servidor o re-registra uno existente.
@@ -642,7 +656,7 @@ def register_new_client(existing_client_id=None):
             client_ip = s.getsockname()[0]
             s.close()
             register_data['client_ip'] = client_ip
-            register_data['diagnostic_port'] = 5002  # Puerto del servidor de diagnóstico
+            register_data['diagnostic_port'] = DIAGNOSTIC_PORT  # Puerto del servidor de diagnóstico
         except:
             # Si no se puede obtener IP, continuar sin ella
             pass
@@ -654,18 +668,18 @@ def register_new_client(existing_client_id=None):
                 session_data = get_session_from_registry()
                 if session_data:
                     remaining = max(0, session_info['remaining_seconds'])
-                    register_data['session'] = {
+                    register_data['session'] = with_state_version({
                         'remaining_seconds': remaining,
                         'time_limit_seconds': session_data.get('time_limit_seconds', remaining or 0)
-                    }
+                    }, 'session')
             
             # Incluir configuración actual del cliente (incluyendo nombre personalizado)
             if config_data:
-                register_data['config'] = {
+                register_data['config'] = with_state_version({
                     'sync_interval': config_data.get('sync_interval', 30),
                     'alert_thresholds': config_data.get('alert_thresholds', [600, 300, 120, 60]),
                     'custom_name': custom_name
-                }
+                }, 'config')
         
         # Incluir lista de servidores conocidos
         if REGISTRY_AVAILABLE:
@@ -680,6 +694,9 @@ def register_new_client(existing_client_id=None):
             print("[Registro] No hay servidores disponibles para registrar el cliente")
             return None
         
+        if 'session' in register_data:
+            register_data['session'] = with_session_end_ts(register_data['session'], available_server)
+        
         response = requests.post(
             f"{available_server}/api/register",
             json=register_data,
@@ -799,6 +816,180 @@ def apply_server_config(server_config):
     except Exception as e:
         print(f"[Config] Error al aplicar configuración del servidor: {e}")
 
+def apply_server_lock(lock_data=None):
+    """
+    Aplica una orden de bloqueo del servidor (su deadline venció). Guarda la sesión
+    como vencida en el registro; monitor_time bloquea en su próximo chequeo y sigue
+    re-bloqueando hasta que el admin asigne tiempo nuevo.
+    
+    Un bloqueo de una sesión anterior (ej: push demorado que llega después del
+    tiempo nuevo del admin) se descarta. Retorna False en ese caso.
+    """
+    if not REGISTRY_AVAILABLE:
+        return False
+    if is_stale_version('session', (lock_data or {}).get('version')):
+        print(f"[Lock] Bloqueo de una sesión anterior (deadline {(lock_data or {}).get('deadline')}), ignorado")
+        return False
+    
+    session_data = get_session_from_registry() or {}
+    time_limit = (lock_data or {}).get('time_limit_seconds') or session_data.get('time_limit_seconds', 0)
+    now_local = datetime.now()
+    save_session_to_registry(
+        time_limit_seconds=time_limit,
+        start_time_iso=(now_local - timedelta(seconds=time_limit)).isoformat(),
+        end_time_iso=now_local.isoformat()
+    )
+    print(f"[Lock] El servidor indicó que la sesión venció, bloqueando")
+    return True
+
+def get_state_version(kind):
+    """Versión ('session' o 'config') del último cambio del admin aplicado, o None."""
+    if not REGISTRY_AVAILABLE:
+        return None
+    return get_state_versions_from_registry().get(kind)
+
+def note_state_version(kind, version):
+    """Recuerda la versión del cambio del admin recién aplicado."""
+    if version is None or not REGISTRY_AVAILABLE:
+        return
+    versions = get_state_versions_from_registry()
+    if versions.get(kind) != version:
+        versions[kind] = version
+        save_state_versions_to_registry(versions)
+
+def is_stale_version(kind, version):
+    """
+    True si un push trae una versión anterior a la ya aplicada (llegó desordenado).
+    Las versiones son enteros HLC del servidor: ordenan por tiempo entre servidores.
+    """
+    current = get_state_version(kind)
+    if not isinstance(version, int) or not isinstance(current, int):
+        return False
+    return version < current
+
+def with_state_version(payload, kind):
+    """Copia del payload con la versión local, para que el servidor detecte reportes viejos."""
+    version = get_state_version(kind)
+    if not payload or version is None:
+        return payload
+    return dict(payload, version=version)
+
+def adopt_server_state(kind, response_data, server_url=None):
+    """
+    El servidor rechazó un reporte por versión vieja (el push del admin no llegó):
+    adoptar la sesión o config vigente que devolvió.
+    """
+    global last_known_remaining
+    
+    if not REGISTRY_AVAILABLE:
+        return
+    
+    if kind == 'session':
+        session = response_data.get('session')
+        if session:
+            start_time_local, end_time_local, remaining = local_session_times(session, server_url)
+            save_session_to_registry(
+                time_limit_seconds=session.get('time_limit_seconds', 0),
+                start_time_iso=start_time_local.isoformat(),
+                end_time_iso=end_time_local.isoformat()
+            )
+            reset_alerts_for_new_session(remaining)
+            last_known_remaining = remaining
+        else:
+            clear_session_from_registry()
+    elif response_data.get('config'):
+        apply_server_config(response_data['config'])
+    
+    note_state_version(kind, response_data.get('version'))
+    label = 'sesión' if kind == 'session' else 'configuración'
+    print(f"[Sync] {label.capitalize()} desactualizada, adoptando la versión {response_data.get('version')} del servidor")
+
+def apply_session_command(data, server_url=None, host=None):
+    """
+    Aplica una sesión asignada por el admin (push o cola de comandos).
+    
+    Returns:
+        segundos restantes, o None si la versión es anterior a la ya aplicada
+        (ej: un push viejo que llegó tarde no pisa un cambio posterior)
+    """
+    global last_known_remaining
+    
+    if is_stale_version('session', data.get('version')):
+        return None
+    
+    # Tiempos locales: deadline absoluto corregido por el offset del servidor
+    # (o, sin offset conocido, desde remaining)
+    start_time_local, end_time_local, remaining = local_session_times(
+        data, server_url, host=host)
+    
+    if REGISTRY_AVAILABLE:
+        save_session_to_registry(
+            time_limit_seconds=data.get('time_limit_seconds', 0),
+            start_time_iso=start_time_local.isoformat(),
+            end_time_iso=end_time_local.isoformat()
+        )
+        
+        # Resetear alertas para la nueva sesión
+        reset_alerts_for_new_session(remaining)
+        last_known_remaining = remaining
+        note_state_version('session', data.get('version'))
+    return remaining
+
+def apply_stop_command(data):
+    """Aplica la detención de la sesión. False si la versión es vieja."""
+    version = (data or {}).get('version')
+    if is_stale_version('session', version):
+        return False
+    if REGISTRY_AVAILABLE:
+        clear_session_from_registry()
+        note_state_version('session', version)
+    return True
+
+def apply_config_command(data):
+    """Aplica la configuración enviada por el admin. False si la versión es vieja."""
+    if is_stale_version('config', data.get('version')):
+        return False
+    if REGISTRY_AVAILABLE:
+        apply_server_config(data)
+        note_state_version('config', data.get('version'))
+    return True
+
+def apply_server_commands(commands, queue_id, server_url=None):
+    """
+    Aplica, en orden, los comandos de la cola que vinieron con /status (los que
+    el push no pudo entregar). Se recuerda el último aplicado para confirmarlo en
+    el próximo /status y no repetirlo.
+    
+    Returns:
+        cantidad de comandos aplicados
+    """
+    if not commands or not queue_id:
+        return 0
+    last_seq = get_state_version('command') if get_state_version('command_queue') == queue_id else 0
+    last_seq = last_seq or 0
+    applied = 0
+    for command in sorted(commands, key=lambda c: c.get('seq', 0)):
+        seq = command.get('seq', 0)
+        if seq <= last_seq:
+            continue
+        command_type = command.get('type')
+        data = command.get('data') or {}
+        if command_type == 'session':
+            apply_session_command(data, server_url)
+        elif command_type == 'stop':
+            apply_stop_command(data)
+        elif command_type == 'config':
+            apply_config_command(data)
+        elif command_type == 'lock':
+            apply_server_lock(data)
+        print(f"[Comandos] '{command_type}' #{seq} aplicado desde la cola del servidor")
+        last_seq = seq
+        applied += 1
+    if applied:
+        note_state_version('command_queue', queue_id)
+        note_state_version('command', last_seq)
+    return applied
+
 def report_session_to_server(client_id, server_url=None):
     """
     Reporta la sesión activa del cliente al servidor.
@@ -826,10 +1017,10 @@ def report_session_to_server(client_id, server_url=None):
     try:
         response = requests.post(
             f"{server_url}/api/client/{client_id}/report-session",
-            json={
+            json=with_state_version(with_session_end_ts({
                 'remaining_seconds': session_info['remaining_seconds'],
                 'time_limit_seconds': session_data.get('time_limit_seconds', session_info['remaining_seconds'])
-            },
+            }, server_url), 'session'),
             timeout=10
         )
         
@@ -840,6 +1031,54 @@ def report_session_to_server(client_id, server_url=None):
     except requests.exceptions.RequestException:
         return False
 
+def build_session_report():
+    """
+    Arma el payload de /report-session desde el registro local.
+    Sesión activa: segundos restantes reales. Expirada o sin sesión: remaining=0
+    con el time_limit (0 si no hay sesión) para que el panel muestre EXPIRADO.
+    
+    Returns:
+        dict con remaining_seconds y time_limit_seconds, o None si no hay registro
+    """
+    if not REGISTRY_AVAILABLE:
+        return None
+    
+    session_info = get_session_info()
+    session_data = get_session_from_registry() if session_info else None
+    
+    if session_info and not session_info['is_expired'] and session_info['remaining_seconds'] > 0:
+        remaining = session_info['remaining_seconds']
+        time_limit = session_data.get('time_limit_seconds', remaining) if session_data else remaining
+        return with_state_version({'remaining_seconds': remaining, 'time_limit_seconds': time_limit}, 'session')
+    
+    time_limit = session_data.get('time_limit_seconds', 0) if session_data else 0
+    return with_state_version({'remaining_seconds': 0, 'time_limit_seconds': time_limit}, 'session')
+
+def build_config_report():
+    """
+    Arma el payload de /config (from_client=True) desde el registro local.
+    
+    Returns:
+        dict con los campos configurados, o None si no hay nada para reportar
+    """
+    if not REGISTRY_AVAILABLE:
+        return None
+    
+    config_data = get_config_from_registry()
+    if not config_data:
+        return None
+    
+    config_payload = {}
+    for field in ('custom_name', 'sync_interval', 'alert_thresholds',
+                  'max_server_timeouts', 'lock_recheck_interval'):
+        if config_data.get(field):
+            config_payload[field] = config_data[field]
+    
+    if not config_payload:
+        return None
+    config_payload['from_client'] = True
+    return with_state_version(config_payload, 'config')
+
 def check_server_status(client_id):
     """Verifica el estado del cliente en el servidor"""
     # Buscar un servidor disponible
@@ -998,21 +1237,18 @@ def sync_with_all_servers(client_id):
                     time_limit = session.get('time_limit_seconds', 0)
                     start_time = session.get('start_time')
                     end_time = session.get('end_time')
-                    remaining_from_server = session.get('remaining_seconds', 0)
                     
                     if all([time_limit, start_time, end_time]):
-                        from datetime import datetime, timedelta
-                        now_local = datetime.now()
-                        end_time_local = now_local + timedelta(seconds=remaining_from_server)
-                        elapsed_seconds = time_limit - remaining_from_server
-                        start_time_local = now_local - timedelta(seconds=elapsed_seconds)
+                        start_time_local, end_time_local, remaining_from_server = \
+                            local_session_times(session, server_url)
                         
-                        if REGISTRY_AVAILABLE:
+                        if REGISTRY_AVAILABLE and not local_session_matches(time_limit, end_time_local):
                             save_session_to_registry(
                                 time_limit_seconds=time_limit,
                                 start_time_iso=start_time_local.isoformat(),
                                 end_time_iso=end_time_local.isoformat()
                             )
+                            note_state_version('session', session.get('version'))
                             last_known_remaining = remaining_from_server
             
             # Enviar lista de servidores conocidos a este servidor para sincronización
@@ -1051,6 +1287,259 @@ def sync_with_server(client_id):
     """
     return sync_with_all_servers(client_id)
 
+class StateOutbox:
+    """
+    Outbox acotado y persistido (en el registro) de transiciones de estado del cliente.
+    
+    Cada transición (sesión iniciada, sesión expirada) se encola con una clave de
+    idempotencia derivada de la transición misma (tipo + fin de la sesión): volver a
+    detectarla (ej: monitor_time tras reiniciar la PC) da la misma clave y no se
+    encola de nuevo si ya está pendiente o confirmada. El SyncManager la re-envía en
+    UN request batch cuando hay un servidor alcanzable, y solo la descarta cuando un
+    servidor confirma la clave. Así el historial sobrevive a caídas de todos los
+    servidores y a reinicios de la PC.
+    """
+    
+    # Máximo de eventos guardados; al superarlo se descartan los más viejos
+    MAX_ENTRIES = 200
+    # Claves confirmadas que se recuerdan para no re-encolar la misma transición
+    MAX_ACKED_KEYS = 200
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None  # Se carga del registro en el primer uso
+        self._acked = None
+    
+    def _ensure_loaded(self):
+        if self._entries is None:
+            self._entries = get_outbox_from_registry() if REGISTRY_AVAILABLE else []
+            self._acked = get_outbox_acked_from_registry() if REGISTRY_AVAILABLE else []
+    
+    @staticmethod
+    def event_key(event_type, data):
+        """Clave de idempotencia de una transición: la misma sesión da la misma clave."""
+        end_time = (data or {}).get('end_time')
+        if not end_time:
+            return uuid.uuid4().hex
+        return hashlib.sha1(f"{event_type}|{end_time}".encode('utf-8')).hexdigest()[:32]
+    
+    def record(self, event_type, data=None):
+        """Encola una transición de estado y la persiste (salvo que ya esté encolada o confirmada)."""
+        entry = {
+            'key': self.event_key(event_type, data),
+            'type': event_type,
+            'at': datetime.now().isoformat(),
+            'data': data or {}
+        }
+        with self._lock:
+            self._ensure_loaded()
+            if entry['key'] in self._acked or any(e.get('key') == entry['key'] for e in self._entries):
+                return
+            self._entries.append(entry)
+            if len(self._entries) > self.MAX_ENTRIES:
+                dropped = len(self._entries) - self.MAX_ENTRIES
+                del self._entries[:dropped]
+                print(f"[Outbox] Límite de {self.MAX_ENTRIES} eventos alcanzado, descartando {dropped} antiguo(s)")
+            self._persist()
+    
+    def pending(self):
+        """Copia de los eventos pendientes, en orden de ocurrencia."""
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._entries)
+    
+    def ack(self, keys):
+        """Descarta los eventos confirmados por un servidor."""
+        keys = set(keys)
+        if not keys:
+            return
+        with self._lock:
+            self._ensure_loaded()
+            acked = [e['key'] for e in self._entries if e.get('key') in keys]
+            if not acked:
+                return
+            self._entries = [e for e in self._entries if e.get('key') not in keys]
+            self._acked.extend(acked)
+            del self._acked[:-self.MAX_ACKED_KEYS]
+            self._persist()
+            if REGISTRY_AVAILABLE:
+                save_outbox_acked_to_registry(self._acked)
+    
+    def _persist(self):
+        if REGISTRY_AVAILABLE:
+            save_outbox_to_registry(self._entries)
+
+
+_state_outbox = StateOutbox()
+
+
+class ClockOffsetEstimator:
+    """
+    Estima el offset del reloj de cada servidor respecto del local (estilo NTP),
+    con las muestras que ya dan los health checks del sync.
+    
+    offset = server_time - (t0 + t3) / 2, con t0/t3 la hora local de envío y de
+    respuesta. El error de una muestra está acotado por RTT/2, así que se usa la de
+    menor RTT entre las últimas SAMPLES.
+    """
+    
+    SAMPLES = 8
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}  # server_url -> deque de (rtt, offset)
+    
+    def observe(self, server_url, t0, t3, server_time):
+        """Agrega una muestra (t0/t3 locales, server_time del servidor)."""
+        if not server_url or server_time is None or t3 < t0:
+            return
+        sample = (t3 - t0, server_time - (t0 + t3) / 2)
+        with self._lock:
+            self._samples.setdefault(
+                server_url, collections.deque(maxlen=self.SAMPLES)).append(sample)
+    
+    def reset(self, server_url):
+        """Descarta las muestras de un servidor (ej: reinició, su reloj pudo cambiar)."""
+        with self._lock:
+            self._samples.pop(server_url, None)
+    
+    def offset(self, server_url=None, host=None):
+        """
+        Offset (s) del servidor por URL, o por host (ej: el origen de un push).
+        None si todavía no hay muestras.
+        """
+        with self._lock:
+            candidates = [samples for url, samples in self._samples.items()
+                          if url == server_url or (host and urlparse(url).hostname == host)]
+            best = min((min(samples) for samples in candidates if samples), default=None)
+        return best[1] if best else None
+    
+    def snapshot(self):
+        """Offset y RTT de la mejor muestra por servidor (para /api/diagnostic)."""
+        with self._lock:
+            result = {}
+            for url, samples in self._samples.items():
+                if samples:
+                    rtt, offset = min(samples)
+                    result[url] = {'offset_ms': round(offset * 1000, 1),
+                                   'rtt_ms': round(rtt * 1000, 1),
+                                   'samples': len(samples)}
+            return result
+
+
+_clock_offsets = ClockOffsetEstimator()
+
+# Diferencia (s) entre dos fines de sesión por debajo de la cual son la misma sesión
+SESSION_DRIFT_TOLERANCE = 2
+
+def session_end_ts_for_server(server_url):
+    """
+    Fin de la sesión local como timestamp en el reloj del servidor, o None si no hay
+    sesión o todavía no se conoce el offset de ese servidor.
+    """
+    offset = _clock_offsets.offset(server_url)
+    if offset is None or not REGISTRY_AVAILABLE:
+        return None
+    session_data = get_session_from_registry()
+    if not session_data or not session_data.get('end_time'):
+        return None
+    return datetime.fromisoformat(session_data['end_time']).timestamp() + offset
+
+def local_session_times(session, server_url=None, host=None):
+    """
+    Convierte una sesión recibida del servidor a horas locales.
+    Con end_ts y offset conocido usa el deadline absoluto (no arrastra la demora de
+    la red); si no, la reconstruye desde remaining_seconds.
+    
+    Returns:
+        (start_time_local, end_time_local, remaining_seconds)
+    """
+    time_limit = session.get('time_limit_seconds', 0)
+    offset = _clock_offsets.offset(server_url, host=host) if session.get('end_ts') else None
+    now_local = datetime.now()
+    if offset is not None:
+        end_time_local = datetime.fromtimestamp(session['end_ts'] - offset)
+    else:
+        end_time_local = now_local + timedelta(seconds=session.get('remaining_seconds', 0))
+    remaining = max(0, int((end_time_local - now_local).total_seconds()))
+    return end_time_local - timedelta(seconds=time_limit), end_time_local, remaining
+
+def with_session_end_ts(session_payload, server_url):
+    """
+    Copia del payload de sesión (report-session o registro) con end_ts para ese
+    servidor, si la sesión está activa y se conoce su offset.
+    """
+    if not session_payload or session_payload.get('remaining_seconds', 0) <= 0:
+        return session_payload
+    end_ts = session_end_ts_for_server(server_url)
+    if end_ts is None:
+        return session_payload
+    return dict(session_payload, end_ts=end_ts)
+
+def outbox_events_for_server(entries, server_url):
+    """
+    Eventos del outbox para un servidor: las expiraciones llevan además el fin de
+    la sesión en el reloj de ese servidor (end_ts), así el servidor solo vence la
+    sesión si es la misma que tiene guardada.
+    """
+    offset = _clock_offsets.offset(server_url)
+    if offset is None:
+        return entries
+    events = []
+    for entry in entries:
+        end_time = (entry.get('data') or {}).get('end_time')
+        if entry.get('type') == 'session_expired' and end_time:
+            try:
+                end_ts = datetime.fromisoformat(end_time).timestamp() + offset
+                entry = dict(entry, data=dict(entry['data'], end_ts=end_ts))
+            except ValueError:
+                pass
+        events.append(entry)
+    return events
+
+def server_session_matches(session_payload, server_session):
+    """
+    True si el servidor ya tiene la sesión que el cliente iba a reportar (entonces
+    el reporte se omite).
+    """
+    if not session_payload:
+        return True
+    time_limit = session_payload.get('time_limit_seconds', 0)
+    if session_payload.get('remaining_seconds', 0) <= 0:
+        if not time_limit:
+            return server_session is None
+        return bool(server_session and server_session.get('is_expired')
+                    and server_session.get('time_limit_seconds') == time_limit)
+    if not server_session or server_session.get('is_expired'):
+        return False
+    if server_session.get('time_limit_seconds') != time_limit:
+        return False
+    if session_payload.get('end_ts') and server_session.get('end_ts'):
+        drift = abs(session_payload['end_ts'] - server_session['end_ts'])
+    else:
+        drift = abs(session_payload['remaining_seconds'] - server_session.get('remaining_seconds', 0))
+    return drift <= SESSION_DRIFT_TOLERANCE
+
+def local_session_matches(time_limit, end_time_local):
+    """True si la sesión del registro ya es esa (mismo límite y fin dentro de la tolerancia)."""
+    if not REGISTRY_AVAILABLE:
+        return False
+    session_data = get_session_from_registry()
+    if not session_data or session_data.get('time_limit_seconds') != time_limit:
+        return False
+    try:
+        drift = abs((datetime.fromisoformat(session_data['end_time']) - end_time_local).total_seconds())
+    except (KeyError, TypeError, ValueError):
+        return False
+    return drift <= SESSION_DRIFT_TOLERANCE
+
+
+# Header del /status con la telemetría del cliente (ver core/telemetry.py del servidor)
+TELEMETRY_HEADER = 'X-CiberMonday-Telemetry'
+# Servidores por muestra de telemetría como máximo
+TELEMETRY_MAX_SERVERS = 16
+
+
 class SyncManager:
     """
     Gestor de sincronización que corre en un hilo dedicado.
@@ -1075,6 +1564,23 @@ class SyncManager:
         self._running = True
         self._thread = None
         self._lock = threading.Lock()
+        # Último resultado del health check por servidor (url -> dict).
+        # Lo consume el servidor de diagnóstico para no hacer requests inline.
+        self._server_health = {}
+        # Época de recuperación vista por servidor (url -> epoch). Una época nueva
+        # significa que el servidor reinició con el estado vacío.
+        self._server_epochs = {}
+        self._resync_pending = False
+        # Despierta el loop antes de terminar el intervalo (re-sincronización)
+        self._wake = threading.Event()
+        # Servidores dueños de este cliente según el anillo de los servidores
+        # (en orden de preferencia). Se sincroniza primero con ellos.
+        self._owner_servers = []
+        # Telemetría que viaja en el /status de cada sync (ver build_telemetry)
+        self._server_stats = {}    # url -> {'sync_ms', 'fails'}
+        self._failovers = 0
+        self._loop_lag_ms = 0
+        self._telemetry_seq = 0
     
     @property
     def client_id(self):
@@ -1103,6 +1609,75 @@ class SyncManager:
         with self._lock:
             return self._last_successful_server
     
+    def get_server_health(self):
+        """Copia del último health check conocido de cada servidor (thread-safe)."""
+        with self._lock:
+            return {url: info.copy() for url, info in self._server_health.items()}
+    
+    def _record_health(self, server_url, available, elapsed_ms=None, status=None, error=None):
+        """Guarda el resultado de un health check para el servidor de diagnóstico."""
+        info = {
+            'available': available,
+            'checked_at': datetime.now().isoformat(),
+            'elapsed_ms': elapsed_ms,
+        }
+        if status is not None:
+            info['status'] = status
+        if error:
+            info['error'] = error
+        with self._lock:
+            self._server_health[server_url] = info
+            if not available:
+                stats = self._server_stats.setdefault(server_url, {'sync_ms': None, 'fails': 0})
+                stats['fails'] += 1
+    
+    def _record_sync(self, server_url, success, elapsed_ms):
+        """Guarda duración y resultado del sync con un servidor (telemetría)."""
+        with self._lock:
+            stats = self._server_stats.setdefault(server_url, {'sync_ms': None, 'fails': 0})
+            stats['sync_ms'] = elapsed_ms
+            if not success:
+                stats['fails'] += 1
+    
+    def build_telemetry(self):
+        """
+        Telemetría compacta de la salud del sync para el servidor (JSON en una
+        línea, va en el header TELEMETRY_HEADER del /status): latencia y fallas
+        por servidor, timeouts acumulados, offset de reloj, atraso del loop,
+        memoria del proceso y cambios de servidor de casa.
+        """
+        timeouts = {}
+        if REGISTRY_AVAILABLE:
+            try:
+                timeouts = {s.get('url'): s.get('timeout_count', 0) for s in get_servers_from_registry()}
+            except Exception:
+                pass
+        offsets = _clock_offsets.snapshot()
+        with self._lock:
+            self._telemetry_seq += 1
+            servers = {}
+            for url, health in list(self._server_health.items())[:TELEMETRY_MAX_SERVERS]:
+                stats = self._server_stats.get(url, {})
+                servers[url] = {
+                    'ms': health.get('elapsed_ms'),
+                    'sync_ms': stats.get('sync_ms'),
+                    'ok': int(bool(health.get('available'))),
+                    'to': timeouts.get(url, 0),
+                    'off_ms': (offsets.get(url) or {}).get('offset_ms'),
+                    'fails': stats.get('fails', 0)
+                }
+            payload = {
+                'v': 1,
+                'seq': self._telemetry_seq,
+                'lag_ms': self._loop_lag_ms,
+                'rss_kb': backend.process_rss_kb(),
+                'fail': self._consecutive_failures,
+                'failovers': self._failovers,
+                'home': self._last_successful_server,
+                'srv': servers
+            }
+        return json.dumps(payload, separators=(',', ':'))
+    
     def start(self):
         """Inicia el hilo de sincronización."""
         self._thread = threading.Thread(target=self._sync_loop, daemon=True)
@@ -1117,101 +1692,257 @@ class SyncManager:
         """Loop principal del hilo de sincronización."""
         # Primera sincronización inmediata al arrancar
         self._do_sync()
+        mark_startup_phase('primer_sync')
         
         while self._running:
-            # Dormir en intervalos cortos para poder responder al stop rápido
-            for _ in range(int(self._sync_interval)):
-                if not self._running:
-                    return
-                time.sleep(1)
+            # Dormir en intervalos cortos para poder responder al stop rápido;
+            # request_resync() despierta el loop antes de tiempo
+            deadline = time.time() + self._sync_interval
+            woken = False
+            while self._running and time.time() < deadline:
+                if self._wake.wait(min(1, max(0, deadline - time.time()))):
+                    woken = True
+                    break
+            if not self._running:
+                return
+            self._wake.clear()
+            with self._lock:
+                self._resync_pending = False
+                # Atraso del loop: cuánto después de lo previsto arranca el sync
+                # (CPU saturada, suspensión de la PC). Un resync no atrasa.
+                self._loop_lag_ms = 0 if woken else round(max(0, time.time() - deadline) * 1000)
             
             self._do_sync()
     
+    def _order_by_preference(self, servers_list):
+        """Ordena los servidores: dueños del cliente, servidor de casa y el resto."""
+        with self._lock:
+            owners = list(self._owner_servers)
+            home_url = self._last_successful_server
+        
+        def rank(server):
+            url = server.get('url')
+            if url in owners:
+                return owners.index(url)
+            return len(owners) + (0 if url == home_url else 1)
+        
+        return sorted(servers_list, key=rank)
+    
+    def _note_owners(self, owners):
+        """Guarda los dueños informados por el servidor (lista de URLs)."""
+        if not isinstance(owners, list) or not owners:
+            return
+        with self._lock:
+            changed = owners != self._owner_servers
+            self._owner_servers = owners
+        if changed:
+            print(f"[SyncManager] Servidores dueños de este cliente: {', '.join(owners)}")
+    
+    def note_server_epoch(self, server_url, epoch, resync_window=None, schedule_resync=True):
+        """
+        Registra la época anunciada por un servidor. Si cambió respecto de la última
+        vista, el servidor reinició sin estado: se agenda una re-sincronización.
+        
+        Returns:
+            True si la época cambió.
+        """
+        if not server_url or not epoch:
+            return False
+        with self._lock:
+            previous = self._server_epochs.get(server_url)
+            self._server_epochs[server_url] = epoch
+        if previous is None or previous == epoch:
+            return False
+        print(f"[SyncManager] {server_url} reinició (época {epoch}). Re-sincronizando...")
+        _clock_offsets.reset(server_url)
+        if schedule_resync:
+            self.request_resync(resync_window)
+        return True
+    
+    def request_resync(self, window=None):
+        """
+        Adelanta la próxima sincronización a un momento aleatorio dentro de la
+        ventana, para que toda la flota no golpee al servidor en el mismo instante.
+        """
+        with self._lock:
+            if self._resync_pending:
+                return
+            self._resync_pending = True
+        try:
+            window = float(window) if window is not None else 3
+        except (TypeError, ValueError):
+            window = 3
+        timer = threading.Timer(random.uniform(0, max(0, window)), self._wake.set)
+        timer.daemon = True
+        timer.start()
+    
     def _do_sync(self):
         """Realiza un ciclo de sincronización con TODOS los servidores disponibles."""
-        try:
-            client_id = self.client_id
-            
-            # Obtener lista de servidores conocidos
-            servers_list = get_available_servers()
-            
-            if not servers_list:
-                with self._lock:
-                    self._consecutive_failures += 1
-                if self._consecutive_failures == 1:
-                    print("[SyncManager] No hay servidores conocidos. Esperando descubrimiento por broadcast...")
-                elif self._consecutive_failures % 5 == 0:
-                    print(f"[SyncManager] {self._consecutive_failures} ciclos sin servidores. Seguirá reintentando...")
-                return
-            
-            # Log de servidores con los que se va a intentar sincronizar
-            server_urls = [s.get('url', '?') for s in servers_list]
-            print(f"[SyncManager] Sincronizando con {len(servers_list)} servidor(es): {', '.join(server_urls)}")
-            
-            # Intentar sincronizar con TODOS los servidores disponibles
-            any_success = False
-            all_failed = True
-            
-            for server_info in servers_list:
-                server_url = server_info.get('url')
-                if not server_url:
-                    continue
+        with tracer.span('sync') as sync_span:
+            try:
+                client_id = self.client_id
                 
-                # Verificar si el servidor está disponible
-                try:
-                    print(f"[SyncManager]   -> Verificando {server_url} ...", flush=True)
-                    health_response = requests.get(f"{server_url}/api/health", timeout=3)
-                    if health_response.status_code != 200:
-                        print(f"[SyncManager] {server_url} - health check falló (status {health_response.status_code}), saltando")
+                # Obtener lista de servidores conocidos
+                servers_list = get_available_servers()
+                
+                if not servers_list:
+                    with self._lock:
+                        self._consecutive_failures += 1
+                    if self._consecutive_failures == 1:
+                        print("[SyncManager] No hay servidores conocidos. Esperando descubrimiento por broadcast...")
+                    elif self._consecutive_failures % 5 == 0:
+                        print(f"[SyncManager] {self._consecutive_failures} ciclos sin servidores. Seguirá reintentando...")
+                    sync_span.fail('Sin servidores conocidos')
+                    return
+                
+                # Primero los dueños del cliente (en su orden), después el último servidor
+                # con sync exitoso ("servidor de casa") y luego el resto
+                servers_list = self._order_by_preference(servers_list)
+                
+                # Log de servidores con los que se va a intentar sincronizar
+                server_urls = [s.get('url', '?') for s in servers_list]
+                print(f"[SyncManager] Sincronizando con {len(servers_list)} servidor(es): {', '.join(server_urls)}")
+                sync_span.set(servers=len(servers_list))
+                
+                # Intentar sincronizar con TODOS los servidores disponibles
+                any_success = False
+                all_failed = True
+                synced_servers = []
+                failed_servers = set()
+                
+                for server_info in servers_list:
+                    server_url = server_info.get('url')
+                    if not server_url:
                         continue
-                except requests.exceptions.RequestException as e:
-                    print(f"[SyncManager] {server_url} - health check falló ({type(e).__name__}: {e}), saltando")
-                    continue
+                    
+                    # Verificar si el servidor está disponible
+                    health_span = tracer.span('sync.health', server=server_url)
+                    try:
+                        print(f"[SyncManager]   -> Verificando {server_url} ...", flush=True)
+                        t0 = time.time()
+                        with health_span:
+                            health_response = requests.get(f"{server_url}/api/health", timeout=3)
+                            health_span.set(status=health_response.status_code)
+                            if health_response.status_code != 200:
+                                health_span.fail(f"status {health_response.status_code}")
+                        t3 = time.time()
+                        elapsed_ms = round((t3 - t0) * 1000)
+                        if health_response.status_code != 200:
+                            self._record_health(server_url, False, elapsed_ms, status=health_response.status_code)
+                            print(f"[SyncManager] {server_url} - health check falló (status {health_response.status_code}), saltando")
+                            failed_servers.add(server_url)
+                            continue
+                        self._record_health(server_url, True, elapsed_ms, status=200)
+                        # Ya estamos sincronizando: solo registrar la época, sin agendar otro sync
+                        try:
+                            health_data = health_response.json()
+                        except ValueError:
+                            health_data = {}
+                        self.note_server_epoch(server_url, health_data.get('epoch'), schedule_resync=False)
+                        # Muestra de offset de reloj (estilo NTP) con el mismo request
+                        _clock_offsets.observe(server_url, t0, t3, health_data.get('server_time'))
+                        server_replicates = bool(health_data.get('replication'))
+                    except requests.exceptions.RequestException as e:
+                        self._record_health(server_url, False, error=f"{type(e).__name__}: {str(e)[:200]}")
+                        print(f"[SyncManager] {server_url} - health check falló ({type(e).__name__}: {e}), saltando")
+                        failed_servers.add(server_url)
+                        continue
+                    
+                    all_failed = False
+                    
+                    # Sincronizar con este servidor
+                    with tracer.span('sync.server', server=server_url) as server_span:
+                        sync_started = time.perf_counter()
+                        success = self._sync_with_server(client_id, server_url)
+                        self._record_sync(server_url, success,
+                                          round((time.perf_counter() - sync_started) * 1000))
+                        if not success:
+                            server_span.fail('Sync fallido')
+                    if success:
+                        print(f"[SyncManager] [OK] Sync exitoso con {server_url}")
+                        any_success = True
+                        synced_servers.append(server_url)
+                        if REGISTRY_AVAILABLE:
+                            reset_server_timeout_count(server_url)
+                        if server_replicates:
+                            # El servidor replica el estado a sus peers: no hace falta
+                            # reportar a cada uno (evita tráfico clientes × servidores)
+                            break
+                    else:
+                        print(f"[SyncManager] [ERROR] Sync fallido con {server_url}")
+                        failed_servers.add(server_url)
+                        if REGISTRY_AVAILABLE:
+                            increment_server_timeouts([server_url])
+                
+                if all_failed:
+                    with self._lock:
+                        self._consecutive_failures += 1
+                    if self._consecutive_failures == 1:
+                        print(f"[SyncManager] Ningún servidor respondió. Reintentando en {self._sync_interval}s...")
+                    elif self._consecutive_failures % 5 == 0:
+                        print(f"[SyncManager] {self._consecutive_failures} intentos fallidos consecutivos.")
+                    
+                    # Buscar servidores activamente (pueden haber cambiado de IP)
+                    request_discovery_probe()
+                    
+                    sync_span.fail('Ningún servidor respondió')
+                    # Si el cliente no se ha registrado aún, intentar registrarlo
+                    if not self._client_registered:
+                        self._try_register(client_id)
+                    return
                 
-                all_failed = False
+                success = any_success
                 
-                # Sincronizar con este servidor
-                success = self._sync_with_server(client_id, server_url)
                 if success:
-                    print(f"[SyncManager] [OK] Sync exitoso con {server_url}")
-                    any_success = True
-                    if REGISTRY_AVAILABLE:
-                        reset_server_timeout_count(server_url)
+                    with self._lock:
+                        self._consecutive_failures = 0
+                        # Failover (telemetría): el servidor de casa falló y se sincronizó con otro
+                        if self._last_successful_server in failed_servers:
+                            self._failovers += 1
+                        self._last_successful_server = synced_servers[0]
+                        self._client_registered = True
+                    sync_span.set(synced=len(synced_servers))
+                    # Re-enviar las transiciones acumuladas (ej: durante una caída)
+                    self._flush_outbox(self.client_id, synced_servers)
                 else:
-                    print(f"[SyncManager] [ERROR] Sync fallido con {server_url}")
-                    if REGISTRY_AVAILABLE:
-                        increment_server_timeouts([server_url])
+                    with self._lock:
+                        self._consecutive_failures += 1
             
-            if all_failed:
-                with self._lock:
-                    self._consecutive_failures += 1
-                if self._consecutive_failures == 1:
-                    print(f"[SyncManager] Ningún servidor respondió. Reintentando en {self._sync_interval}s...")
-                elif self._consecutive_failures % 5 == 0:
-                    print(f"[SyncManager] {self._consecutive_failures} intentos fallidos consecutivos.")
-                
-                # Si el cliente no se ha registrado aún, intentar registrarlo
-                if not self._client_registered:
-                    self._try_register(client_id)
-                return
-            
-            success = any_success
-            
-            if success:
-                with self._lock:
-                    self._consecutive_failures = 0
-                    self._last_successful_server = server_url
-                    self._client_registered = True
-            else:
+            except Exception as e:
                 with self._lock:
                     self._consecutive_failures += 1
+                sync_span.fail(f"{type(e).__name__}: {e}")
+                print(f"[SyncManager] Error durante sincronización: {e}")
+                if self._consecutive_failures % 5 == 0:
+                    print(f"[SyncManager] {self._consecutive_failures} intentos fallidos. El cliente sigue funcionando offline.")
+    
+    @traced('sync.outbox')
+    def _flush_outbox(self, client_id, server_urls):
+        """
+        Envía el outbox pendiente en un único request batch a cada servidor alcanzable.
+        Los eventos confirmados por al menos un servidor se descartan; los servidores
+        deduplican por clave, así un reintento nunca se aplica dos veces.
+        """
+        entries = _state_outbox.pending()
+        if not entries or not server_urls:
+            return
         
-        except Exception as e:
-            with self._lock:
-                self._consecutive_failures += 1
-            print(f"[SyncManager] Error durante sincronización: {e}")
-            if self._consecutive_failures % 5 == 0:
-                print(f"[SyncManager] {self._consecutive_failures} intentos fallidos. El cliente sigue funcionando offline.")
+        acked = set()
+        for server_url in server_urls:
+            try:
+                response = requests.post(
+                    f"{server_url}/api/client/{client_id}/report-batch",
+                    json={'events': outbox_events_for_server(entries, server_url)},
+                    timeout=10
+                )
+                if response.status_code == 200:
+                    acked.update(response.json().get('accepted', []))
+            except Exception as e:
+                print(f"[Outbox] No se pudo enviar batch a {server_url}: {e}")
+        
+        if acked:
+            _state_outbox.ack(acked)
+            print(f"[Outbox] {len(acked)} evento(s) re-enviado(s) a {len(server_urls)} servidor(es)")
     
     def _try_register(self, client_id):
         """Intenta registrar el cliente con algún servidor disponible."""
@@ -1235,11 +1966,21 @@ class SyncManager:
         Retorna True si la sincronización fue exitosa.
         """
         try:
-            # Verificar si el cliente existe en este servidor
-            response = requests.get(
-                f"{server_url}/api/client/{client_id}/status",
-                timeout=10
-            )
+            # Verificar si el cliente existe en este servidor. El ack confirma los
+            # comandos de la cola ya aplicados para que el servidor deje de enviarlos.
+            params = None
+            if get_state_version('command_queue'):
+                params = {'ack': get_state_version('command'),
+                          'queue': get_state_version('command_queue')}
+            with tracer.span('sync.status') as span:
+                # La telemetría del sync viaja en el mismo request (sin tráfico extra)
+                response = requests.get(
+                    f"{server_url}/api/client/{client_id}/status",
+                    params=params,
+                    headers={TELEMETRY_HEADER: self.build_telemetry()},
+                    timeout=10
+                )
+                span.set(status=response.status_code)
             
             if response.status_code == 404:
                 # Cliente no encontrado en ESTE servidor - registrar directamente
@@ -1264,13 +2005,21 @@ class SyncManager:
                 reset_server_timeout_count(server_url)
             
             data = response.json()
+            self._note_owners((data.get('client') or {}).get('owners'))
+            
+            # Comandos del admin que el push no entregó (ej: la PC estaba reiniciando)
+            client_info = data.get('client') or {}
+            if client_info.get('commands'):
+                with tracer.span('sync.commands', count=len(client_info['commands'])):
+                    apply_server_commands(client_info.get('commands'), client_info.get('command_queue'), server_url)
             
             # Actualizar lista de servidores conocidos si el servidor la envía
             if 'known_servers' in data and REGISTRY_AVAILABLE:
                 self._update_servers_from_response(data, server_url)
             
             # REPORTAR el estado local al servidor (el cliente es la fuente de verdad)
-            self._report_state_to_server(client_id, server_url)
+            self._report_state_to_server(client_id, server_url,
+                                         server_session=(data.get('client') or {}).get('session'))
             
             # Enviar lista de servidores conocidos al servidor
             if REGISTRY_AVAILABLE:
@@ -1289,62 +2038,56 @@ class SyncManager:
             print(f"[SyncManager] Error inesperado con {server_url}: {e}")
             return False
     
-    def _report_state_to_server(self, client_id, server_url):
+    def _report_state_to_server(self, client_id, server_url, server_session=None):
         """
         Reporta el estado actual del cliente al servidor.
         Incluye sesión, configuración y nombre.
         El cliente es la fuente de verdad.
+        
+        Args:
+            server_session: Sesión que el servidor devolvió en /status. Si ya es la
+                            misma que la local, no se reporta.
         """
         if not REGISTRY_AVAILABLE:
             return
         
-        # Reportar sesión actual (activa o expirada)
-        session_info = get_session_info()
-        if session_info and not session_info['is_expired'] and session_info['remaining_seconds'] > 0:
-            report_session_to_server(client_id, server_url=server_url)
-        else:
-            # Informar al server la sesión expirada (con time_limit para que muestre EXPIRADO)
-            # o que no hay sesión (time_limit=0)
-            try:
-                time_limit = 0
-                if session_info:
-                    session_data = get_session_from_registry()
-                    if session_data:
-                        time_limit = session_data.get('time_limit_seconds', 0)
-                requests.post(
-                    f"{server_url}/api/client/{client_id}/report-session",
-                    json={'remaining_seconds': 0, 'time_limit_seconds': time_limit},
-                    timeout=5
-                )
-            except:
-                pass
+        # Reportar sesión actual (activa, expirada con time_limit, o sin sesión)
+        try:
+            session_payload = with_session_end_ts(build_session_report(), server_url)
+            if session_payload and not server_session_matches(session_payload, server_session):
+                with tracer.span('sync.report_session') as span:
+                    response = requests.post(
+                        f"{server_url}/api/client/{client_id}/report-session",
+                        json=session_payload,
+                        timeout=10
+                    )
+                    span.set(status=response.status_code)
+                result = response.json() if response.status_code == 200 else {}
+                if result.get('stale'):
+                    adopt_server_state('session', result, server_url)
+                # El deadline del servidor ya venció (ej: el push de bloqueo no llegó)
+                elif result.get('lock'):
+                    apply_server_lock()
+        except Exception:
+            pass
         
         # Reportar configuración y nombre
         try:
-            config_data = get_config_from_registry()
-            if config_data:
-                config_payload = {}
-                if config_data.get('custom_name'):
-                    config_payload['custom_name'] = config_data['custom_name']
-                if config_data.get('sync_interval'):
-                    config_payload['sync_interval'] = config_data['sync_interval']
-                if config_data.get('alert_thresholds'):
-                    config_payload['alert_thresholds'] = config_data['alert_thresholds']
-                if config_data.get('max_server_timeouts'):
-                    config_payload['max_server_timeouts'] = config_data['max_server_timeouts']
-                if config_data.get('lock_recheck_interval'):
-                    config_payload['lock_recheck_interval'] = config_data['lock_recheck_interval']
-                
-                if config_payload:
-                    config_payload['from_client'] = True
-                    requests.post(
+            config_payload = build_config_report()
+            if config_payload:
+                with tracer.span('sync.report_config') as span:
+                    response = requests.post(
                         f"{server_url}/api/client/{client_id}/config",
                         json=config_payload,
                         timeout=5
                     )
+                    span.set(status=response.status_code)
+                if response.status_code == 200 and response.json().get('stale'):
+                    adopt_server_state('config', response.json(), server_url)
         except Exception:
             pass
     
+    @traced('sync.register')
     def _register_on_server(self, client_id, server_url):
         """
         Registra el cliente directamente en un servidor específico.
@@ -1374,7 +2117,7 @@ class SyncManager:
                 client_ip = s.getsockname()[0]
                 s.close()
                 register_data['client_ip'] = client_ip
-                register_data['diagnostic_port'] = 5002
+                register_data['diagnostic_port'] = DIAGNOSTIC_PORT
             except:
                 pass
             
@@ -1385,18 +2128,18 @@ class SyncManager:
                     session_data = get_session_from_registry()
                     if session_data:
                         remaining = max(0, session_info['remaining_seconds'])
-                        register_data['session'] = {
+                        register_data['session'] = with_state_version(with_session_end_ts({
                             'remaining_seconds': remaining,
                             'time_limit_seconds': session_data.get('time_limit_seconds', remaining or 0)
-                        }
+                        }, server_url), 'session')
                 
                 # Incluir configuración
                 if config_data:
-                    register_data['config'] = {
+                    register_data['config'] = with_state_version({
                         'sync_interval': config_data.get('sync_interval', 30),
                         'alert_thresholds': config_data.get('alert_thresholds', [600, 300, 120, 60]),
                         'custom_name': custom_name
-                    }
+                    }, 'config')
                 
                 # Incluir servidores conocidos
                 known_servers = get_servers_from_registry()
@@ -1410,6 +2153,7 @@ class SyncManager:
             
             if response.status_code == 201:
                 data = response.json()
+                self._note_owners(data.get('owners'))
                 known_servers_resp = data.get('known_servers', [])
                 
                 # Merge servidores (NO reemplazar, para no perder descubiertos por broadcast)
@@ -1443,6 +2187,7 @@ class SyncManager:
             print(f"[SyncManager] Error inesperado al registrar en {server_url}: {e}")
             return False
     
+    @traced('sync.servers_update')
     def _update_servers_from_response(self, data, server_url):
         """Actualiza la lista de servidores conocidos desde la respuesta del servidor."""
         try:
@@ -1491,16 +2236,15 @@ class SyncManager:
         time_limit = session.get('time_limit_seconds', 0)
         start_time = session.get('start_time')
         end_time = session.get('end_time')
-        remaining_from_server = session.get('remaining_seconds', 0)
         
         if not all([time_limit, start_time, end_time]):
             print(f"[SyncManager] [WARN]  Datos de sesión incompletos desde {server_url}")
             return
         
-        now_local = datetime.now()
-        end_time_local = now_local + timedelta(seconds=remaining_from_server)
-        elapsed_seconds = time_limit - remaining_from_server
-        start_time_local = now_local - timedelta(seconds=elapsed_seconds)
+        start_time_local, end_time_local, remaining_from_server = local_session_times(session, server_url)
+        if local_session_matches(time_limit, end_time_local):
+            # Misma sesión: no reescribir el registro
+            return
         
         if REGISTRY_AVAILABLE:
             save_session_to_registry(
@@ -1508,6 +2252,7 @@ class SyncManager:
                 start_time_iso=start_time_local.isoformat(),
                 end_time_iso=end_time_local.isoformat()
             )
+            note_state_version('session', session.get('version'))
             
             # Detectar nueva sesión o cambio drástico para resetear alertas
             if last_known_remaining is None or abs(last_known_remaining - remaining_from_server) > 120:
@@ -1530,6 +2275,7 @@ class SyncManager:
             # No hay sesión válida en ningún lado
             clear_session_from_registry()
     
+    @traced('sync.send_servers')
     def _send_servers_to_server(self, known_servers, server_url):
         """Envía la lista de servidores conocidos al servidor para sincronización."""
         try:
@@ -1544,11 +2290,304 @@ class SyncManager:
                 sync_data = sync_response.json()
                 updated_servers = sync_data.get('known_servers', [])
                 if updated_servers and REGISTRY_AVAILABLE:
+                    # Conservar campos locales que el servidor no conoce
+                    confirmed = {s.get('url'): s['confirmed_at'] for s in known_servers if s.get('confirmed_at')}
+                    for server in updated_servers:
+                        if server.get('url') in confirmed:
+                            server['confirmed_at'] = confirmed[server['url']]
                     save_servers_to_registry(updated_servers)
         except Exception:
             pass
 
 
+class PropagationWorker:
+    """
+    Propaga el estado local a todos los servers después de recibir un push.
+    
+    Hay un único hilo worker. Los pedidos se coalescen: si llegan varios push
+    mientras se propaga, se hace UNA propagación más con el estado más reciente.
+    El envío a los servers es concurrente y con deadline, sin health check previo
+    (un POST fallido equivale a server caído), así los demás paneles convergen
+    en un RTT.
+    """
+    
+    # Tiempo máximo que se espera a los servers en cada ronda (segundos)
+    PROPAGATION_DEADLINE = 5
+    # Requests concurrentes como máximo
+    MAX_PARALLEL = 8
+    
+    def __init__(self):
+        self._pending = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._origin_host = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.MAX_PARALLEL,
+            thread_name_prefix='propagation'
+        )
+    
+    def request(self, origin_host=None):
+        """
+        Pide una propagación. No bloquea.
+        
+        Args:
+            origin_host: IP del server que envió el push. Ya conoce el cambio,
+                         así que se omite si todos los push pendientes vienen de él.
+        """
+        with self._lock:
+            if self._pending.is_set() and self._origin_host != origin_host:
+                self._origin_host = None
+            elif not self._pending.is_set():
+                self._origin_host = origin_host
+            self._pending.set()
+            
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            self._pending.wait()
+            with self._lock:
+                origin_host = self._origin_host
+                self._origin_host = None
+                self._pending.clear()
+            try:
+                self._propagate(origin_host)
+            except Exception as e:
+                print(f"[Propagación] Error: {e}")
+    
+    @traced('propagate')
+    def _propagate(self, origin_host):
+        """Envía sesión y configuración actuales a todos los servers en paralelo."""
+        client_id = get_known_client_id()
+        if not client_id:
+            return
+        
+        session_payload = build_session_report()
+        if session_payload is None:
+            return
+        config_payload = build_config_report()
+        
+        server_urls = []
+        for server_info in get_available_servers():
+            server_url = server_info.get('url')
+            if not server_url:
+                continue
+            if origin_host and urlparse(server_url).hostname == origin_host:
+                continue
+            server_urls.append(server_url)
+        
+        if not server_urls:
+            return
+        
+        # Los reportes corren en el executor: cuelgan del span de esta ronda
+        parent_span = tracer.current()
+        futures = [
+            self._executor.submit(self._report_to_server, server_url, client_id,
+                                  session_payload, config_payload, parent_span)
+            for server_url in server_urls
+        ]
+        done, not_done = concurrent.futures.wait(futures, timeout=self.PROPAGATION_DEADLINE)
+        ok_count = sum(1 for f in done if not f.exception() and f.result())
+        
+        if parent_span is not None:
+            parent_span.set(servers=len(server_urls), ok=ok_count, timed_out=len(not_done))
+        print(f"[Propagación] Estado propagado a {ok_count}/{len(server_urls)} servidor(es)" +
+              (f" ({len(not_done)} sin respuesta antes del deadline)" if not_done else ""))
+    
+    def _report_to_server(self, server_url, client_id, session_payload, config_payload,
+                          parent_span=None):
+        """Reporta el estado a UN server. Retorna True si la sesión fue aceptada."""
+        with tracer.span('propagate.server', parent=parent_span, server=server_url) as span:
+            accepted = self._post_state(server_url, client_id, session_payload, config_payload)
+            if not accepted:
+                span.fail('Sesión no aceptada')
+            return accepted
+    
+    def _post_state(self, server_url, client_id, session_payload, config_payload):
+        """POST de sesión y configuración a UN server."""
+        timeout = (2, self.PROPAGATION_DEADLINE)
+        try:
+            response = requests.post(
+                f"{server_url}/api/client/{client_id}/report-session",
+                json=with_session_end_ts(session_payload, server_url),
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                return False
+            if response.json().get('stale'):
+                # Hubo otro cambio del admin después del que se propaga
+                adopt_server_state('session', response.json(), server_url)
+            if config_payload:
+                response = requests.post(
+                    f"{server_url}/api/client/{client_id}/config",
+                    json=config_payload,
+                    timeout=timeout
+                )
+                if response.status_code == 200 and response.json().get('stale'):
+                    adopt_server_state('config', response.json(), server_url)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+
+_propagation_worker = None
+_propagation_worker_lock = threading.Lock()
+
+def get_propagation_worker():
+    """Obtiene el PropagationWorker único del proceso (lo crea la primera vez)."""
+    global _propagation_worker
+    with _propagation_worker_lock:
+        if _propagation_worker is None:
+            _propagation_worker = PropagationWorker()
+        return _propagation_worker
+
+def get_known_client_id():
+    """
+    Client ID ya conocido (SyncManager o registro), sin registrar contra servers.
+    Retorna None si todavía no hay ID local.
+    """
+    if _sync_manager is not None:
+        return _sync_manager.client_id
+    if REGISTRY_AVAILABLE:
+        return get_client_id_from_registry()
+    return None
+
+
+class DiscoveredServerCache:
+    """
+    Vista en memoria de los servidores anunciados por broadcast/probe.
+    
+    Cada servidor se anuncia una vez por segundo; escribir el registro en cada
+    anuncio solo para actualizar last_seen genera decenas de miles de escrituras
+    por día. El cache deduplica los anuncios y solo persiste servidores nuevos,
+    cambios de IP/puerto, o un last_seen con antigüedad de LAST_SEEN_PERSIST_INTERVAL.
+    También recuerda (persistido en el registro como confirmed_at) cuándo se
+    confirmó cada servidor vía /api/register-server, para no repetirlo en cada reinicio.
+    """
+    
+    # Segundos mínimos entre escrituras de last_seen para un mismo servidor
+    LAST_SEEN_PERSIST_INTERVAL = 300
+    # Segundos mínimos entre confirmaciones /api/register-server a un mismo servidor
+    CONFIRM_INTERVAL = 6 * 3600
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = None  # url -> {'ip', 'port', 'persisted_at', 'confirmed_at'}
+    
+    @staticmethod
+    def _parse_timestamp(value):
+        try:
+            return datetime.fromisoformat(value).timestamp() if value else None
+        except (TypeError, ValueError):
+            return None
+    
+    def _ensure_loaded(self):
+        if self._servers is not None:
+            return
+        self._servers = {}
+        if REGISTRY_AVAILABLE:
+            for server in get_servers_from_registry():
+                url = server.get('url')
+                if url:
+                    self._servers[url] = {
+                        'ip': server.get('ip'),
+                        'port': server.get('port'),
+                        # 0: el primer anuncio tras reiniciar refresca last_seen una vez
+                        'persisted_at': 0,
+                        'confirmed_at': self._parse_timestamp(server.get('confirmed_at'))
+                    }
+    
+    def observe(self, server_url, server_ip, server_port):
+        """
+        Registra un anuncio. Persiste solo si el servidor es nuevo, cambió de
+        IP/puerto o su last_seen persistido quedó viejo.
+        
+        Returns:
+            True si el servidor no estaba en el registro (nuevo).
+        """
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._servers.get(server_url)
+            is_new = entry is None
+            if is_new:
+                entry = {'ip': server_ip, 'port': server_port, 'persisted_at': 0, 'confirmed_at': None}
+                self._servers[server_url] = entry
+            
+            changed = entry['ip'] != server_ip or entry['port'] != server_port
+            if changed:
+                entry['ip'] = server_ip
+                entry['port'] = server_port
+            
+            if not (is_new or changed or now - entry['persisted_at'] >= self.LAST_SEEN_PERSIST_INTERVAL):
+                return False
+            entry['persisted_at'] = now
+            snapshot = dict(entry)
+        
+        self._persist(server_url, snapshot)
+        return is_new
+    
+    def should_confirm(self, server_url):
+        """True si nunca se confirmó este servidor o pasó CONFIRM_INTERVAL."""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._servers.get(server_url)
+            confirmed_at = entry.get('confirmed_at') if entry else None
+        return confirmed_at is None or time.time() - confirmed_at >= self.CONFIRM_INTERVAL
+    
+    def mark_confirmed(self, server_url):
+        """Guarda el momento de la confirmación para respetarlo entre reinicios."""
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._servers.get(server_url)
+            if entry is None:
+                return
+            entry['confirmed_at'] = now
+            entry['persisted_at'] = now
+            snapshot = dict(entry)
+        self._persist(server_url, snapshot)
+    
+    def _persist(self, server_url, entry):
+        """Actualiza (o agrega) el servidor en la lista del registro."""
+        if not REGISTRY_AVAILABLE:
+            return
+        # Leer la lista actual: el SyncManager también la modifica
+        known_servers = get_servers_from_registry()
+        now_iso = datetime.now().isoformat()
+        confirmed_iso = (datetime.fromtimestamp(entry['confirmed_at']).isoformat()
+                         if entry.get('confirmed_at') else None)
+        
+        for server in known_servers:
+            if server.get('url') == server_url:
+                server['last_seen'] = now_iso
+                if entry.get('ip'):
+                    server['ip'] = entry['ip']
+                if entry.get('port'):
+                    server['port'] = entry['port']
+                if confirmed_iso:
+                    server['confirmed_at'] = confirmed_iso
+                break
+        else:
+            new_server = {
+                'url': server_url,
+                'ip': entry.get('ip'),
+                'port': entry.get('port'),
+                'last_seen': now_iso
+            }
+            if confirmed_iso:
+                new_server['confirmed_at'] = confirmed_iso
+            known_servers.append(new_server)
+            print(f"[Discovery] Nuevo servidor registrado: {server_url}")
+        
+        save_servers_to_registry(known_servers)
+
+
+_discovered_servers = DiscoveredServerCache()
+
+
 def start_server_discovery_listener():
     """
     Inicia un servidor UDP que escucha broadcasts de nuevos servidores.
@@ -1556,7 +2595,6 @@ def start_server_discovery_listener():
     """
     def listener_thread():
         # Puerto para recibir broadcasts de servidores
-        DISCOVERY_PORT = 5001
         broadcast_count = 0
         last_broadcast_time = None
         
@@ -1588,6 +2626,11 @@ def start_server_discovery_listener():
             
             sock.settimeout(1.0)  # Timeout para poder verificar si el thread debe continuar
             
+            # Recibir también anuncios multicast (servidores en modo multicast/both)
+            multicast_group = get_discovery_multicast_group()
+            if not _join_discovery_multicast(sock, multicast_group):
+                multicast_group = None
+            
             print(f"[Discovery] [OK] Escuchando broadcasts de servidores en puerto {DISCOVERY_PORT}...")
             print(f"[Discovery] [OK] El listener está activo y escuchando...")
             print(f"[Discovery] Esperando broadcasts UDP desde la red local...")
@@ -1601,7 +2644,26 @@ def start_server_discovery_listener():
             
             known_server_urls = set()  # Para trackear qué servers ya conocemos
             
+            # Probe inmediato: los servidores con clientes no emiten anuncios,
+            # pero responden consultas en DISCOVERY_QUERY_PORT
+            _send_discovery_probe(sock, multicast_group)
+            probe_interval = DISCOVERY_PROBE_MIN_INTERVAL
+            next_probe_at = time.time() + probe_interval
+            
             while True:
+                # Re-probar con backoff mientras no haya respuestas, o si el
+                # SyncManager lo pidió porque ningún servidor respondió
+                now = time.time()
+                if _discovery_probe_requested.is_set():
+                    _discovery_probe_requested.clear()
+                    _send_discovery_probe(sock, multicast_group)
+                    probe_interval = DISCOVERY_PROBE_MIN_INTERVAL
+                    next_probe_at = now + probe_interval
+                elif not known_server_urls and now >= next_probe_at:
+                    _send_discovery_probe(sock, multicast_group)
+                    probe_interval = min(probe_interval * 2, DISCOVERY_PROBE_MAX_INTERVAL)
+                    next_probe_at = now + probe_interval
+                
                 try:
                     data, addr = sock.recvfrom(1024)
                     broadcast_count += 1
@@ -1619,8 +2681,19 @@ def start_server_discovery_listener():
                         server_info = json.loads(data.decode('utf-8'))
                     except json.JSONDecodeError:
                         continue
+                    if not isinstance(server_info, dict):
+                        continue
+                    
+                    if server_info.get('type') == 'offer':
+                        # Respuesta unicast a un probe nuestro
+                        _discovery_stats['offers_received'] += 1
                     
                     server_url = server_info.get('url')
+                    
+                    # Época nueva = el servidor reinició: re-sincronizar con jitter
+                    if _sync_manager is not None and server_info.get('epoch'):
+                        _sync_manager.note_server_epoch(
+                            server_url, server_info['epoch'], server_info.get('resync_window'))
                     server_ip = server_info.get('ip', addr[0])
                     server_port = server_info.get('port', 5000)
                     
@@ -1630,46 +2703,29 @@ def start_server_discovery_listener():
                     if server_url:
                         is_new = server_url not in known_server_urls
                         
-                        # Registrar el servidor en nuestra lista
-                        if REGISTRY_AVAILABLE:
-                            known_servers = get_servers_from_registry()
-                            
-                            server_exists = False
-                            for server in known_servers:
-                                if server.get('url') == server_url:
-                                    server['last_seen'] = datetime.now().isoformat()
-                                    if server_ip:
-                                        server['ip'] = server_ip
-                                    if server_port:
-                                        server['port'] = server_port
-                                    save_servers_to_registry(known_servers)
-                                    server_exists = True
-                                    break
-                            
-                            if not server_exists:
-                                known_servers.append({
-                                    'url': server_url,
-                                    'ip': server_ip,
-                                    'port': server_port,
-                                    'last_seen': datetime.now().isoformat()
-                                })
-                                save_servers_to_registry(known_servers)
-                                print(f"[Discovery] Nuevo servidor registrado: {server_url}")
+                        # Dedup en memoria: solo escribe el registro si hay algo nuevo
+                        _discovered_servers.observe(server_url, server_ip, server_port)
                         
                         # Solo loguear la primera vez que vemos este server
                         if is_new:
                             known_server_urls.add(server_url)
                             print(f"[Discovery] Servidor detectado: {server_url} ({server_ip}:{server_port})")
                             
-                            # Confirmar con el servidor
-                            try:
-                                requests.post(
-                                    f"{server_url}/api/register-server",
-                                    json={'url': server_url, 'ip': server_ip, 'port': server_port},
-                                    timeout=2
-                                )
-                            except Exception:
-                                pass
+                            # Confirmar con el servidor (limitado también entre reinicios)
+                            if _discovered_servers.should_confirm(server_url):
+                                with tracer.span('discovery.confirm', server=server_url,
+                                                 via=server_info.get('type', 'announce')) as span:
+                                    try:
+                                        response = requests.post(
+                                            f"{server_url}/api/register-server",
+                                            json={'url': server_url, 'ip': server_ip, 'port': server_port},
+                                            timeout=2
+                                        )
+                                        span.set(status=response.status_code)
+                                        if response.status_code == 200:
+                                            _discovered_servers.mark_confirmed(server_url)
+                                    except Exception as e:
+                                        span.fail(f"{type(e).__name__}: {e}")
                         
                 except socket.timeout:
                     current_time = time.time()
@@ -1710,17 +2766,91 @@ def start_server_discovery_listener():
 
 # Variables globales para el servidor de diagnóstico
 _diagnostic_server = None
+# SyncManager activo (lo setea monitor_time). El servidor de diagnóstico
+# lee de acá el health cacheado en lugar de consultar servidores inline.
+_sync_manager = None
+# Cupos para endpoints de diagnóstico. Los push del servidor NO usan cupo,
+# así un diagnóstico lento nunca demora un comando del admin.
+DIAGNOSTIC_MAX_CONCURRENT = 4
+_diagnostic_slots = threading.BoundedSemaphore(DIAGNOSTIC_MAX_CONCURRENT)
 _discovery_stats = {
     'broadcast_count': 0,
     'last_broadcast_time': None,
     'last_broadcast_from': None,
     'servers_discovered': set(),
-    'listener_started': False
+    'listener_started': False,
+    'probes_sent': 0,
+    'offers_received': 0
 }
 
+# Puerto UDP donde los servidores responden probes de descubrimiento
+DISCOVERY_QUERY_PORT = 5003
+# Grupo multicast de descubrimiento (debe coincidir con multicast_group del servidor;
+# se puede sobreescribir con 'multicast_group' en la config del registro)
+DISCOVERY_MULTICAST_GROUP = '239.255.77.77'
+# Backoff entre probes mientras no se conozca ningún servidor
+DISCOVERY_PROBE_MIN_INTERVAL = 1
+DISCOVERY_PROBE_MAX_INTERVAL = 60
+_discovery_probe_requested = threading.Event()
+
+def request_discovery_probe():
+    """Pide al listener de descubrimiento que envíe un probe en su próxima vuelta."""
+    _discovery_probe_requested.set()
+
+def get_discovery_multicast_group():
+    """Grupo multicast configurado en el registro, o el default."""
+    if REGISTRY_AVAILABLE:
+        try:
+            group = (get_config_from_registry() or {}).get('multicast_group')
+            if group:
+                return group
+        except Exception:
+            pass
+    return DISCOVERY_MULTICAST_GROUP
+
+def _join_discovery_multicast(sock, group):
+    """Une el socket del listener al grupo multicast (IGMP) para recibir anuncios."""
+    try:
+        membership = socket.inet_aton(group) + socket.inet_aton('0.0.0.0')
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        print(f"[Discovery] [OK] Unido al grupo multicast {group}")
+        return True
+    except OSError as e:
+        print(f"[Discovery] [WARN]  No se pudo unir al grupo multicast {group}: {e}")
+        return False
+
+def _send_discovery_probe(sock, multicast_group=None):
+    """
+    Envía un probe por broadcast (y al grupo multicast si se indica) desde el socket
+    del listener (puerto 5001), así las respuestas unicast de los servidores llegan
+    al mismo socket que los anuncios.
+    """
+    probe = json.dumps({'type': 'discover', 'v': 1}).encode('utf-8')
+    targets = ['255.255.255.255']
+    if multicast_group:
+        targets.append(multicast_group)
+    
+    sent = False
+    for target in targets:
+        try:
+            sock.sendto(probe, (target, DISCOVERY_QUERY_PORT))
+            sent = True
+        except OSError as e:
+            print(f"[Discovery] No se pudo enviar probe a {target}: {e}")
+    if sent:
+        _discovery_stats['probes_sent'] += 1
+        tracer.event('discovery.probe', targets=len(targets))
+    return sent
+
 class DiagnosticHandler(BaseHTTPRequestHandler):
     """Handler HTTP para endpoints de diagnóstico del cliente"""
     
+    # HTTP/1.1 con keep-alive: el servidor puede reutilizar la conexión
+    # para varios push seguidos. Todas las respuestas envían Content-Length.
+    protocol_version = 'HTTP/1.1'
+    # Cerrar conexiones keep-alive inactivas para no acumular threads
+    timeout = 15
+    
     def log_message(self, format, *args):
         """Suprimir logs del servidor HTTP"""
         pass
@@ -1729,6 +2859,18 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
         """Handle GET requests"""
         path = self.path.split('?')[0]
         
+        # Los diagnósticos comparten un cupo limitado; si está lleno se responde
+        # 503 al instante en lugar de encolar threads detrás de tests lentos.
+        if not _diagnostic_slots.acquire(timeout=0.5):
+            self._send_json({'error': 'Diagnóstico ocupado, reintentar'}, 503)
+            return
+        try:
+            self._route_get(path)
+        finally:
+            _diagnostic_slots.release()
+    
+    def _route_get(self, path):
+        """Despacha los endpoints GET de diagnóstico."""
         if path == '/api/diagnostic':
             self._send_diagnostic_info()
         elif path == '/api/servers':
@@ -1739,6 +2881,8 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             self._send_discovery_info()
         elif path == '/api/test-connectivity':
             self._send_connectivity_test()
+        elif path == '/api/trace':
+            self._send_trace()
         elif path == '/':
             self._send_html_dashboard()
         else:
@@ -1747,7 +2891,12 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
     def do_POST(self):
         """Handle POST requests"""
         path = self.path.split('?')[0]
-        
+        with tracer.span('push' if path.startswith('/api/push/') else 'http.post',
+                         path=path, origin=self.client_address[0]):
+            self._route_post(path)
+    
+    def _route_post(self, path):
+        """Despacha los endpoints POST."""
         if path == '/api/add-server':
             self._handle_add_server()
         elif path == '/api/push/session':
@@ -1756,6 +2905,8 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             self._handle_push_config()
         elif path == '/api/push/stop':
             self._handle_push_stop()
+        elif path == '/api/push/lock':
+            self._handle_push_lock()
         else:
             self._send_json({'error': 'Not found'}, 404)
     
@@ -1772,8 +2923,6 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
         Recibe una notificación push del server cuando el admin cambia el tiempo.
         El cliente actualiza su sesión local y luego propaga a todos los servers.
         """
-        global last_known_remaining
-        
         try:
             data = self._read_post_data()
             if not data:
@@ -1789,27 +2938,15 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
                 self._send_json({'success': False, 'message': 'Datos incompletos'}, 400)
                 return
             
-            # Calcular tiempos locales basados en remaining
-            now_local = datetime.now()
-            end_time_local = now_local + timedelta(seconds=remaining)
-            elapsed_seconds = time_limit - remaining
-            start_time_local = now_local - timedelta(seconds=elapsed_seconds)
-            
-            if REGISTRY_AVAILABLE:
-                save_session_to_registry(
-                    time_limit_seconds=time_limit,
-                    start_time_iso=start_time_local.isoformat(),
-                    end_time_iso=end_time_local.isoformat()
-                )
-                
-                # Resetear alertas para la nueva sesión
-                reset_alerts_for_new_session(remaining)
-                last_known_remaining = remaining
+            remaining = apply_session_command(data, host=self.client_address[0])
+            if remaining is None:
+                self._send_json({'success': True, 'message': 'Versión vieja, ignorado'})
+                return
             
             print(f"[Push] Sesión recibida del servidor: {remaining}s restantes ({time_limit}s total)")
             
             # Propagar a todos los servers en background
-            self._trigger_propagation()
+            self._trigger_propagation(data)
             
             self._send_json({'success': True, 'message': f'Sesión actualizada: {remaining}s restantes'})
             
@@ -1831,13 +2968,14 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
                 self._send_json({'success': False, 'message': 'No data'}, 400)
                 return
             
-            if REGISTRY_AVAILABLE:
-                apply_server_config(data)
+            if not apply_config_command(data):
+                self._send_json({'success': True, 'message': 'Versión vieja, ignorado'})
+                return
             
             print(f"[Push] Configuración recibida del servidor: {data}")
             
             # Propagar a todos los servers en background
-            self._trigger_propagation()
+            self._trigger_propagation(data)
             
             self._send_json({'success': True, 'message': 'Configuración actualizada'})
             
@@ -1852,13 +2990,21 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
         Recibe una notificación push del server cuando el admin detiene la sesión.
         """
         try:
-            if REGISTRY_AVAILABLE:
-                clear_session_from_registry()
+            # Consumir el body aunque no se use: con keep-alive, un body sin leer
+            # se interpretaría como el inicio del próximo request
+            try:
+                data = self._read_post_data()
+            except json.JSONDecodeError:
+                data = None
+            
+            if not apply_stop_command(data):
+                self._send_json({'success': True, 'message': 'Versión vieja, ignorado'})
+                return
             
             print(f"[Push] Sesión detenida por el servidor")
             
             # Propagar a todos los servers en background
-            self._trigger_propagation()
+            self._trigger_propagation(data)
             
             self._send_json({'success': True, 'message': 'Sesión detenida'})
             
@@ -1866,65 +3012,39 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             print(f"[Push] Error al procesar push de stop: {e}")
             self._send_json({'success': False, 'message': str(e)}, 500)
     
-    def _trigger_propagation(self):
+    def _handle_push_lock(self):
         """
-        Lanza en background la propagación del estado actual del cliente a todos los servers.
-        Esto se ejecuta después de recibir un push del server, para que todos los demás
-        servers se enteren del cambio.
+        Recibe la orden de bloqueo del server cuando vence el deadline de la sesión
+        (respaldo del bloqueo local si el reloj o el registro fueron manipulados).
         """
-        import threading
-        
-        def _propagate():
+        try:
             try:
-                if not REGISTRY_AVAILABLE:
-                    return
-                
-                client_id = get_client_id()
-                if not client_id:
-                    return
-                
-                servers_list = get_available_servers()
-                if not servers_list:
-                    return
-                
-                session_info = get_session_info()
-                
-                for server_info in servers_list:
-                    server_url = server_info.get('url')
-                    if not server_url:
-                        continue
-                    
-                    try:
-                        # Verificar que el server está vivo
-                        health = requests.get(f"{server_url}/api/health", timeout=3)
-                        if health.status_code != 200:
-                            continue
-                        
-                        if session_info and not session_info['is_expired'] and session_info['remaining_seconds'] > 0:
-                            # Reportar sesión activa
-                            report_session_to_server(client_id, server_url=server_url)
-                        else:
-                            # Reportar sesión expirada (con time_limit) o sin sesión
-                            try:
-                                time_limit = 0
-                                if session_info:
-                                    sd = get_session_from_registry()
-                                    if sd:
-                                        time_limit = sd.get('time_limit_seconds', 0)
-                                requests.post(
-                                    f"{server_url}/api/client/{client_id}/report-session",
-                                    json={'remaining_seconds': 0, 'time_limit_seconds': time_limit},
-                                    timeout=5
-                                )
-                            except:
-                                pass
-                        
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+                data = self._read_post_data()
+            except json.JSONDecodeError:
+                data = None
+            
+            if not apply_server_lock(data) and REGISTRY_AVAILABLE:
+                self._send_json({'success': True, 'message': 'Versión vieja, ignorado'})
+                return
+            
+            self._send_json({'success': True, 'message': 'Bloqueo aplicado'})
+            
+        except Exception as e:
+            print(f"[Push] Error al procesar push de bloqueo: {e}")
+            self._send_json({'success': False, 'message': str(e)}, 500)
+    
+    def _trigger_propagation(self, push_data=None):
+        """
+        Pide al PropagationWorker que propague el estado actual del cliente a todos
+        los servers. Se ejecuta después de recibir un push del server, para que todos
+        los demás servers se enteren del cambio. Push seguidos se coalescen.
         
-        threading.Thread(target=_propagate, daemon=True).start()
+        Si el push viene marcado como replicated, el servidor ya replica el cambio
+        a sus peers y no hace falta propagarlo.
+        """
+        if push_data and push_data.get('replicated'):
+            return
+        get_propagation_worker().request(origin_host=self.client_address[0])
     
     def _handle_add_server(self):
         """Maneja la notificación de un nuevo servidor desde el servidor principal"""
@@ -1995,13 +3115,46 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             traceback.print_exc()
             self._send_json({'success': False, 'message': str(e)}, 500)
     
-    def _send_json(self, data, status=200):
+    def _send_json(self, data, status=200, indent=2):
         """Envía respuesta JSON"""
+        body = json.dumps(data, indent=indent).encode('utf-8')
         self.send_response(status)
         self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(json.dumps(data, indent=2).encode('utf-8'))
+        self.wfile.write(body)
+    
+    def _send_trace(self):
+        """
+        Spans recientes de sincronización, registro, propagación y descubrimiento.
+        
+        Query params:
+            format: 'chrome' (default, para chrome://tracing o ui.perfetto.dev)
+                    u 'otel' (spans estilo OpenTelemetry)
+            limit: cantidad máxima de spans terminados (los más recientes)
+            clear: '1' vacía el buffer después de exportarlo
+        """
+        params = parse_qs(urlparse(self.path).query)
+        trace_format = params.get('format', ['chrome'])[0]
+        try:
+            limit = int(params.get('limit', [0])[0]) or None
+        except ValueError:
+            self._send_json({'success': False, 'message': 'limit debe ser un número'}, 400)
+            return
+        
+        if trace_format == 'chrome':
+            data = tracer.chrome_trace(limit)
+        elif trace_format == 'otel':
+            data = {'success': True, 'tracing': tracer.status(), 'spans': tracer.otel_spans(limit)}
+        else:
+            self._send_json({'success': False, 'message': "format debe ser 'chrome' u 'otel'"}, 400)
+            return
+        
+        if params.get('clear', ['0'])[0] == '1':
+            tracer.clear()
+        # Sin indentar: el buffer completo puede tener miles de spans
+        self._send_json(data, indent=None)
     
     def _send_html_dashboard(self):
         """Envía dashboard HTML de diagnóstico"""
@@ -2112,10 +3265,12 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
     </script>
 </body>
 </html>"""
+        body = html.encode('utf-8')
         self.send_response(200)
         self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(html.encode('utf-8'))
+        self.wfile.write(body)
     
     def _send_diagnostic_info(self):
         """Envía información completa de diagnóstico"""
@@ -2145,21 +3300,16 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             except:
                 pass
         
-        # Probar disponibilidad de servidores
-        for server in known_servers:
-            server_url = server.get('url')
-            if server_url:
-                try:
-                    response = requests.get(f"{server_url}/api/health", timeout=2)
-                    server['available'] = response.status_code == 200
-                except:
-                    server['available'] = False
+        # Disponibilidad según el último health check del SyncManager
+        _annotate_cached_health(known_servers)
         
         self._send_json({
             'success': True,
             'client_id': client_id,
             'server_url': SERVER_URL,
             'registry_available': REGISTRY_AVAILABLE,
+            'platform': backend.status(),
+            'tracing': tracer.status(),
             'session': session_info,
             'known_servers': known_servers,
             'discovery': {
@@ -2167,8 +3317,14 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
                 'broadcast_count': _discovery_stats['broadcast_count'],
                 'last_broadcast_time': _discovery_stats['last_broadcast_time'],
                 'last_broadcast_from': _discovery_stats['last_broadcast_from'],
+                'probes_sent': _discovery_stats['probes_sent'],
+                'offers_received': _discovery_stats['offers_received'],
                 'servers_discovered': list(_discovery_stats['servers_discovered'])
-            }
+            },
+            # ms desde la carga del módulo hasta cada fase del arranque
+            'startup_phases_ms': dict(_startup_phases),
+            # Offset y RTT estimados por servidor
+            'clock_offsets': _clock_offsets.snapshot()
         })
     
     def _send_status_info(self):
@@ -2201,6 +3357,8 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             'broadcast_count': _discovery_stats['broadcast_count'],
             'last_broadcast_time': _discovery_stats['last_broadcast_time'],
             'last_broadcast_from': _discovery_stats['last_broadcast_from'],
+            'probes_sent': _discovery_stats['probes_sent'],
+            'offers_received': _discovery_stats['offers_received'],
             'servers_discovered_count': len(_discovery_stats['servers_discovered']),
             'servers_discovered': list(_discovery_stats['servers_discovered'])
         })
@@ -2211,15 +3369,8 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
         if REGISTRY_AVAILABLE:
             try:
                 known_servers = get_servers_from_registry()
-                # Probar disponibilidad
-                for server in known_servers:
-                    server_url = server.get('url')
-                    if server_url:
-                        try:
-                            response = requests.get(f"{server_url}/api/health", timeout=2)
-                            server['available'] = response.status_code == 200
-                        except:
-                            server['available'] = False
+                # Disponibilidad según el último health check del SyncManager
+                _annotate_cached_health(known_servers)
             except:
                 pass
         
@@ -2303,14 +3454,40 @@ class DiagnosticHandler(BaseHTTPRequestHandler):
             'timestamp': datetime.now().isoformat()
         })
 
-def start_diagnostic_server(port=5002):
+def _annotate_cached_health(known_servers):
+    """
+    Marca cada servidor con el último health check conocido del SyncManager.
+    No hace requests: 'available' queda en None si todavía no hubo chequeo.
+    """
+    health = _sync_manager.get_server_health() if _sync_manager else {}
+    for server in known_servers:
+        info = health.get(server.get('url'))
+        if info:
+            server['available'] = info['available']
+            server['last_check'] = info['checked_at']
+            server['elapsed_ms'] = info.get('elapsed_ms')
+        else:
+            server['available'] = None
+
+
+class ThreadedDiagnosticServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTPServer que atiende cada conexión en su propio thread.
+    Un diagnóstico lento (ej: /api/test-connectivity) no bloquea los push del servidor.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_diagnostic_server(port=DIAGNOSTIC_PORT):
     """Inicia el servidor HTTP de diagnóstico del cliente"""
     global _diagnostic_server
     
     def server_thread():
+        global _diagnostic_server
         try:
             # Escuchar en todas las interfaces (0.0.0.0) para permitir conexiones desde la red
-            server = HTTPServer(('0.0.0.0', port), DiagnosticHandler)
+            server = ThreadedDiagnosticServer(('0.0.0.0', port), DiagnosticHandler)
             _diagnostic_server = server
             
             # Obtener IP local para mostrar en logs
@@ -2358,35 +3535,23 @@ def update_discovery_stats(broadcast_count=None, last_broadcast_time=None, last_
     if server_url is not None:
         _discovery_stats['servers_discovered'].add(server_url)
 
-def monitor_time(client_id):
+def verify_firewall_rule():
     """
-    Monitorea el tiempo restante leyendo del registro local.
-    La sincronización con el servidor corre en un hilo dedicado (SyncManager).
-    Este loop principal solo lee del registro local y maneja el tiempo/bloqueo.
+    Verifica (y si hay permisos, agrega) la regla de firewall para el puerto UDP
+    de descubrimiento. Usa netsh, que puede tardar varios segundos.
     """
-    global alerts_shown  # Declarar al inicio de la función
-    
-    print("=" * 50)
-    print("Cliente CiberMonday iniciado")
-    print("=" * 50)
-    print(f"ID del cliente: {client_id}")
-    print(f"Servidor configurado: {SERVER_URL}")
-    if REGISTRY_AVAILABLE:
-        print("Modo: Registro local + sincronización en hilo dedicado")
-    else:
-        print("Modo: Consulta directa al servidor")
-    print("Esperando asignación de tiempo...")
-    print("=" * 50)
+    if not backend.manages_firewall:
+        return
     
     # Verificar y agregar regla del firewall al iniciar si no existe
     try:
         from firewall_manager import check_firewall_rule, add_firewall_rule, is_admin
-        
+
         print("\n[Firewall] Verificando configuración del firewall...")
-        
+
         if not check_firewall_rule():
             print("[Firewall] [WARN]  La regla del firewall no está configurada")
-            
+
             # Intentar agregar automáticamente si tenemos privilegios de administrador
             if is_admin():
                 print("[Firewall] Intentando agregar regla automáticamente...")
@@ -2403,7 +3568,7 @@ def monitor_time(client_id):
                 print("[Firewall] Para agregar la regla, ejecuta como administrador:")
                 print("[Firewall]   python firewall_manager.py add")
                 print("[Firewall] O desde PowerShell como administrador:")
-                print("[Firewall]   netsh advfirewall firewall add rule name=\"CiberMonday Client UDP Discovery\" dir=in action=allow protocol=UDP localport=5001 enable=yes\n")
+                print(f"[Firewall]   netsh advfirewall firewall add rule name=\"CiberMonday Client UDP Discovery\" dir=in action=allow protocol=UDP localport={DISCOVERY_PORT} enable=yes\n")
         else:
             print("[Firewall] [OK] Regla del firewall configurada correctamente\n")
     except ImportError:
@@ -2414,12 +3579,57 @@ def monitor_time(client_id):
         import traceback
         traceback.print_exc()
         print()
+
+def run_deferred_startup_tasks():
+    """
+    Tareas de arranque que no son necesarias para aplicar la sesión guardada:
+    verificación del firewall, listener de descubrimiento y log de servidores.
+    Corre en background mientras monitor_time ya está bloqueando si corresponde.
+    """
+    verify_firewall_rule()
+    mark_startup_phase('firewall')
     
-    # Iniciar listener de descubrimiento de servidores
     start_server_discovery_listener()
+    mark_startup_phase('descubrimiento')
+    
+    if REGISTRY_AVAILABLE:
+        try:
+            known_servers = get_servers_from_registry()
+            print(f"[Inicio] Servidores conocidos en registro: {len(known_servers)}")
+            if known_servers:
+                print(f"[Inicio] Servidores: {', '.join([s.get('url', 'Unknown') for s in known_servers])}")
+        except Exception as e:
+            print(f"[Inicio] [WARN]  Advertencia: No se pudo leer lista de servidores: {e}")
+    
+    # Importar requests acá (fuera del camino crítico) para que el primer sync no lo pague
+    requests._load()
+    mark_startup_phase('requests')
+
+def monitor_time(client_id):
+    """
+    Monitorea el tiempo restante leyendo del registro local.
+    La sincronización con el servidor corre en un hilo dedicado (SyncManager).
+    Este loop principal solo lee del registro local y maneja el tiempo/bloqueo.
+    """
+    global alerts_shown  # Declarar al inicio de la función
+    
+    print("=" * 50)
+    print("Cliente CiberMonday iniciado")
+    print("=" * 50)
+    print(f"ID del cliente: {client_id}")
+    print(f"Servidor configurado: {SERVER_URL}")
+    if REGISTRY_AVAILABLE:
+        print("Modo: Registro local + sincronización en hilo dedicado")
+    else:
+        print("Modo: Consulta directa al servidor")
+    print("Esperando asignación de tiempo...")
+    print("=" * 50)
     
-    # Iniciar servidor de diagnóstico
-    start_diagnostic_server(port=5002)
+    # Servidor de diagnóstico primero: es liviano y recibe los push del admin
+    start_diagnostic_server(port=DIAGNOSTIC_PORT)
+    
+    # Firewall (netsh) y descubrimiento en background: no demoran el primer chequeo
+    threading.Thread(target=run_deferred_startup_tasks, daemon=True).start()
     
     # Intervalo de sincronización desde configuración (o 30 por defecto)
     try:
@@ -2442,7 +3652,9 @@ def monitor_time(client_id):
     
     # Iniciar hilo de sincronización con SyncManager
     # El SyncManager se encarga de toda la comunicación con servidores
+    global _sync_manager
     sync_manager = SyncManager(client_id, SYNC_INTERVAL)
+    _sync_manager = sync_manager
     sync_manager.start()
     
     last_remaining = None
@@ -2458,6 +3670,7 @@ def monitor_time(client_id):
             # Leer del registro local
             if REGISTRY_AVAILABLE:
                 session_info = get_session_info()
+                mark_startup_phase('primer_chequeo')
                 
                 if session_info is None:
                     # No hay sesión en registro - esperando a que el servidor asigne tiempo
@@ -2475,6 +3688,12 @@ def monitor_time(client_id):
                 # Si es la primera vez que vemos esta sesión, inicializar alertas
                 if last_remaining is None:
                     reset_alerts_for_new_session(remaining_seconds)
+                    if not is_expired and remaining_seconds > 0:
+                        _state_outbox.record('session_started', {
+                            'time_limit_seconds': session_info.get('time_limit_seconds', 0),
+                            'start_time': session_info.get('start_time'),
+                            'end_time': session_info.get('end_time')
+                        })
             else:
                 # Fallback: consultar servidor directamente (sin registro disponible)
                 client_data = check_server_status(client_id)
@@ -2510,8 +3729,14 @@ def monitor_time(client_id):
                     print("[EXPIRACION] Bloqueando PC. Se re-bloqueara si el usuario vuelve a entrar.", flush=True)
                     print("=" * 50, flush=True)
                     result = lock_workstation()
+                    mark_startup_phase('primer_bloqueo')
                     if not result:
                         print("[EXPIRACION] FALLO: lock_workstation() no pudo bloquear", flush=True)
+                    if REGISTRY_AVAILABLE:
+                        _state_outbox.record('session_expired', {
+                            'time_limit_seconds': session_info.get('time_limit_seconds', 0),
+                            'end_time': session_info.get('end_time')
+                        })
                 else:
                     # Ya estaba expirado: solo re-bloquear si el usuario reconectó
                     if is_user_session_active():
@@ -2547,9 +3772,10 @@ def monitor_time(client_id):
 
 def main():
     """Función principal"""
-    # Verificar que estamos en Windows
-    if sys.platform != 'win32':
+    # Verificar que estamos en Windows (salvo con el backend simulado)
+    if sys.platform != 'win32' and backend.name == 'windows':
         print("ERROR: Este cliente solo funciona en Windows.")
+        print("Para simularlo en Linux: CIBERMONDAY_BACKEND=sim")
         sys.exit(1)
     
     # Si solo se pidió configurar (--configure), la GUI ya se mostró al cargar el módulo
@@ -2560,30 +3786,36 @@ def main():
     
     # La configuración ya se obtuvo al inicio del script (puede mostrar GUI)
     # Si llegamos aquí, la configuración está lista
+    mark_startup_phase('main')
     
     # Aplicar protecciones si están disponibles
-    if PROTECTION_AVAILABLE:
-        try:
-            protections = apply_protections()
-            if protections:
-                print("Protecciones aplicadas:", ", ".join(protections))
-        except Exception as e:
-            print(f"Advertencia: No se pudieron aplicar todas las protecciones: {e}")
+    try:
+        protections = backend.apply_protections()
+        if protections:
+            print("Protecciones aplicadas:", ", ".join(protections))
+    except ImportError:
+        pass
+    except Exception as e:
+        print(f"Advertencia: No se pudieron aplicar todas las protecciones: {e}")
     
     # Verificar permisos de administrador (recomendado)
     try:
-        is_admin = ctypes.windll.shell32.IsUserAnAdmin()
+        is_admin = backend.is_admin()
         if not is_admin:
             print("ADVERTENCIA: No se ejecuta como administrador.")
             print("El bloqueo y las protecciones pueden no funcionar correctamente.")
-            print("Presiona Enter para continuar o Ctrl+C para salir...")
-            input()
+            if not IS_SERVICE:
+                # En modo servicio no hay consola: no esperar input
+                print("Presiona Enter para continuar o Ctrl+C para salir...")
+                input()
     except:
         pass
     
-    # Obtener o registrar cliente
-    # get_client_id() NUNCA retorna None - genera un ID local si no puede contactar servidores
-    client_id = get_client_id()
+    # Obtener cliente solo de registro/archivo (sin red). Si es nuevo, se genera un ID
+    # local y el SyncManager lo registra en background, así el primer chequeo de la
+    # sesión guardada no espera a ningún servidor.
+    client_id = get_client_id(allow_register=False)
+    mark_startup_phase('client_id')
     
     print(f"[Inicio] Cliente ID: {client_id}")
     
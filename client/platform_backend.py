@@ -0,0 +1,346 @@
+"""
+Backend de plataforma del cliente CiberMonday
+Separa lo que depende de Windows (bloqueo, sesión del usuario, registro,
+protecciones, alertas) del resto del cliente.
+
+- 'windows': APIs reales (LockWorkStation/WTS, winreg, DACL, MessageBox).
+- 'sim': simulación para Linux/CI. El bloqueo se registra en vez de bloquear y
+  el registro es un archivo JSON por instancia, así el SyncManager, monitor_time,
+  el listener de descubrimiento y el servidor de diagnóstico corren sin cambios
+  (cientos de instancias por máquina, cada una con sus puertos).
+
+Se elige con la variable de entorno CIBERMONDAY_BACKEND (default: 'windows').
+
+Variables del backend simulado:
+    CIBERMONDAY_SIM_DIR          Directorio de estado (registro y client_id.txt).
+                                 Default: <tmp>/cibermonday-sim/<puerto de diagnóstico>
+    CIBERMONDAY_SERVER_URL       Servidor para la config inicial (si no hay config)
+    CIBERMONDAY_SYNC_INTERVAL    sync_interval de la config inicial (default: 30)
+"""
+
+import ctypes
+import json
+import os
+import tempfile
+import threading
+import time
+
+BACKEND_ENV = 'CIBERMONDAY_BACKEND'
+DEFAULT_BACKEND = 'windows'
+
+# Constantes de Windows API
+WTS_CURRENT_SERVER_HANDLE = 0
+
+
+class WindowsBackend:
+    """APIs reales de Windows."""
+
+    name = 'windows'
+    # Directorio de estado propio (None = junto al ejecutable)
+    data_dir = None
+    # El firewall de Windows se verifica/configura con netsh
+    manages_firewall = True
+
+    def __init__(self):
+        # Fuera de Windows no hay windll: el módulo carga igual y main() avisa
+        windll = getattr(ctypes, 'windll', None)
+        self.user32 = windll.user32 if windll else None
+        self.kernel32 = windll.kernel32 if windll else None
+
+    @property
+    def registry(self):
+        """Módulo con la API de winreg que usa registry_manager."""
+        import winreg
+        return winreg
+
+    def lock_workstation(self):
+        """
+        Bloquea la estación de trabajo de Windows.
+
+        Funciona tanto desde la sesión del usuario como desde Session 0 (servicios).
+
+        Métodos (en orden de prioridad):
+        1. LockWorkStation() - funciona desde la sesión interactiva del usuario
+        2. WTSDisconnectSession() - funciona desde Session 0 (servicios de Windows)
+           Desconecta la sesión activa mostrando la pantalla de bloqueo.
+           Los programas del usuario siguen corriendo.
+        """
+        # Método 1: LockWorkStation() - solo funciona desde la sesión del usuario
+        try:
+            result = self.user32.LockWorkStation()
+            if result:
+                print("[Lock] PC bloqueada (LockWorkStation)", flush=True)
+                return True
+            else:
+                print("[Lock] LockWorkStation() fallo (retorno 0), intentando WTSDisconnectSession...", flush=True)
+        except Exception as e:
+            print(f"[Lock] Error en LockWorkStation: {e}", flush=True)
+
+        # Método 2: WTSDisconnectSession - funciona desde Session 0 (servicios)
+        # Desconecta la sesión de consola activa, mostrando la pantalla de login/bloqueo
+        try:
+            wtsapi32 = ctypes.windll.wtsapi32
+            # Obtener la sesión de consola activa (donde el usuario está logueado)
+            session_id = self.kernel32.WTSGetActiveConsoleSessionId()
+            if session_id != 0xFFFFFFFF:  # 0xFFFFFFFF = no hay sesión activa
+                result = wtsapi32.WTSDisconnectSession(
+                    WTS_CURRENT_SERVER_HANDLE,  # Servidor local
+                    session_id,                  # Sesión del usuario
+                    False                        # No esperar
+                )
+                if result:
+                    print(f"[Lock] Sesion {session_id} desconectada (WTSDisconnectSession)", flush=True)
+                    return True
+                else:
+                    error_code = self.kernel32.GetLastError()
+                    print(f"[Lock] WTSDisconnectSession fallo para sesion {session_id} (error: {error_code})", flush=True)
+            else:
+                print("[Lock] No se encontro sesion activa de consola", flush=True)
+        except Exception as e:
+            print(f"[Lock] Error en WTSDisconnectSession: {e}", flush=True)
+
+        print("[Lock] ERROR: No se pudo bloquear la PC con ningun metodo", flush=True)
+        return False
+
+    def is_user_session_active(self):
+        """
+        Verifica si la sesión del usuario en la consola está activa (conectada).
+
+        Usa WTSQuerySessionInformationW para consultar el estado de la sesión.
+        Retorna True si el usuario está conectado al escritorio (WTSActive=0),
+        False si la sesión está desconectada o no hay sesión.
+        """
+        try:
+            wtsapi32 = ctypes.windll.wtsapi32
+            session_id = self.kernel32.WTSGetActiveConsoleSessionId()
+            if session_id == 0xFFFFFFFF:
+                return False  # No hay sesión de consola
+
+            # WTSConnectState = 8 (clase de info para estado de conexión)
+            WTSConnectState = 8
+            buffer = ctypes.c_void_p()
+            bytes_returned = ctypes.c_ulong()
+
+            result = wtsapi32.WTSQuerySessionInformationW(
+                WTS_CURRENT_SERVER_HANDLE,
+                session_id,
+                WTSConnectState,
+                ctypes.byref(buffer),
+                ctypes.byref(bytes_returned)
+            )
+
+            if result and buffer.value is not None:
+                # El buffer contiene un INT con el estado de la sesión
+                # WTSActive = 0: usuario conectado al escritorio
+                # WTSDisconnected = 4: sesión desconectada (bloqueada por nosotros)
+                state = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_int)).contents.value
+                wtsapi32.WTSFreeMemory(buffer)
+                return state == 0  # Solo activa si WTSActive
+
+            return True  # Asumir activa si no se pudo consultar
+        except Exception:
+            return True  # Asumir activa si hay error (mejor bloquear de más que de menos)
+
+    def show_message(self, title, message, flags):
+        """Ventana emergente (MessageBoxW). Bloquea hasta que el usuario la cierra."""
+        self.user32.MessageBoxW(0, message, title, flags)
+
+    def is_admin(self):
+        return bool(ctypes.windll.shell32.IsUserAnAdmin())
+
+    def apply_protections(self):
+        """Protecciones del proceso (DACL, prioridad). Retorna la lista de las aplicadas."""
+        from protection import apply_protections
+        return apply_protections()
+
+    def process_rss_kb(self):
+        """Memoria residente del proceso (working set) en KB, o None si no se pudo leer."""
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong), ('PageFaultCount', ctypes.c_ulong)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                    'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                    'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        try:
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            self.kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+            ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.c_void_p(self.kernel32.GetCurrentProcess()),
+                ctypes.byref(counters), counters.cb)
+            return counters.WorkingSetSize // 1024 if ok else None
+        except Exception:
+            return None
+
+    def status(self):
+        return {'backend': self.name}
+
+
+class SimRegistry:
+    """
+    Registro simulado con la misma API de winreg que usa registry_manager.
+    Los valores se guardan en un archivo JSON; cada escritura despierta a quien
+    espere en `changed` (benchmarks que miden cuándo el cliente aplicó un cambio).
+    """
+
+    HKEY_LOCAL_MACHINE = 'HKLM'
+    HKEY_CURRENT_USER = 'HKCU'
+    KEY_READ = 0x20019
+    KEY_WRITE = 0x20006
+    REG_SZ = 1
+
+    def __init__(self, path=None):
+        self.path = path
+        self.changed = threading.Condition()
+        self.values = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.values = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[Sim] Registro simulado ilegible, se empieza vacío: {e}")
+
+    def _persist(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.values, f)
+        os.replace(tmp_path, self.path)
+
+    def CreateKey(self, root, path):
+        return path
+
+    def OpenKey(self, root, path, reserved=0, access=0):
+        return path
+
+    def CloseKey(self, key):
+        pass
+
+    def SetValueEx(self, key, name, reserved, kind, value):
+        with self.changed:
+            self.values[name] = value
+            self._persist()
+            self.changed.notify_all()
+
+    def QueryValueEx(self, key, name):
+        with self.changed:
+            if name not in self.values:
+                raise FileNotFoundError(name)
+            return self.values[name], self.REG_SZ
+
+    def DeleteValue(self, key, name):
+        with self.changed:
+            if name not in self.values:
+                raise FileNotFoundError(name)
+            del self.values[name]
+            self._persist()
+            self.changed.notify_all()
+
+    def wait_for(self, predicate, timeout):
+        """Espera hasta que predicate() sea True. Retorna time.time() en ese momento, o None."""
+        deadline = time.time() + timeout
+        with self.changed:
+            while not predicate():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+            return time.time()
+
+
+class SimBackend:
+    """
+    Simulación para correr el cliente fuera de Windows. El "usuario" empieza
+    conectado; un bloqueo lo desconecta hasta simulate_user_login().
+    """
+
+    name = 'sim'
+    manages_firewall = False
+
+    def __init__(self, data_dir=None):
+        if data_dir is None:
+            data_dir = os.getenv('CIBERMONDAY_SIM_DIR') or os.path.join(
+                tempfile.gettempdir(), 'cibermonday-sim',
+                os.getenv('CIBERMONDAY_DIAGNOSTIC_PORT', '5002'))
+        os.makedirs(data_dir, exist_ok=True)
+        self.data_dir = data_dir
+        self.registry = SimRegistry(os.path.join(data_dir, 'registry.json'))
+        self.locks = []          # time.time() de cada bloqueo
+        self.messages = []       # (time.time(), título) de cada alerta
+        self.user_active = True
+        self._seed_config()
+
+    def _seed_config(self):
+        """Config inicial desde el entorno (equivale a la GUI del primer arranque)."""
+        server_url = os.getenv('CIBERMONDAY_SERVER_URL')
+        if not server_url or 'Config' in self.registry.values:
+            return
+        self.registry.SetValueEx(None, 'Config', 0, SimRegistry.REG_SZ, json.dumps({
+            'server_url': server_url,
+            'check_interval': 5,
+            'sync_interval': int(os.getenv('CIBERMONDAY_SYNC_INTERVAL', 30))
+        }))
+
+    def lock_workstation(self):
+        with self.registry.changed:
+            self.locks.append(time.time())
+            self.user_active = False
+            self.registry.changed.notify_all()
+        print("[Lock] PC bloqueada (simulado)", flush=True)
+        return True
+
+    def is_user_session_active(self):
+        return self.user_active
+
+    def simulate_user_login(self):
+        """El usuario vuelve a entrar (monitor_time re-bloquea si la sesión sigue vencida)."""
+        self.user_active = True
+
+    def show_message(self, title, message, flags):
+        self.messages.append((time.time(), title))
+
+    def is_admin(self):
+        return True
+
+    def apply_protections(self):
+        return []
+
+    def process_rss_kb(self):
+        """Memoria residente del proceso (Linux: /proc/self/statm)."""
+        try:
+            with open('/proc/self/statm') as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf('SC_PAGE_SIZE') // 1024
+        except (OSError, ValueError, IndexError, AttributeError):
+            return None
+
+    def status(self):
+        return {
+            'backend': self.name,
+            'data_dir': self.data_dir,
+            'locks': len(self.locks),
+            'last_lock': self.locks[-1] if self.locks else None,
+            'user_active': self.user_active,
+            'alerts': len(self.messages)
+        }
+
+
+BACKENDS = {'windows': WindowsBackend, 'sim': SimBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend del proceso (se crea la primera vez según CIBERMONDAY_BACKEND)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = os.getenv(BACKEND_ENV, DEFAULT_BACKEND).strip().lower()
+                if name not in BACKENDS:
+                    print(f"[Backend] '{name}' desconocido, usando '{DEFAULT_BACKEND}'")
+                    name = DEFAULT_BACKEND
+                _backend = BACKENDS[name]()
+    return _backend
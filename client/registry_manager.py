@@ -2,12 +2,17 @@
 Módulo para gestionar el tiempo de sesión en el registro de Windows
 Almacena la información de tiempo localmente para que el cliente funcione
 sin depender de la conexión continua al servidor.
+
+El acceso al registro pasa por el backend de plataforma: winreg real en Windows,
+un registro simulado en archivo con CIBERMONDAY_BACKEND=sim.
 """
 
-import winreg
 import json
 from datetime import datetime, timedelta
 import os
+from platform_backend import get_backend
+
+winreg = get_backend().registry
 
 # Clave del registro donde se almacena la información
 REGISTRY_KEY_PATH = r"SOFTWARE\CiberMonday"
@@ -15,6 +20,9 @@ REGISTRY_VALUE_SESSION = "SessionData"
 REGISTRY_VALUE_CLIENT_ID = "ClientID"
 REGISTRY_VALUE_CONFIG = "Config"
 REGISTRY_VALUE_SERVERS = "KnownServers"
+REGISTRY_VALUE_OUTBOX = "Outbox"
+REGISTRY_VALUE_OUTBOX_ACKED = "OutboxAcked"
+REGISTRY_VALUE_VERSIONS = "StateVersions"
 
 def get_registry_key(create=False):
     """Obtiene o crea la clave del registro"""
@@ -444,3 +452,121 @@ def reset_server_timeout_count(server_url):
             save_servers_to_registry(servers_list)
     except Exception as e:
         print(f"[Error] Error al resetear contador de timeout: {e}")
+
+def save_outbox_to_registry(entries):
+    """
+    Guarda el outbox de transiciones de estado pendientes de reportar.
+    
+    Args:
+        entries: Lista de eventos (dicts con key, type, at, data)
+    """
+    try:
+        key = get_registry_key(create=True)
+        if key is None:
+            return False
+        
+        winreg.SetValueEx(key, REGISTRY_VALUE_OUTBOX, 0, winreg.REG_SZ, json.dumps(entries))
+        winreg.CloseKey(key)
+        return True
+    except Exception as e:
+        print(f"Error al guardar outbox en registro: {e}")
+        return False
+
+def get_outbox_from_registry():
+    """Obtiene el outbox de transiciones pendientes. Lista vacía si no existe o está corrupto."""
+    try:
+        key = get_registry_key(create=False)
+        if key is None:
+            return []
+        
+        try:
+            entries_json, _ = winreg.QueryValueEx(key, REGISTRY_VALUE_OUTBOX)
+            winreg.CloseKey(key)
+        except FileNotFoundError:
+            winreg.CloseKey(key)
+            return []
+        
+        entries = json.loads(entries_json)
+        return entries if isinstance(entries, list) else []
+    except Exception as e:
+        print(f"[Advertencia] Error al leer outbox del registro: {e}")
+        return []
+
+def save_outbox_acked_to_registry(keys):
+    """
+    Guarda las claves de los últimos eventos del outbox confirmados por un servidor,
+    para no volver a encolar la misma transición (ej: tras reiniciar la PC).
+    
+    Args:
+        keys: Lista de claves de idempotencia (la más vieja primero)
+    """
+    try:
+        key = get_registry_key(create=True)
+        if key is None:
+            return False
+        
+        winreg.SetValueEx(key, REGISTRY_VALUE_OUTBOX_ACKED, 0, winreg.REG_SZ, json.dumps(keys))
+        winreg.CloseKey(key)
+        return True
+    except Exception as e:
+        print(f"Error al guardar claves confirmadas del outbox en registro: {e}")
+        return False
+
+def get_outbox_acked_from_registry():
+    """Obtiene las claves confirmadas del outbox. Lista vacía si no existe o está corrupto."""
+    try:
+        key = get_registry_key(create=False)
+        if key is None:
+            return []
+        
+        try:
+            keys_json, _ = winreg.QueryValueEx(key, REGISTRY_VALUE_OUTBOX_ACKED)
+            winreg.CloseKey(key)
+        except FileNotFoundError:
+            winreg.CloseKey(key)
+            return []
+        
+        keys = json.loads(keys_json)
+        return keys if isinstance(keys, list) else []
+    except Exception as e:
+        print(f"[Advertencia] Error al leer claves confirmadas del outbox del registro: {e}")
+        return []
+
+def save_state_versions_to_registry(versions):
+    """
+    Guarda las versiones del último cambio del admin aplicado.
+    
+    Args:
+        versions: dict con 'session' y/o 'config' (enteros HLC del servidor)
+    """
+    try:
+        key = get_registry_key(create=True)
+        if key is None:
+            return False
+        
+        winreg.SetValueEx(key, REGISTRY_VALUE_VERSIONS, 0, winreg.REG_SZ, json.dumps(versions))
+        winreg.CloseKey(key)
+        return True
+    except Exception as e:
+        print(f"Error al guardar versiones en registro: {e}")
+        return False
+
+def get_state_versions_from_registry():
+    """Obtiene las versiones de sesión y config. Dict vacío si no existen o están corruptas."""
+    try:
+        key = get_registry_key(create=False)
+        if key is None:
+            return {}
+        
+        try:
+            versions_json, _ = winreg.QueryValueEx(key, REGISTRY_VALUE_VERSIONS)
+            winreg.CloseKey(key)
+        except FileNotFoundError:
+            winreg.CloseKey(key)
+            return {}
+        
+        versions = json.loads(versions_json)
+        return versions if isinstance(versions, dict) else {}
+    except Exception as e:
+        print(f"[Advertencia] Error al leer versiones del registro: {e}")
+        return {}
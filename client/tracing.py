@@ -0,0 +1,268 @@
+"""
+Trazas del cliente CiberMonday
+Spans livianos (nombre, inicio, duración, atributos, padre) de los caminos que
+hablan con los servidores: ciclo de sincronización por fases, registro,
+propagación después de un push y descubrimiento. Se guardan en un buffer
+circular en memoria y se exportan desde el puerto de diagnóstico (/api/trace):
+
+- formato Chrome trace (chrome://tracing, ui.perfetto.dev, speedscope)
+- spans estilo OpenTelemetry (trace_id, span_id, parent_span_id, *_unix_nano)
+
+Los spans que todavía no terminaron también se exportan (marcados como
+abiertos), así un sync colgado muestra en qué fase está esperando.
+
+CIBERMONDAY_TRACE_BUFFER fija cuántos spans se conservan (default: 4000; 0 desactiva).
+"""
+
+import collections
+import functools
+import os
+import threading
+import time
+
+TRACE_BUFFER_ENV = 'CIBERMONDAY_TRACE_BUFFER'
+DEFAULT_TRACE_BUFFER = 4000
+
+
+class Span:
+    """Un tramo de trabajo. Se usa como context manager (ver Tracer.span)."""
+
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'start',
+                 '_t0', 'duration', 'thread_id', 'thread_name', 'attrs', 'error')
+
+    def __init__(self, tracer, name, parent, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        else:
+            self.trace_id = os.urandom(16).hex()
+            self.parent_id = None
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.attrs = attrs
+        self.error = None
+        self.duration = None
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        """Agrega atributos (ej: status HTTP, cantidad de servidores)."""
+        self.attrs.update(attrs)
+
+    def fail(self, message):
+        """Marca el span como fallido sin que haya una excepción."""
+        self.error = str(message)[:200]
+
+    def __enter__(self):
+        self.tracer._push(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.error is None:
+            self.error = f"{exc_type.__name__}: {str(exc)[:200]}"
+        self.duration = time.perf_counter() - self._t0
+        self.tracer._finish(self)
+        return False
+
+
+class _NoopSpan:
+    """Span vacío para cuando el trazado está desactivado."""
+
+    def set(self, **attrs):
+        pass
+
+    def fail(self, message):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Buffer circular de spans terminados más los que siguen abiertos."""
+
+    def __init__(self, capacity=DEFAULT_TRACE_BUFFER):
+        self.capacity = max(0, int(capacity))
+        self._finished = collections.deque(maxlen=self.capacity or None)
+        self._open = {}  # span_id -> Span
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.dropped = 0
+
+    @classmethod
+    def from_env(cls):
+        try:
+            capacity = int(os.getenv(TRACE_BUFFER_ENV, DEFAULT_TRACE_BUFFER))
+        except ValueError:
+            capacity = DEFAULT_TRACE_BUFFER
+        return cls(capacity)
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    # ==================== REGISTRO ====================
+
+    def span(self, name, parent=None, **attrs):
+        """
+        Abre un span hijo del span actual del thread (o de `parent`, para trabajo
+        que sigue en otro thread, ej: el executor de la propagación).
+
+            with tracer.span('sync.health', server=url) as span:
+                ...
+                span.set(status=200)
+        """
+        if not self.capacity:
+            return _NOOP_SPAN
+        if parent is None:
+            parent = self.current()
+        elif not isinstance(parent, Span):
+            parent = None
+        return Span(self, name, parent, attrs)
+
+    def event(self, name, **attrs):
+        """Marca instantánea (span de duración 0), ej: un probe enviado."""
+        with self.span(name, **attrs):
+            pass
+
+    def current(self):
+        """Span abierto más interno del thread actual (None si no hay)."""
+        stack = getattr(self._local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def _push(self, span):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+        with self._lock:
+            self._open[span.span_id] = span
+
+    def _finish(self, span):
+        stack = getattr(self._local, 'stack', None)
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif stack and span in stack:
+            stack.remove(span)
+        with self._lock:
+            self._open.pop(span.span_id, None)
+            if len(self._finished) == self.capacity:
+                self.dropped += 1
+            self._finished.append(span)
+
+    def snapshot(self, limit=None):
+        """(terminados, abiertos) con los terminados más recientes al final."""
+        with self._lock:
+            finished = list(self._finished)
+            still_open = list(self._open.values())
+        if limit:
+            finished = finished[-limit:]
+        return finished, still_open
+
+    def clear(self):
+        with self._lock:
+            self._finished.clear()
+            self.dropped = 0
+
+    def status(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'capacity': self.capacity,
+                    'spans': len(self._finished), 'open': len(self._open),
+                    'dropped': self.dropped}
+
+    # ==================== EXPORTACIÓN ====================
+
+    @staticmethod
+    def _args(span, is_open=False):
+        args = dict(span.attrs)
+        args['span_id'] = span.span_id
+        if span.parent_id:
+            args['parent_id'] = span.parent_id
+        if span.error:
+            args['error'] = span.error
+        if is_open:
+            args['open'] = True
+        return args
+
+    def chrome_trace(self, limit=None):
+        """
+        Trazas en el formato JSON de Chrome (Trace Event Format): un evento
+        completo ("X") por span y el nombre de cada thread como metadato.
+        """
+        finished, still_open = self.snapshot(limit)
+        pid = os.getpid()
+        now_perf = time.perf_counter()
+        events = []
+        threads = {}
+        for span in finished:
+            threads[span.thread_id] = span.thread_name
+            events.append({
+                'name': span.name, 'cat': span.name.split('.')[0], 'ph': 'X',
+                'ts': round(span.start * 1e6), 'dur': round(span.duration * 1e6, 1),
+                'pid': pid, 'tid': span.thread_id, 'args': self._args(span)
+            })
+        for span in still_open:
+            threads[span.thread_id] = span.thread_name
+            events.append({
+                'name': span.name, 'cat': span.name.split('.')[0], 'ph': 'X',
+                'ts': round(span.start * 1e6), 'dur': round((now_perf - span._t0) * 1e6, 1),
+                'pid': pid, 'tid': span.thread_id, 'args': self._args(span, is_open=True)
+            })
+        events.sort(key=lambda e: e['ts'])
+        for tid, name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': name}})
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': 'CiberMonday cliente'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def otel_spans(self, limit=None):
+        """Spans con los campos de OpenTelemetry (tiempos en ns desde epoch)."""
+        finished, still_open = self.snapshot(limit)
+        now_perf = time.perf_counter()
+        result = []
+        for span in finished + still_open:
+            is_open = span.duration is None
+            duration = (now_perf - span._t0) if is_open else span.duration
+            start_ns = int(span.start * 1e9)
+            attributes = dict(span.attrs)
+            attributes['thread.name'] = span.thread_name
+            result.append({
+                'trace_id': span.trace_id,
+                'span_id': span.span_id,
+                'parent_span_id': span.parent_id,
+                'name': span.name,
+                'start_time_unix_nano': start_ns,
+                'end_time_unix_nano': None if is_open else start_ns + int(duration * 1e9),
+                'duration_ms': round(duration * 1000, 3),
+                'attributes': attributes,
+                'status': {'code': 'ERROR', 'message': span.error} if span.error
+                else {'code': 'UNSET' if is_open else 'OK'}
+            })
+        result.sort(key=lambda s: s['start_time_unix_nano'])
+        return result
+
+
+# Tracer del proceso
+tracer = Tracer.from_env()
+
+
+def traced(name):
+    """Decorator: ejecuta la función dentro de un span del tracer del proceso."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
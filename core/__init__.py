@@ -2,5 +2,11 @@
 # Lógica de negocio reutilizable entre servidor web y app Android
 
 from .client_manager import ClientManager
+from .hash_ring import HashRing
+from .metrics import MetricsRegistry, ServerMetrics
+from .profiling import Profiler
+from .telemetry import FleetTelemetry
+from .traffic import TrafficRecorder
 
-__all__ = ['ClientManager']
+__all__ = ['ClientManager', 'HashRing', 'MetricsRegistry', 'ServerMetrics', 'Profiler', 'FleetTelemetry',
+           'TrafficRecorder']
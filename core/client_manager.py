@@ -9,12 +9,21 @@ import uuid
 import json
 import socket
 import hashlib
+import hmac
+import ipaddress
+import os
 import threading
 import time
+import heapq
+import concurrent.futures
 import urllib.request
 import urllib.error
 from urllib.parse import urlparse
 
+from .hash_ring import HashRing
+from .metrics import ServerMetrics
+from .telemetry import FleetTelemetry
+
 
 class ClientManager:
     """
@@ -30,23 +39,130 @@ class ClientManager:
         'lock_recheck_interval': 1,
     }
     
-    # Segundos durante los cuales un reporte del cliente es ignorado
-    # después de un cambio de admin (para dar tiempo al push de llegar)
-    ADMIN_CHANGE_GRACE_SECONDS = 15
+    # Puertos UDP de descubrimiento: los clientes escuchan anuncios en DISCOVERY_PORT
+    # y los servidores responden consultas (probes) en DISCOVERY_QUERY_PORT
+    DISCOVERY_PORT = 5001
+    DISCOVERY_QUERY_PORT = 5003
+    # Versión del protocolo de descubrimiento (incluida en las respuestas)
+    DISCOVERY_PROTOCOL_VERSION = 1
+    # Modos de anuncio: broadcast de subred, grupo multicast (IGMP) o ambos
+    DISCOVERY_MODES = ('broadcast', 'multicast', 'both')
+    DEFAULT_MULTICAST_GROUP = '239.255.77.77'
+    # Ráfaga de anuncios al iniciar, al reanudar o al cambiar la red
+    DISCOVERY_BURST_COUNT = 5
+    DISCOVERY_BURST_INTERVAL = 0.2
+    
+    # Replicación entre servidores: entradas retenidas en el log, máximo por envío,
+    # heartbeat (s) hacia peers sin cambios y cada cuánto se replica un last_seen
+    CHANGE_LOG_LIMIT = 5000
+    REPLICATION_BATCH_SIZE = 500
+    REPLICATION_HEARTBEAT = 2
+    REPLICATION_TOUCH_INTERVAL = 20
+    REPLICATION_MAX_PARALLEL = 8
+    # Secreto compartido de la malla: con CIBERMONDAY_MESH_SECRET configurado,
+    # /api/replicate solo acepta envíos que traigan este header con el mismo valor
+    MESH_SECRET_ENV = 'CIBERMONDAY_MESH_SECRET'
+    MESH_SECRET_HEADER = 'X-CiberMonday-Mesh-Secret'
+    # Elección de líder: un peer se considera vivo si se supo de él (heartbeat de
+    # replicación enviado o recibido) dentro del lease
+    LEADER_LEASE_SECONDS = 6
+    
+    # Recuperación en frío: ventana (s) en la que los clientes re-sincronizan con
+    # jitter al ver una nueva época, y segundos sin re-registros para darla por terminada
+    RECOVERY_RESYNC_WINDOW = 3
+    RECOVERY_SETTLE_SECONDS = 10
+    
+    # Vencimiento en el servidor: diferencia (s) tolerada entre el remaining que
+    # reporta el cliente y el deadline del servidor antes de marcar divergencia, y
+    # espera máxima del scheduler (para re-calcular si el reloj del sistema salta)
+    EXPIRY_DIVERGENCE_TOLERANCE = 30
+    EXPIRY_MAX_WAIT = 60
+    # Diferencia (s) entre el fin reportado y el guardado por debajo de la cual la
+    # sesión se considera la misma y el reporte no la reescribe
+    SESSION_DRIFT_TOLERANCE = 2
     
-    def __init__(self, server_port=5000):
+    # Versiones de sesión/config (HLC) como un entero comparable:
+    #   wall_ms << 32 | contador << 16 | nodo
+    # Así ordenan por tiempo real entre servidores que no se replican y las
+    # versiones Lamport anteriores (enteros chicos) quedan como más viejas
+    HLC_COUNTER_MASK = 0xFFFF
+    HLC_NODE_MASK = 0xFFFF
+    
+    @classmethod
+    def _default_server_config(cls):
+        """Config del servidor por defecto (from_json completa con esto lo que falte)."""
+        return {
+            # Intervalo inicial entre anuncios; se duplica hasta broadcast_max_interval
+            'broadcast_interval': 1,
+            'broadcast_max_interval': 30,
+            'discovery_mode': 'broadcast',
+            'multicast_group': cls.DEFAULT_MULTICAST_GROUP,
+            'multicast_ttl': 1,
+            # Cantidad de servidores dueños de cada cliente (hashing consistente)
+            'replication_factor': 2
+        }
+    
+    def __init__(self, server_port=5000, commands_path=None):
         self.clients_db = {}
         self.client_sessions = {}
         self.client_configs = {}
         self.servers_db = {}
-        self.server_config = {
-            'broadcast_interval': 1
-        }
+        self.server_config = self._default_server_config()
+        # Se activa cuando cambia la config de descubrimiento para reiniciar la ráfaga
+        self._discovery_reset = threading.Event()
         self.server_port = server_port
         self._local_server_url = None
-        # Trackea cambios de admin pendientes para evitar que el sync del
-        # cliente sobreescriba antes de que el push llegue
-        self._pending_admin_changes = {}  # client_id -> datetime
+        # Reloj lógico híbrido (HLC) para versionar sesión y config de cada cliente:
+        # cada cambio de admin toma una versión nueva y el cliente la devuelve en sus
+        # reportes, así un reporte con versión vieja se rechaza sin esperar
+        self._version_lock = threading.Lock()
+        self._hlc_wall = 0      # ms del último valor emitido u observado
+        self._hlc_counter = 0   # desempate dentro del mismo ms
+        # Desempate entre servidores: dos servidores nunca emiten la misma versión
+        self._hlc_node = uuid.uuid4().int & self.HLC_NODE_MASK
+        # Historial de transiciones reportadas por cada cliente (outbox/batch)
+        self.client_history = {}  # client_id -> list de eventos
+        # Comandos del admin pendientes de confirmar por cada cliente (ver COLA DE COMANDOS).
+        # Con commands_path las colas con pendientes se guardan en disco y sobreviven
+        # a un reinicio del servidor
+        self.client_commands = {}  # client_id -> {'id', 'seq', 'acked', 'pending'}
+        self.commands_path = commands_path
+        self._commands_file_lock = threading.Lock()
+        self._load_commands()
+        # Claves de idempotencia ya aplicadas, para deduplicar reintentos del batch
+        self._ingested_event_keys = {}  # client_id -> dict key -> None (ordenado)
+        # Log de cambios replicado a los demás servidores (ver REPLICACIÓN)
+        self._replication_lock = threading.Lock()
+        self._change_log = []          # entradas ordenadas por seq
+        self._change_seq = 0           # último seq asignado
+        self._client_versions = {}     # client_id -> timestamp del último cambio (incluye borrados)
+        self._replicated_touch = {}    # client_id -> time.time() del último last_seen replicado
+        self._peer_replication = {}    # peer_url -> cursor y estado del envío
+        self._replication_wake = threading.Event()
+        self.mesh_secret = os.getenv(self.MESH_SECRET_ENV) or None
+        # Elección de líder sobre la malla de replicación (ver LÍDER)
+        self._started_monotonic = time.monotonic()
+        self._peer_seen = {}           # peer_url -> time.time() del último contacto
+        self._peer_claims = {}         # peer_url -> líder que ese peer reconoce
+        self._leader = None
+        # Anillo de dueños sobre los servidores vivos (ver DUEÑOS DE CLIENTES)
+        self._ring = HashRing()
+        # Scheduler de vencimientos (ver EXPIRACIÓN EN EL SERVIDOR)
+        self._expiry_cond = threading.Condition()
+        self._expiry_heap = []         # (timestamp, client_id, deadline)
+        self._expiry_scheduled = {}    # client_id -> deadline vigente en el heap
+        # Época de recuperación: cambia en cada arranque. Los clientes que ven una
+        # época nueva (anuncios UDP o /api/health) se re-registran de inmediato.
+        self.recovery_epoch = uuid.uuid4().hex[:12]
+        self._recovery = {
+            'started_at': datetime.now(),
+            'recovered_clients': 0,
+            'last_recovered_at': None
+        }
+        # Métricas para /api/metrics (ver core/metrics.py)
+        self.metrics = ServerMetrics(self)
+        # Telemetría que mandan los clientes en cada sync (ver core/telemetry.py)
+        self.telemetry = FleetTelemetry()
     
     @property
     def local_server_url(self):
@@ -105,10 +221,18 @@ class ClientManager:
         if diagnostic_port:
             client_data['diagnostic_port'] = diagnostic_port
         
+        known_session_version = self.clients_db.get(client_id, {}).get('session_version', 0)
+        if client_id not in self.clients_db:
+            self._note_client_recovered(is_reregister)
+        else:
+            # Conservar lo que el servidor sabe y el cliente no reporta
+            for key in ('deadline_divergence', 'session_version', 'config_version'):
+                if key in self.clients_db[client_id]:
+                    client_data[key] = self.clients_db[client_id][key]
         self.clients_db[client_id] = client_data
         
-        # Configuración
-        if config:
+        # Configuración (salvo que sea anterior a un cambio del admin)
+        if config and not self._is_stale_report(client_id, 'config', config.get('version')):
             self.client_configs[client_id] = {
                 'sync_interval': config.get('sync_interval', self.DEFAULT_CONFIG['sync_interval']),
                 'alert_thresholds': config.get('alert_thresholds', self.DEFAULT_CONFIG['alert_thresholds']),
@@ -120,23 +244,36 @@ class ClientManager:
         elif client_id not in self.client_configs:
             self.client_configs[client_id] = self.DEFAULT_CONFIG.copy()
         
-        # Restaurar sesión si se proporcionó (activa o expirada)
+        # Restaurar sesión si se proporcionó (activa o expirada) y no es anterior
+        # a un cambio del admin
         session_restored = False
-        if session_data:
+        if session_data and not self._is_stale_report(client_id, 'session', session_data.get('version')):
             remaining_seconds = session_data.get('remaining_seconds', 0)
             time_limit = session_data.get('time_limit_seconds', remaining_seconds)
             
             if remaining_seconds > 0:
                 # Sesión activa
-                end_time = datetime.now() + timedelta(seconds=remaining_seconds)
+                end_time = self._reported_end_time(remaining_seconds, session_data.get('end_ts'))
                 start_time = end_time - timedelta(seconds=time_limit)
-                
-                self.client_sessions[client_id] = {
-                    'time_limit': time_limit,
-                    'start_time': start_time.isoformat(),
-                    'end_time': end_time.isoformat()
-                }
-                self.clients_db[client_id]['is_active'] = True
+                deadline = self._known_deadline(client_id, session_data.get('version'),
+                                                known_session_version)
+                if deadline:
+                    # El servidor ya conoce la sesión: se marca la diferencia y manda su deadline
+                    self._check_deadline_divergence(
+                        client_id, int((end_time - datetime.now()).total_seconds()), deadline)
+                    self.clients_db[client_id]['is_active'] = \
+                        'expired_at' not in self.client_sessions[client_id]
+                else:
+                    # Si es la misma sesión que ya conocemos no se reescribe
+                    if not self._session_unchanged(client_id, time_limit, end_time):
+                        self.client_sessions[client_id] = {
+                            'time_limit': time_limit,
+                            'start_time': start_time.isoformat(),
+                            'end_time': end_time.isoformat(),
+                            'deadline': end_time.isoformat()
+                        }
+                        self._schedule_expiry(client_id)
+                    self.clients_db[client_id]['is_active'] = True
                 session_restored = True
             elif time_limit > 0 and client_id not in self.client_sessions:
                 # Sesión expirada que el servidor no conocía (ej: server recién arrancó).
@@ -163,6 +300,8 @@ class ClientManager:
             local_url = f"http://{local_ip}:{self.server_port}"
             self.register_server(local_url, local_ip, self.server_port)
         
+        self._record_change(client_id)
+        
         message = 'Cliente re-registrado' if is_reregister else 'Cliente registrado'
         print(f"[Registro] {message}: {client_id[:8]}... nombre={name}")
         
@@ -172,7 +311,8 @@ class ClientManager:
             'message': message,
             'session_restored': session_restored,
             'config': self.client_configs.get(client_id, self.DEFAULT_CONFIG),
-            'known_servers': self.get_servers()
+            'known_servers': self.get_servers(),
+            'owners': self.get_client_owners(client_id)
         }
     
     # Segundos sin contacto para considerar un cliente desconectado
@@ -182,6 +322,10 @@ class ClientManager:
         """Actualiza last_seen del cliente. Llamar en cada interacción."""
         if client_id in self.clients_db:
             self.clients_db[client_id]['last_seen'] = datetime.now().isoformat()
+            # Replicar last_seen de forma espaciada para que los peers sepan que está conectado
+            now = time.time()
+            if now - self._replicated_touch.get(client_id, 0) >= self.REPLICATION_TOUCH_INTERVAL:
+                self._record_change(client_id)
     
     def _is_client_connected(self, client_id):
         """Verifica si el cliente se ha reportado recientemente."""
@@ -234,41 +378,71 @@ class ClientManager:
         
         return clients_list
     
-    def get_client_status(self, client_id):
+    def get_client_status(self, client_id, ack_seq=None, ack_queue=None, telemetry=None):
         """
         Obtiene el estado de un cliente específico.
         También actualiza last_seen ya que el cliente está haciendo una consulta.
         
+        Args:
+            ack_seq: Último comando que el cliente aplicó (confirma los anteriores).
+            ack_queue: ID de la cola a la que se refiere ack_seq.
+            telemetry: Muestra de telemetría del cliente (header X-CiberMonday-Telemetry).
+        
         Returns:
-            dict con info del cliente o None si no existe
+            dict con info del cliente (incluye los comandos pendientes) o None si no existe
         """
         if client_id not in self.clients_db:
             return None
         
+        if telemetry:
+            # La telemetría es accesoria: una muestra rota nunca hace fallar el status
+            try:
+                self.telemetry.ingest(client_id, telemetry)
+                self.metrics.telemetry_samples.inc()
+            except Exception as e:
+                print(f"[Telemetría] Muestra inválida de {client_id[:8]}...: {e}")
+        
         # El cliente está consultando, actualizar last_seen
         self._touch_client(client_id)
+        self.metrics.client_syncs.inc(client_id)
+        if ack_seq is not None:
+            self.ack_commands(client_id, ack_seq, queue_id=ack_queue)
         
         client_data = self.clients_db[client_id].copy()
         client_data['connected'] = self._is_client_connected(client_id)
-        
-        if client_id in self.client_sessions:
-            session = self.client_sessions[client_id]
-            end_time = datetime.fromisoformat(session['end_time'])
-            remaining_seconds = max(0, int((end_time - datetime.now()).total_seconds()))
-            
-            client_data['session'] = {
-                'time_limit_seconds': session['time_limit'],
-                'start_time': session['start_time'],
-                'end_time': session['end_time'],
-                'remaining_seconds': remaining_seconds,
-                'is_expired': remaining_seconds == 0
-            }
-        else:
-            client_data['session'] = None
-        
+        client_data['session'] = self._session_view(client_id)
         client_data['config'] = self.client_configs.get(client_id, self.DEFAULT_CONFIG.copy())
+        client_data['owners'] = self.get_client_owners(client_id)
+        # Comandos que el push no pudo entregar: viajan con cada status hasta el ack.
+        # Solo cuenta como reintento el reenvío de un comando ya entregado en un status
+        queue = self.client_commands.get(client_id)
+        for command in queue['pending'] if queue else ():
+            delivered = command.get('delivered', 0)
+            if delivered:
+                self.metrics.push_retries.inc(command['type'])
+            command['delivered'] = delivered + 1
+        client_data['commands'] = self.get_pending_commands(client_id)
+        client_data['command_queue'] = (self.client_commands.get(client_id) or {}).get('id')
         return client_data
     
+    def _session_view(self, client_id):
+        """Sesión del cliente tal como la ve el propio cliente (None si no tiene)."""
+        session = self.client_sessions.get(client_id)
+        if not session:
+            return None
+        end_time = datetime.fromisoformat(session['end_time'])
+        remaining_seconds = max(0, int((end_time - datetime.now()).total_seconds()))
+        return {
+            'time_limit_seconds': session['time_limit'],
+            'start_time': session['start_time'],
+            'end_time': session['end_time'],
+            # Fin absoluto en el reloj del servidor (el cliente lo corrige con su offset)
+            'end_ts': end_time.timestamp(),
+            'remaining_seconds': remaining_seconds,
+            'is_expired': remaining_seconds == 0,
+            'version': self.clients_db[client_id].get('session_version', 0)
+        }
+    
     def set_client_time(self, client_id, time_value, time_unit='minutes'):
         """
         Establece el tiempo de uso para un cliente.
@@ -298,15 +472,23 @@ class ClientManager:
         self.client_sessions[client_id] = {
             'time_limit': total_seconds,
             'start_time': start_time.isoformat(),
-            'end_time': end_time.isoformat()
+            'end_time': end_time.isoformat(),
+            # Deadline del servidor: lo fija el admin y los reportes no lo mueven
+            'deadline': end_time.isoformat()
         }
         self.clients_db[client_id]['is_active'] = True
+        self.clients_db[client_id].pop('deadline_divergence', None)
+        version = self._new_version(client_id, 'session')
+        self._record_change(client_id)
+        self._schedule_expiry(client_id)
         
         session_info = {
             'time_limit_seconds': total_seconds,
             'start_time': start_time.isoformat(),
             'end_time': end_time.isoformat(),
-            'remaining_seconds': total_seconds
+            'end_ts': end_time.timestamp(),
+            'remaining_seconds': total_seconds,
+            'version': version
         }
         
         # Notificar al cliente del cambio de sesión
@@ -336,9 +518,14 @@ class ClientManager:
             self.clients_db[client_id]['total_time_used'] += time_used
             del self.client_sessions[client_id]
             self.clients_db[client_id]['is_active'] = False
+        version = self._new_version(client_id, 'session')
+        self._record_change(client_id)
         
         # Notificar al cliente que su sesión fue detenida
-        self._notify_client(client_id, 'stop', {'message': 'Sesión detenida por el administrador'})
+        self._notify_client(client_id, 'stop', {
+            'message': 'Sesión detenida por el administrador',
+            'version': version
+        })
         
         return {'success': True, 'message': 'Sesión detenida'}
     
@@ -356,7 +543,15 @@ class ClientManager:
             del self.client_sessions[client_id]
         if client_id in self.client_configs:
             del self.client_configs[client_id]
+        self.client_history.pop(client_id, None)
+        self._ingested_event_keys.pop(client_id, None)
+        had_commands = self.client_commands.pop(client_id, None) is not None
         del self.clients_db[client_id]
+        if had_commands:
+            self._persist_commands()
+        self._record_change(client_id)
+        self.metrics.forget_client(client_id)
+        self.telemetry.forget(client_id)
         
         return {'success': True, 'message': 'Cliente eliminado'}
     
@@ -371,24 +566,31 @@ class ClientManager:
     def set_client_config(self, client_id, sync_interval=None, alert_thresholds=None,
                           custom_name=None, max_server_timeouts=None,
                           lock_recheck_interval=None,
-                          notify_client=True):
+                          notify_client=True, version=None):
         """
         Modifica la configuración de un cliente.
         
         Args:
             notify_client: Si True, envía push al cliente (acción de admin).
                           Si False, es un reporte del propio cliente, no notificar.
+            version: Versión de config que reporta el cliente (solo si notify_client=False).
         
         Returns:
-            dict con success, message, config
+            dict con success, message, config. Si el reporte del cliente es anterior
+            al último cambio del admin: stale=True con la config y versión vigentes.
         """
         if client_id not in self.clients_db:
             return {'success': False, 'message': 'Cliente no encontrado'}
         
-        # Si es reporte del cliente y hay un cambio de admin pendiente, ignorar
-        if not notify_client and self._has_pending_admin_change(client_id):
-            current_config = self.client_configs.get(client_id, self.DEFAULT_CONFIG.copy())
-            return {'success': True, 'message': 'Cambio de admin pendiente', 'config': current_config}
+        # Reporte del cliente anterior al último cambio del admin: devolver lo vigente
+        if not notify_client and self._is_stale_report(client_id, 'config', version):
+            return {
+                'success': True,
+                'stale': True,
+                'message': 'Versión de configuración vieja',
+                'config': self.client_configs.get(client_id, self.DEFAULT_CONFIG.copy()),
+                'version': self.clients_db[client_id].get('config_version', 0)
+            }
         
         current_config = self.client_configs.get(client_id, self.DEFAULT_CONFIG.copy())
         
@@ -429,12 +631,15 @@ class ClientManager:
             current_config['lock_recheck_interval'] = lock_recheck_interval
         
         self.client_configs[client_id] = current_config
+        if notify_client:
+            version = self._new_version(client_id, 'config')
+        self._record_change(client_id)
         
         print(f"[Config] Cliente {client_id[:8]}... configuración actualizada: {current_config}")
         
         # Solo notificar al cliente si es acción del admin (no si el cliente reportó)
         if notify_client:
-            self._notify_client(client_id, 'config', current_config)
+            self._notify_client(client_id, 'config', dict(current_config, version=version))
         
         return {
             'success': True,
@@ -446,113 +651,304 @@ class ClientManager:
     
     def _notify_client(self, client_id, event_type, event_data):
         """
-        Envía una notificación HTTP push al cliente cuando el admin hace un cambio.
-        El cliente es la fuente de verdad y propagará el cambio a los demás servers.
+        Encola el cambio del admin en la cola de comandos del cliente y lo envía
+        por HTTP push. El cliente es la fuente de verdad y propagará el cambio a
+        los demás servers.
         
-        Incluye reintentos automáticos y marca un grace period para que el sync
-        del cliente no sobreescriba el cambio antes de que el push llegue.
+        El push se intenta una sola vez: si falla (ej: la PC está reiniciando), el
+        comando viaja con la respuesta de /status en el próximo contacto del
+        cliente hasta que lo confirme (ver COLA DE COMANDOS).
         
         Args:
             client_id: ID del cliente
-            event_type: Tipo de evento ('session', 'config', 'stop')
+            event_type: Tipo de evento ('session', 'config', 'stop', 'lock')
             event_data: Datos del evento a enviar
         """
         if client_id not in self.clients_db:
             return
         
-        client = self.clients_db[client_id]
+        command = self._enqueue_command(client_id, event_type, event_data)
+        self._record_change(client_id)
+        
+        # Solo el dueño primario entrega push; otro servidor replica la intención
+        # y el dueño la entrega al aplicarla (ver apply_replication)
+        if not self._should_deliver_push(client_id):
+            self._record_push_intent(client_id, command)
+            return
+        
+        self._push_command(client_id, command)
+    
+    def _push_command(self, client_id, command):
+        """Envía UN comando al cliente por HTTP push (un intento, en background)."""
+        client = self.clients_db.get(client_id)
+        if not client:
+            return
         client_ip = client.get('client_ip')
         diagnostic_port = client.get('diagnostic_port', 5002)
+        event_type = command['type']
         
         if not client_ip:
-            print(f"[Push] Cliente {client_id[:8]}... no tiene IP registrada, no se puede notificar")
+            print(f"[Push] Cliente {client_id[:8]}... no tiene IP registrada, '{event_type}' queda en su cola")
             return
         
-        # Marcar que hay un cambio de admin pendiente (grace period)
-        self._pending_admin_changes[client_id] = datetime.now()
-        
-        import time as _time
-        
         def _do_notify():
             url = f"http://{client_ip}:{diagnostic_port}/api/push/{event_type}"
-            payload = json.dumps(event_data).encode('utf-8')
-            
-            max_retries = 5
-            retry_delays = [0, 2, 3, 5, 5]  # segundos entre reintentos
-            
-            for attempt in range(max_retries):
-                if attempt > 0:
-                    _time.sleep(retry_delays[attempt])
-                
-                try:
-                    req = urllib.request.Request(
-                        url,
-                        data=payload,
-                        headers={'Content-Type': 'application/json'}
-                    )
-                    
-                    with urllib.request.urlopen(req, timeout=5) as response:
-                        if response.status == 200:
-                            print(f"[Push] '{event_type}' enviado a cliente {client_id[:8]}..." + 
-                                  (f" (intento {attempt + 1})" if attempt > 0 else ""))
-                            # Push exitoso, limpiar pending
-                            self._pending_admin_changes.pop(client_id, None)
-                            return
-                        else:
-                            print(f"[Push] Cliente respondió {response.status} (intento {attempt + 1}/{max_retries})")
-                except Exception as e:
-                    if attempt < max_retries - 1:
-                        print(f"[Push] Reintentando '{event_type}' a {client_id[:8]}... ({attempt + 1}/{max_retries}): {e}")
-                    else:
-                        print(f"[Push] Falló '{event_type}' a {client_id[:8]}... después de {max_retries} intentos: {e}")
-                        # No limpiar pending - se limpiará por timeout en report_session
+            # replicated: este servidor ya replica el cambio a los demás, el cliente
+            # no necesita propagarlo server por server
+            payload = json.dumps(dict(command['data'], replicated=True,
+                                      command_seq=command['seq'])).encode('utf-8')
+            self.metrics.push_attempts.inc(event_type)
+            try:
+                req = urllib.request.Request(
+                    url,
+                    data=payload,
+                    headers={'Content-Type': 'application/json'}
+                )
+                with urllib.request.urlopen(req, timeout=5) as response:
+                    if response.status == 200:
+                        print(f"[Push] '{event_type}' enviado a cliente {client_id[:8]}...")
+                        self.metrics.push_success.inc(event_type)
+                        self.ack_commands(client_id, command['seq'], exact=True)
+                        return
+                    print(f"[Push] Cliente respondió {response.status} a '{event_type}'")
+            except Exception as e:
+                print(f"[Push] Falló '{event_type}' a {client_id[:8]}...: {e}")
+            self.metrics.push_failures.inc(event_type)
+            print(f"[Push] '{event_type}' queda en la cola de {client_id[:8]}... hasta su próximo contacto")
         
         # Enviar en un thread para no bloquear la respuesta al admin
         threading.Thread(target=_do_notify, daemon=True).start()
     
+    # ==================== COLA DE COMANDOS ====================
+    
+    # Comandos pendientes retenidos por cliente
+    COMMAND_QUEUE_LIMIT = 20
+    # Archivo donde se guardan las colas (ver default_commands_path)
+    COMMANDS_FILE_ENV = 'CIBERMONDAY_COMMANDS_FILE'
+    # Un comando nuevo reemplaza a los pendientes que quedan sin efecto
+    COMMAND_SUPERSEDES = {
+        'session': ('session', 'stop', 'lock'),
+        'stop': ('session', 'stop', 'lock'),
+        'lock': ('lock',),
+        'config': ('config',),
+    }
+    
+    def _enqueue_command(self, client_id, command_type, data):
+        """
+        Agrega un comando a la cola del cliente con el siguiente número de secuencia.
+        La cola tiene un ID propio: si se pierde y se crea otra (ej: el cliente fue
+        borrado), el cliente no confunde sus secuencias con las de la anterior.
+        """
+        queue = self.client_commands.get(client_id)
+        if queue is None:
+            queue = {'id': uuid.uuid4().hex[:8], 'seq': 0, 'acked': 0, 'pending': []}
+            self.client_commands[client_id] = queue
+        queue['seq'] += 1
+        superseded = self.COMMAND_SUPERSEDES.get(command_type, ())
+        queue['pending'] = [c for c in queue['pending'] if c['type'] not in superseded]
+        command = {
+            'seq': queue['seq'],
+            'type': command_type,
+            'data': data,
+            'created_at': datetime.now().isoformat()
+        }
+        queue['pending'].append(command)
+        del queue['pending'][:-self.COMMAND_QUEUE_LIMIT]
+        self._persist_commands()
+        return command
+    
+    def ack_commands(self, client_id, seq, exact=False, queue_id=None):
+        """
+        Confirma comandos aplicados por el cliente.
+        
+        Args:
+            seq: Secuencia confirmada. Por defecto confirma también las anteriores
+                 (el cliente las aplica en orden desde /status).
+            exact: Solo ese comando (ack de un push, que puede llegar desordenado).
+            queue_id: Cola a la que se refiere el ack; si no es la actual se ignora.
+        """
+        queue = self.client_commands.get(client_id)
+        if not queue or not queue['pending']:
+            return
+        if queue_id is not None and queue_id != queue['id']:
+            return
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError):
+            return
+        before = len(queue['pending'])
+        if exact:
+            queue['pending'] = [c for c in queue['pending'] if c['seq'] != seq]
+        else:
+            queue['pending'] = [c for c in queue['pending'] if c['seq'] > seq]
+            queue['acked'] = max(queue['acked'], seq)
+        if len(queue['pending']) != before:
+            self._persist_commands()
+            self._record_change(client_id)
+    
+    @classmethod
+    def default_commands_path(cls, server_port):
+        """
+        Archivo de la cola de comandos de un servidor: CIBERMONDAY_COMMANDS_FILE o
+        ~/.cibermonday/commands-<puerto>.json. Vacío u 'off' la deja solo en memoria.
+        """
+        path = os.getenv(cls.COMMANDS_FILE_ENV)
+        if path is None:
+            return os.path.join(os.path.expanduser('~'), '.cibermonday', f'commands-{server_port}.json')
+        if path.strip().lower() in ('', 'off'):
+            return None
+        return path
+    
+    def _load_commands(self):
+        """Restaura las colas guardadas (los clientes las reciben al re-registrarse)."""
+        if not self.commands_path or not os.path.exists(self.commands_path):
+            return
+        try:
+            with open(self.commands_path, encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[Comandos] No se pudo leer {self.commands_path}: {e}")
+            return
+        for client_id, queue in (stored or {}).items():
+            if isinstance(queue, dict) and isinstance(queue.get('pending'), list) and queue.get('id'):
+                self.client_commands[client_id] = queue
+        pending = sum(len(q['pending']) for q in self.client_commands.values())
+        if pending:
+            print(f"[Comandos] {pending} comando(s) pendiente(s) restaurado(s) de {self.commands_path}")
+    
+    def _persist_commands(self):
+        """Guarda las colas con comandos pendientes (escritura atómica)."""
+        if not self.commands_path:
+            return
+        with self._commands_file_lock:
+            snapshot = {client_id: dict(queue, pending=list(queue['pending']))
+                        for client_id, queue in list(self.client_commands.items())
+                        if queue.get('pending')}
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.commands_path)), exist_ok=True)
+                tmp_path = f"{self.commands_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(snapshot, f)
+                os.replace(tmp_path, self.commands_path)
+            except OSError as e:
+                print(f"[Comandos] No se pudo guardar {self.commands_path}: {e}")
+    
+    def get_pending_commands(self, client_id):
+        """Comandos sin confirmar del cliente, en orden de secuencia."""
+        queue = self.client_commands.get(client_id)
+        if not queue:
+            return []
+        # 'delivered' es contabilidad del servidor, no viaja al cliente
+        return [{k: v for k, v in c.items() if k != 'delivered'} for c in queue['pending']]
+    
     # ==================== SESSION REPORTING ====================
     
-    def _has_pending_admin_change(self, client_id):
+    def _reported_end_time(self, remaining_seconds, end_ts=None):
         """
-        Verifica si hay un cambio de admin pendiente para este cliente.
-        Si el grace period expiró, lo limpia automáticamente.
+        Fin de una sesión reportada por el cliente. Con end_ts (deadline absoluto en
+        el reloj del servidor) no arrastra la demora de la red; sin él (clientes
+        viejos o end_ts inválido) se reconstruye desde remaining_seconds.
         """
-        if client_id not in self._pending_admin_changes:
+        if end_ts:
+            try:
+                return datetime.fromtimestamp(float(end_ts))
+            except (TypeError, ValueError, OverflowError, OSError):
+                pass
+        return datetime.now() + timedelta(seconds=remaining_seconds)
+    
+    def _session_unchanged(self, client_id, time_limit, end_time):
+        """True si la sesión guardada es la misma (mismo límite y fin dentro de la tolerancia)."""
+        session = self.client_sessions.get(client_id)
+        if not session or 'expired_at' in session or session.get('time_limit') != time_limit:
             return False
+        drift = abs((datetime.fromisoformat(session['end_time']) - end_time).total_seconds())
+        return drift <= self.SESSION_DRIFT_TOLERANCE
+    
+    def _new_version(self, client_id, kind):
+        """
+        Asigna una versión nueva (HLC) a la sesión o config del cliente: mayor que
+        cualquier versión emitida u observada por este servidor y, entre servidores,
+        ordenada por el reloj de pared (salvo desfasajes de reloj entre ellos).
+        """
+        with self._version_lock:
+            wall = int(time.time() * 1000)
+            if wall > self._hlc_wall:
+                self._hlc_wall, self._hlc_counter = wall, 0
+            elif self._hlc_counter < self.HLC_COUNTER_MASK:
+                self._hlc_counter += 1
+            else:
+                self._hlc_wall, self._hlc_counter = self._hlc_wall + 1, 0
+            version = (self._hlc_wall << 32) | (self._hlc_counter << 16) | self._hlc_node
+        self.clients_db[client_id][f'{kind}_version'] = version
+        return version
+    
+    def _observe_version(self, version):
+        """Adelanta el HLC a una versión vista (reporte o replicación)."""
+        if not isinstance(version, int) or isinstance(version, bool) or version <= 0:
+            return
+        seen = (version >> 32, (version >> 16) & self.HLC_COUNTER_MASK)
+        with self._version_lock:
+            if seen > (self._hlc_wall, self._hlc_counter):
+                self._hlc_wall, self._hlc_counter = seen
+    
+    def _is_stale_report(self, client_id, kind, version):
+        """
+        True si el reporte del cliente es anterior al último cambio del admin.
         
-        elapsed = (datetime.now() - self._pending_admin_changes[client_id]).total_seconds()
-        if elapsed > self.ADMIN_CHANGE_GRACE_SECONDS:
-            # Grace period expirado, limpiar
-            del self._pending_admin_changes[client_id]
-            return False
+        - version menor a la guardada: el cliente todavía no recibió el cambio.
+        - igual: lo confirma; mayor: el servidor perdió estado (ej: reinicio) y la adopta.
+        - None: cliente sin versionado, se acepta como antes.
         
-        return True
+        Las versiones son HLC con el nodo emisor en los bits bajos: igual significa
+        el mismo cambio del mismo servidor, no un cambio distinto con igual contador.
+        """
+        if not isinstance(version, int) or isinstance(version, bool) or \
+                client_id not in self.clients_db:
+            return False
+        key = f'{kind}_version'
+        current = self.clients_db[client_id].get(key, 0)
+        if version < current:
+            return True
+        if version > current:
+            self.clients_db[client_id][key] = version
+            self._observe_version(version)
+        return False
     
-    def report_session(self, client_id, remaining_seconds, time_limit_seconds=None):
+    def report_session(self, client_id, remaining_seconds, time_limit_seconds=None, end_ts=None,
+                       version=None):
         """
         Permite a un cliente reportar su sesión activa.
+        
+        end_ts es el fin de la sesión como timestamp ya corregido al reloj del
+        servidor (offset estimado por el cliente). Con él, reportar la misma sesión
+        dos veces da el mismo resultado y el reporte no reescribe nada.
         Si remaining_seconds <= 0, marca la sesión como expirada pero la mantiene
         para que el panel siga mostrando "EXPIRADO". La sesión solo se elimina
         cuando el admin asigna nuevo tiempo o hace "Detener".
         
-        Si hay un cambio de admin pendiente (grace period), el reporte se ignora
-        para evitar que el sync del cliente sobreescriba el cambio del admin.
+        version es la versión de sesión que tiene el cliente. Si es anterior al
+        último cambio del admin, el reporte se rechaza y se devuelve la sesión
+        vigente (stale=True) para que el cliente la adopte.
         
         Returns:
             dict con success, message, session
         """
         if client_id not in self.clients_db:
             return {'success': False, 'message': 'Cliente no encontrado'}
+        self.metrics.client_reports.inc(client_id)
         
         # El cliente está reportando, actualizar last_seen
         self._touch_client(client_id)
+        known_version = self.clients_db[client_id].get('session_version', 0)
         
-        # Verificar si hay un cambio de admin pendiente
-        if self._has_pending_admin_change(client_id):
+        # Reporte anterior al último cambio del admin: devolver la sesión vigente
+        if self._is_stale_report(client_id, 'session', version):
             return {
                 'success': True,
-                'message': 'Cambio de admin pendiente, reporte ignorado',
-                'session': None
+                'stale': True,
+                'message': 'Versión de sesión vieja, reporte rechazado',
+                'session': self._session_view(client_id),
+                'version': self.clients_db[client_id].get('session_version', 0)
             }
         
         # remaining_seconds <= 0: sesión expirada. Mantener la sesión en client_sessions
@@ -578,6 +974,7 @@ class ClientManager:
                 }
                 self.clients_db[client_id]['total_time_used'] += time_limit_seconds
             self.clients_db[client_id]['is_active'] = False
+            self._record_change(client_id)
             return {
                 'success': True,
                 'message': 'Sesión expirada',
@@ -585,15 +982,64 @@ class ClientManager:
             }
         
         time_limit = time_limit_seconds or remaining_seconds
-        end_time = datetime.now() + timedelta(seconds=remaining_seconds)
+        end_time = self._reported_end_time(remaining_seconds, end_ts)
         start_time = end_time - timedelta(seconds=time_limit)
+        remaining_seconds = max(0, int((end_time - datetime.now()).total_seconds()))
+        
+        # El deadline de la sesión que el servidor ya conoce no se mueve con el reporte:
+        # si el cliente dice tener otro tiempo (reloj o registro manipulados) se marca
+        # y la sesión guardada queda como está
+        deadline = self._known_deadline(client_id, version, known_version)
+        if deadline:
+            self._check_deadline_divergence(client_id, remaining_seconds, deadline)
+            if datetime.fromisoformat(deadline) <= datetime.now():
+                # Vencida según el servidor: no revivirla y pedirle al cliente que bloquee
+                self._mark_session_expired(client_id)
+                return {
+                    'success': True,
+                    'message': 'Sesión vencida según el servidor',
+                    'session': None,
+                    'lock': True
+                }
+            session = self.client_sessions[client_id]
+            self.clients_db[client_id]['is_active'] = 'expired_at' not in session
+            return {
+                'success': True,
+                'message': 'Sesión según el deadline del servidor',
+                'unchanged': True,
+                'session': {
+                    'time_limit_seconds': session['time_limit'],
+                    'start_time': session['start_time'],
+                    'end_time': session['end_time'],
+                    'remaining_seconds': max(0, int(
+                        (datetime.fromisoformat(deadline) - datetime.now()).total_seconds()))
+                }
+            }
+        
+        if self._session_unchanged(client_id, time_limit, end_time):
+            session = self.client_sessions[client_id]
+            self.clients_db[client_id]['is_active'] = True
+            return {
+                'success': True,
+                'message': 'Sesión sin cambios',
+                'unchanged': True,
+                'session': {
+                    'time_limit_seconds': session['time_limit'],
+                    'start_time': session['start_time'],
+                    'end_time': session['end_time'],
+                    'remaining_seconds': remaining_seconds
+                }
+            }
         
         self.client_sessions[client_id] = {
             'time_limit': time_limit,
             'start_time': start_time.isoformat(),
-            'end_time': end_time.isoformat()
+            'end_time': end_time.isoformat(),
+            'deadline': end_time.isoformat()
         }
         self.clients_db[client_id]['is_active'] = True
+        self._record_change(client_id)
+        self._schedule_expiry(client_id)
         
         return {
             'success': True,
@@ -606,6 +1052,142 @@ class ClientManager:
             }
         }
     
+    # ==================== BATCH INGEST (OUTBOX) ====================
+    
+    # Eventos de historial guardados por cliente
+    CLIENT_HISTORY_LIMIT = 50
+    # Claves de idempotencia recordadas por cliente
+    INGESTED_KEYS_LIMIT = 1000
+    
+    def ingest_events(self, client_id, events):
+        """
+        Aplica un batch de transiciones de estado acumuladas por el cliente
+        (ej: durante una caída de todos los servidores).
+        
+        Cada evento trae una clave de idempotencia: si ya se aplicó, se ignora pero
+        se confirma igual, para que el cliente pueda descartarlo de su outbox.
+        
+        Args:
+            client_id: ID del cliente
+            events: Lista de dicts con key, type, at, data
+            
+        Returns:
+            dict con success, accepted (claves confirmadas), applied, duplicates
+        """
+        if client_id not in self.clients_db:
+            return {'success': False, 'message': 'Cliente no encontrado'}
+        
+        self._touch_client(client_id)
+        self.metrics.client_reports.inc(client_id)
+        
+        seen = self._ingested_event_keys.setdefault(client_id, {})
+        accepted = []
+        applied = 0
+        duplicates = 0
+        
+        for event in sorted(events or [], key=lambda e: e.get('at') or ''):
+            key = event.get('key')
+            if not key:
+                continue
+            accepted.append(key)
+            if key in seen:
+                duplicates += 1
+                continue
+            
+            self._apply_client_event(client_id, event)
+            seen[key] = None
+            applied += 1
+        
+        # Acotar las claves recordadas (se descartan las más viejas)
+        while len(seen) > self.INGESTED_KEYS_LIMIT:
+            del seen[next(iter(seen))]
+        
+        if applied:
+            self._record_change(client_id)
+            print(f"[Batch] Cliente {client_id[:8]}...: {applied} evento(s) aplicados, {duplicates} duplicado(s)")
+        
+        return {
+            'success': True,
+            'accepted': accepted,
+            'applied': applied,
+            'duplicates': duplicates
+        }
+    
+    @staticmethod
+    def _event_end_time(data):
+        """
+        Fin de la sesión de un evento del outbox: end_ts (en el reloj del servidor)
+        si el cliente conocía el offset, si no el end_time local del cliente.
+        """
+        try:
+            if data.get('end_ts'):
+                return datetime.fromtimestamp(float(data['end_ts']))
+            if data.get('end_time'):
+                return datetime.fromisoformat(data['end_time'])
+        except (TypeError, ValueError, OverflowError, OSError):
+            pass
+        return None
+    
+    def _apply_client_event(self, client_id, event):
+        """Aplica UNA transición reportada por el cliente y la agrega al historial."""
+        event_type = event.get('type')
+        data = event.get('data') or {}
+        
+        if event_type == 'session_expired':
+            time_limit = data.get('time_limit_seconds') or 0
+            end_time = self._event_end_time(data)
+            session = self.client_sessions.get(client_id)
+            if session:
+                # Solo si es la misma sesión: un outbox que llega tarde no puede
+                # vencer una sesión que el admin asignó después (queda en el historial)
+                if end_time and self._session_unchanged(client_id, time_limit, end_time):
+                    session['expired_at'] = event.get('at') or datetime.now().isoformat()
+                    self.clients_db[client_id]['total_time_used'] += session['time_limit']
+                    self.clients_db[client_id]['is_active'] = False
+            elif time_limit > 0:
+                # El servidor no conocía la sesión: registrarla como expirada
+                expired_at = event.get('at') or datetime.now().isoformat()
+                end_time = end_time or datetime.fromisoformat(expired_at)
+                start_time = end_time - timedelta(seconds=time_limit)
+                self.client_sessions[client_id] = {
+                    'time_limit': time_limit,
+                    'start_time': start_time.isoformat(),
+                    'end_time': end_time.isoformat(),
+                    'expired_at': expired_at
+                }
+                self.clients_db[client_id]['total_time_used'] += time_limit
+                self.clients_db[client_id]['is_active'] = False
+        
+        history = self.client_history.setdefault(client_id, [])
+        # end_ts depende del offset estimado en cada envío: no forma parte del evento
+        record = {'type': event_type, 'at': event.get('at'),
+                  'data': {k: v for k, v in data.items() if k != 'end_ts'}}
+        # Un reinicio del cliente puede re-reportar la misma transición con otra clave
+        if any(h['type'] == record['type'] and h['data'] == record['data'] for h in history):
+            return
+        history.append(record)
+        if len(history) > self.CLIENT_HISTORY_LIMIT:
+            del history[:len(history) - self.CLIENT_HISTORY_LIMIT]
+    
+    def get_client_history(self, client_id):
+        """Historial de transiciones del cliente, o None si no existe."""
+        if client_id not in self.clients_db:
+            return None
+        return list(self.client_history.get(client_id, []))
+    
+    def get_fleet_health(self, client_id=None):
+        """
+        Salud de la sincronización de la flota según la telemetría de los clientes.
+        Con client_id, las muestras guardadas de ese cliente.
+        """
+        if client_id:
+            if client_id not in self.clients_db:
+                return {'success': False, 'message': 'Cliente no encontrado'}
+            return {'success': True, 'client_id': client_id,
+                    'samples': self.telemetry.samples(client_id)}
+        names = {cid: client.get('name') for cid, client in list(self.clients_db.items())}
+        return self.telemetry.fleet_health(names)
+    
     # ==================== SERVER MANAGEMENT ====================
     
     def register_server(self, server_url, server_ip=None, server_port=None):
@@ -689,13 +1271,21 @@ class ClientManager:
                 }
                 if client_id not in self.client_configs:
                     self.client_configs[client_id] = self.DEFAULT_CONFIG.copy()
+                self._record_change(client_id)
     
-    def _sync_with_other_servers(self):
+    def _sync_with_other_servers(self, force=False):
         """
         Sincroniza la lista de servidores conocidos con otros servidores.
         Solo sincroniza SERVIDORES, no clientes. Los clientes son la fuente
         de verdad de su propia sesión y la propagan a cada server al sincronizar.
+        
+        Args:
+            force: Si False (disparo automático), solo lo hace el líder para no
+                   duplicar el trabajo en cada servidor.
         """
+        if not force and not self.is_leader():
+            return
+        
         my_url = self.local_server_url
         if not my_url:
             return
@@ -730,19 +1320,594 @@ class ClientManager:
             except Exception:
                 pass
     
+    # ==================== REPLICACIÓN ENTRE SERVIDORES ====================
+    
+    def _client_state(self, client_id):
+        """Estado completo de un cliente tal como se replica (None si no existe)."""
+        if client_id not in self.clients_db:
+            return None
+        session = self.client_sessions.get(client_id)
+        config = self.client_configs.get(client_id)
+        commands = self.client_commands.get(client_id)
+        return {
+            'client': dict(self.clients_db[client_id]),
+            'session': dict(session) if session else None,
+            'config': dict(config) if config else None,
+            'commands': dict(commands, pending=list(commands['pending'])) if commands else None
+        }
+    
+    def _record_change(self, client_id):
+        """
+        Agrega al log de replicación el estado actual del cliente (o su borrado).
+        Las entradas son de estado completo, así aplicarlas es idempotente y un peer
+        atrasado puede saltar entradas intermedias del mismo cliente.
+        """
+        state = self._client_state(client_id)
+        with self._replication_lock:
+            # Versión estrictamente creciente aunque el reloj no avance
+            at = max(time.time(), self._client_versions.get(client_id, 0) + 1e-6)
+            self._client_versions[client_id] = at
+            self._change_seq += 1
+            self._change_log.append({
+                'seq': self._change_seq,
+                'at': at,
+                'op': 'upsert' if state else 'delete',
+                'client_id': client_id,
+                'state': state
+            })
+            if len(self._change_log) > self.CHANGE_LOG_LIMIT:
+                del self._change_log[:len(self._change_log) - self.CHANGE_LOG_LIMIT]
+        if state:
+            self._replicated_touch[client_id] = time.time()
+        else:
+            self._replicated_touch.pop(client_id, None)
+        self._replication_wake.set()
+    
+    def _changes_since(self, cursor):
+        """
+        Entradas con seq > cursor, coalescidas por cliente (queda la última).
+        
+        Returns:
+            (entries, new_cursor, snapshot). snapshot=True si el cursor quedó fuera
+            del log retenido y se devuelve el estado completo en su lugar.
+        """
+        with self._replication_lock:
+            base_seq = self._change_log[0]['seq'] if self._change_log else self._change_seq + 1
+            if cursor < base_seq - 1:
+                entries = self._snapshot_entries()
+                return entries, self._change_seq, True
+            start = cursor - base_seq + 1
+            batch = self._change_log[start:start + self.REPLICATION_BATCH_SIZE]
+            new_cursor = batch[-1]['seq'] if batch else cursor
+        
+        latest = {}
+        for entry in batch:
+            # Las intenciones de push no se coalescen: cada una se entrega
+            key = ('push', entry['seq']) if entry['op'] == 'push' else entry['client_id']
+            latest[key] = entry
+        entries = sorted(latest.values(), key=lambda e: e['seq'])
+        return entries, new_cursor, False
+    
+    def _snapshot_entries(self):
+        """Estado completo como entradas (upserts y borrados conocidos). Requiere el lock."""
+        entries = []
+        for client_id, at in self._client_versions.items():
+            state = self._client_state(client_id)
+            entries.append({
+                'seq': self._change_seq,
+                'at': at,
+                'op': 'upsert' if state else 'delete',
+                'client_id': client_id,
+                'state': state
+            })
+        return entries
+    
+    def is_replication_peer(self, remote_addr, secret=None):
+        """
+        True si un POST /api/replicate viene de un servidor de la malla. Con secreto
+        configurado se exige el secreto; sin él, la IP tiene que ser la de un servidor
+        conocido o de esta misma máquina.
+        """
+        if self.mesh_secret:
+            return bool(secret) and hmac.compare_digest(str(secret), self.mesh_secret)
+        if remote_addr in ('127.0.0.1', '::1'):
+            return True
+        peer_ips = set()
+        for server in list(self.servers_db.values()):
+            peer_ips.add(server.get('ip'))
+            peer_ips.add(urlparse(server.get('url') or '').hostname)
+        return remote_addr in peer_ips or remote_addr == self.get_local_ip()
+    
+    @classmethod
+    def _valid_push_command(cls, command):
+        """Valida un comando recibido en una intención de push replicada."""
+        return (isinstance(command, dict)
+                and command.get('type') in cls.COMMAND_SUPERSEDES
+                and isinstance(command.get('seq'), int) and not isinstance(command['seq'], bool)
+                and isinstance(command.get('data'), dict))
+    
+    def apply_replication(self, origin_url, origin_epoch, entries, claimed_leader=None):
+        """
+        Aplica entradas recibidas de otro servidor. Gana la versión más nueva por
+        cliente; las entradas aplicadas NO se vuelven a loguear (cada servidor
+        replica directamente a todos sus peers).
+        
+        Args:
+            claimed_leader: Líder que reconoce el peer emisor (heartbeat de liderazgo).
+        
+        Returns:
+            dict con success, epoch (la nuestra, para que el peer detecte reinicios),
+            leader, applied, stale
+        """
+        if origin_epoch == self.recovery_epoch:
+            # Nos estamos enviando a nosotros mismos (otra URL del mismo servidor)
+            return {'success': True, 'self': True, 'epoch': self.recovery_epoch, 'applied': 0, 'stale': 0}
+        
+        if origin_url and origin_url != self.local_server_url:
+            known = {s.get('url') for s in self.servers_db.values()}
+            if origin_url not in known:
+                self.register_server(origin_url)
+            self._note_peer_alive(origin_url, claimed_leader)
+        
+        applied = 0
+        stale = 0
+        for entry in entries or []:
+            client_id = entry.get('client_id')
+            at = entry.get('at') or 0
+            if not client_id:
+                continue
+            if entry.get('op') == 'push':
+                # Intención de push de otro servidor: la entrega el dueño primario
+                command = entry.get('data')
+                if not self._valid_push_command(command):
+                    print(f"[Replicación] Intención de push inválida de {origin_url}, ignorada")
+                    continue
+                if client_id in self.clients_db and self._should_deliver_push(client_id):
+                    self._push_command(client_id, command)
+                continue
+            with self._replication_lock:
+                if at <= self._client_versions.get(client_id, 0):
+                    stale += 1
+                    continue
+                self._client_versions[client_id] = at
+            
+            state = entry.get('state')
+            if entry.get('op') == 'delete' or not state:
+                self.clients_db.pop(client_id, None)
+                self.client_sessions.pop(client_id, None)
+                self.client_configs.pop(client_id, None)
+                self.client_history.pop(client_id, None)
+                self._ingested_event_keys.pop(client_id, None)
+                self.client_commands.pop(client_id, None)
+                self._replicated_touch.pop(client_id, None)
+            else:
+                self.clients_db[client_id] = state['client']
+                self._observe_version(max(state['client'].get('session_version', 0),
+                                          state['client'].get('config_version', 0)))
+                if state.get('session'):
+                    self.client_sessions[client_id] = state['session']
+                else:
+                    self.client_sessions.pop(client_id, None)
+                if state.get('config'):
+                    self.client_configs[client_id] = state['config']
+                else:
+                    self.client_configs.pop(client_id, None)
+                if state.get('commands'):
+                    self.client_commands[client_id] = state['commands']
+                else:
+                    self.client_commands.pop(client_id, None)
+                # Ya está replicado: no re-enviar el last_seen recibido
+                self._replicated_touch[client_id] = time.time()
+                self._schedule_expiry(client_id)
+            applied += 1
+        
+        if applied:
+            self._persist_commands()
+        
+        return {
+            'success': True,
+            'epoch': self.recovery_epoch,
+            'leader': self.get_leader(),
+            'applied': applied,
+            'stale': stale
+        }
+    
+    def _replication_peers(self):
+        """URLs de los demás servidores conocidos."""
+        my_url = self.local_server_url
+        return [s['url'] for s in self.get_servers() if s.get('url') and s['url'] != my_url]
+    
+    def _ship_to_peer(self, peer_url):
+        """
+        Envía al peer las entradas posteriores a su cursor (o un heartbeat vacío).
+        Si el peer reinició (época nueva) o el cursor quedó fuera del log, envía
+        el estado completo.
+        """
+        # cursor -1: el primer envío a un peer es siempre el estado completo
+        peer = self._peer_replication.setdefault(peer_url, {
+            'cursor': -1, 'epoch': None, 'failures': 0, 'next_attempt': 0,
+            'last_sent': 0, 'last_ack': None, 'is_self': False
+        })
+        now = time.time()
+        if peer['is_self'] or now < peer['next_attempt']:
+            return
+        
+        entries, new_cursor, snapshot = self._changes_since(peer['cursor'])
+        if not entries and now - peer['last_sent'] < self.REPLICATION_HEARTBEAT:
+            return
+        
+        payload = {
+            'origin': self.local_server_url,
+            'epoch': self.recovery_epoch,
+            'leader': self.get_leader(),
+            'snapshot': snapshot,
+            'entries': entries
+        }
+        try:
+            headers = {'Content-Type': 'application/json'}
+            if self.mesh_secret:
+                headers[self.MESH_SECRET_HEADER] = self.mesh_secret
+            req = urllib.request.Request(
+                f"{peer_url}/api/replicate",
+                data=json.dumps(payload).encode('utf-8'),
+                headers=headers
+            )
+            with urllib.request.urlopen(req, timeout=3) as response:
+                result = json.loads(response.read().decode('utf-8'))
+        except Exception as e:
+            peer['failures'] += 1
+            peer['next_attempt'] = now + min(30, 2 ** peer['failures'])
+            if peer['failures'] in (1, 5) or peer['failures'] % 20 == 0:
+                print(f"[Replicación] {peer_url} no disponible ({peer['failures']} fallo(s)): {e}")
+            return
+        
+        peer['failures'] = 0
+        peer['next_attempt'] = 0
+        peer['last_sent'] = now
+        peer['last_ack'] = datetime.now().isoformat()
+        
+        if result.get('self'):
+            peer['is_self'] = True
+            return
+        self._note_peer_alive(peer_url, result.get('leader'))
+        
+        peer_epoch = result.get('epoch')
+        if peer['epoch'] is not None and peer_epoch != peer['epoch']:
+            # El peer reinició con el estado vacío: reenviar todo desde cero
+            print(f"[Replicación] {peer_url} reinició. Enviando estado completo...")
+            peer['epoch'] = peer_epoch
+            peer['cursor'] = -1
+            self._replication_wake.set()
+            return
+        peer['epoch'] = peer_epoch
+        peer['cursor'] = new_cursor
+        if snapshot:
+            print(f"[Replicación] Estado completo enviado a {peer_url} ({len(entries)} cliente(s))")
+        
+        # Si quedaron entradas pendientes (batch lleno), seguir enseguida
+        if new_cursor < self._change_seq:
+            self._replication_wake.set()
+    
+    def start_replication(self, stop_check=None):
+        """
+        Inicia el hilo que envía el log de cambios a cada peer. Se despierta con
+        cada cambio (agrupando los que llegan casi juntos) y cada REPLICATION_HEARTBEAT
+        segundos para detectar peers reiniciados.
+        """
+        def replication_thread():
+            should_run = lambda: (stop_check is None or not stop_check())
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.REPLICATION_MAX_PARALLEL) as pool:
+                while should_run():
+                    if self._replication_wake.wait(self.REPLICATION_HEARTBEAT):
+                        # Agrupar ráfagas de cambios en un solo envío
+                        time.sleep(0.05)
+                    self._replication_wake.clear()
+                    try:
+                        peers = self._replication_peers()
+                        list(pool.map(self._ship_to_peer, peers))
+                        self._evaluate_leader()
+                    except Exception as e:
+                        print(f"[Replicación] Error: {e}")
+        
+        thread = threading.Thread(target=replication_thread, daemon=True)
+        thread.start()
+        return thread
+    
+    def get_replication_status(self):
+        """Cursor y estado de envío por peer."""
+        with self._replication_lock:
+            head = self._change_seq
+            retained = len(self._change_log)
+        peers = {}
+        for url, peer in list(self._peer_replication.items()):
+            if peer['is_self']:
+                continue
+            peers[url] = {
+                'cursor': peer['cursor'],
+                'lag': head - peer['cursor'],
+                'failures': peer['failures'],
+                'last_ack': peer['last_ack']
+            }
+        return {'head_seq': head, 'retained': retained, 'peers': peers}
+    
+    # ==================== LÍDER ====================
+    
+    def _note_peer_alive(self, peer_url, claimed_leader=None):
+        """Registra contacto con un peer y a quién reconoce como líder."""
+        self._peer_seen[peer_url] = time.time()
+        if claimed_leader is not None:
+            self._peer_claims[peer_url] = claimed_leader
+    
+    def _live_peers(self):
+        """Peers de los que se supo dentro del lease."""
+        now = time.time()
+        return {url for url, seen in list(self._peer_seen.items())
+                if now - seen < self.LEADER_LEASE_SECONDS}
+    
+    def _evaluate_leader(self):
+        """
+        Elige líder entre este servidor y los peers vivos.
+        
+        - Si algún peer vivo (o este servidor) ya se proclama líder, se lo mantiene
+          (liderazgo "pegajoso": un servidor que se une no desplaza al actual).
+        - Si hay más de uno (malla re-unida), gana la URL menor.
+        - Si nadie lo es, el de URL menor. Al arrancar se espera un lease para
+          escuchar heartbeats antes de proclamarse, salvo que no haya otros servidores.
+        - Sin URL local (sin IP de LAN) este servidor no se proclama: solo reconoce
+          a un peer que ya sea líder.
+        """
+        me = self.local_server_url
+        live = self._live_peers()
+        claimants = {url for url in live if self._peer_claims.get(url) == url}
+        if me and self._leader == me:
+            claimants.add(me)
+        
+        if claimants:
+            leader = min(claimants)
+        else:
+            warming_up = time.monotonic() - self._started_monotonic < self.LEADER_LEASE_SECONDS
+            if not me or (warming_up and self._replication_peers()):
+                return self._leader
+            leader = min(live | {me})
+        
+        if leader != self._leader:
+            role = "este servidor" if leader == me else leader
+            print(f"[Líder] Nuevo líder: {role}")
+            self._leader = leader
+        return leader
+    
+    def get_leader(self):
+        """URL del líder actual (None mientras no se eligió)."""
+        return self._leader
+    
+    def is_leader(self):
+        """
+        True si este servidor es el líder. Sin la replicación corriendo (ej: un
+        único servidor sin malla) se evalúa en el momento.
+        """
+        if self._leader is None:
+            self._evaluate_leader()
+        me = self.local_server_url
+        return me is not None and self._leader == me
+    
+    def _should_deliver_push(self, client_id):
+        """
+        Entrega los push el dueño primario del cliente (entre los servidores vivos),
+        así la carga de push se reparte según el anillo. Como el anillo solo
+        contiene servidores vivos, si el dueño cae otro toma su lugar.
+        """
+        owners = self.get_client_owners(client_id)
+        return not owners or owners[0] == self.local_server_url
+    
+    def _record_push_intent(self, client_id, command):
+        """Agrega al log una intención de push (un comando encolado) para que la entregue el dueño primario."""
+        with self._replication_lock:
+            self._change_seq += 1
+            self._change_log.append({
+                'seq': self._change_seq,
+                'at': time.time(),
+                'op': 'push',
+                'client_id': client_id,
+                'event': command['type'],
+                'data': command
+            })
+            if len(self._change_log) > self.CHANGE_LOG_LIMIT:
+                del self._change_log[:len(self._change_log) - self.CHANGE_LOG_LIMIT]
+        self._replication_wake.set()
+    
+    def get_leader_status(self):
+        """Líder actual y peers vivos (para /api/health)."""
+        return {
+            'leader': self._leader,
+            'is_leader': self._leader is not None and self._leader == self.local_server_url,
+            'live_peers': sorted(self._live_peers())
+        }
+    
+    # ==================== DUEÑOS DE CLIENTES ====================
+    
+    def _current_ring(self):
+        """Anillo sobre este servidor y los peers vivos (se actualiza al cambiar el set)."""
+        me = self.local_server_url
+        # Sin URL local (sin IP de LAN) este servidor no entra al anillo
+        members = self._live_peers() | ({me} if me else set())
+        current = self._ring.nodes
+        for node in current - members:
+            self._ring.remove(node)
+        for node in members - current:
+            self._ring.add(node)
+        return self._ring
+    
+    def get_client_owners(self, client_id):
+        """
+        Servidores dueños del cliente (replication_factor R), en orden de preferencia.
+        El cliente sincroniza con el primero y usa los siguientes como respaldo.
+        """
+        replication_factor = self.server_config.get('replication_factor', 2)
+        return self._current_ring().owners(client_id, replication_factor)
+    
+    def is_client_owner(self, client_id):
+        """True si este servidor es uno de los R dueños del cliente."""
+        return self.local_server_url in self.get_client_owners(client_id)
+    
+    # ==================== EXPIRACIÓN EN EL SERVIDOR ====================
+    
+    def _known_deadline(self, client_id, version, known_version):
+        """
+        Deadline de la sesión que el servidor ya conoce para este cliente, o None si
+        no conoce ninguna (se adopta la reportada).
+        
+        Mientras el reporte sea de la misma versión de sesión (o sin versión) el
+        deadline del servidor manda, sin importar el time_limit que diga el cliente.
+        Una versión mayor es un cambio del admin que este servidor no vio: se adopta.
+        
+        Args:
+            version: versión de sesión del reporte
+            known_version: session_version que tenía el servidor antes del reporte
+        """
+        session = self.client_sessions.get(client_id)
+        if not session:
+            return None
+        if isinstance(version, int) and not isinstance(version, bool) and version > known_version:
+            return None
+        return session.get('deadline') or session['end_time']
+    
+    def _check_deadline_divergence(self, client_id, reported_remaining, deadline):
+        """
+        Compara el remaining reportado por el cliente con el deadline del servidor y
+        marca (o limpia) deadline_divergence en el cliente.
+        """
+        expected = int((datetime.fromisoformat(deadline) - datetime.now()).total_seconds())
+        delta = reported_remaining - expected
+        client = self.clients_db[client_id]
+        if abs(delta) <= self.EXPIRY_DIVERGENCE_TOLERANCE:
+            if client.pop('deadline_divergence', None):
+                print(f"[Expiración] Cliente {client_id[:8]}... volvió a coincidir con el deadline")
+            return
+        if 'deadline_divergence' not in client:
+            print(f"[Expiración] Cliente {client_id[:8]}... reporta {reported_remaining}s "
+                  f"pero según el servidor le quedan {max(0, expected)}s ({delta:+d}s)")
+        client['deadline_divergence'] = {
+            'reported_remaining': reported_remaining,
+            'expected_remaining': max(0, expected),
+            'delta_seconds': delta,
+            'detected_at': datetime.now().isoformat()
+        }
+    
+    def _schedule_expiry(self, client_id):
+        """
+        Agenda el vencimiento de la sesión del cliente. Las entradas viejas del heap
+        no se borran: se descartan al salir si ya no son el deadline vigente.
+        """
+        session = self.client_sessions.get(client_id)
+        with self._expiry_cond:
+            if not session or 'expired_at' in session:
+                self._expiry_scheduled.pop(client_id, None)
+                return
+            deadline = session.get('deadline') or session['end_time']
+            if self._expiry_scheduled.get(client_id) == deadline:
+                return
+            self._expiry_scheduled[client_id] = deadline
+            entry = (datetime.fromisoformat(deadline).timestamp(), client_id, deadline)
+            heapq.heappush(self._expiry_heap, entry)
+            if self._expiry_heap[0] is entry:
+                # Es el próximo vencimiento: despertar al scheduler para acortar la espera
+                self._expiry_cond.notify()
+    
+    def _recheck_expiry(self, client_id, deadline):
+        """Vuelve a agendar un deadline vencido que este servidor no hizo cumplir."""
+        with self._expiry_cond:
+            if client_id in self._expiry_scheduled:
+                # Se agendó otro deadline mientras tanto
+                return
+            self._expiry_scheduled[client_id] = deadline
+            heapq.heappush(self._expiry_heap,
+                           (time.time() + self.LEADER_LEASE_SECONDS, client_id, deadline))
+    
+    def _mark_session_expired(self, client_id):
+        """Marca la sesión como vencida (una sola vez). Retorna True si cambió."""
+        session = self.client_sessions.get(client_id)
+        if not session or 'expired_at' in session:
+            return False
+        session['expired_at'] = datetime.now().isoformat()
+        self.clients_db[client_id]['total_time_used'] += session['time_limit']
+        self.clients_db[client_id]['is_active'] = False
+        self._record_change(client_id)
+        return True
+    
+    def _enforce_expiry(self, client_id, deadline):
+        """
+        Vencimiento alcanzado: el dueño primario marca la sesión como vencida y le
+        envía al cliente la orden de bloqueo. Los demás servidores reciben el estado
+        por replicación (así el cliente recibe un solo push) y vuelven a revisar cada
+        LEADER_LEASE_SECONDS: si el dueño cayó, el anillo cambia y el nuevo dueño
+        primario bloquea.
+        """
+        session = self.client_sessions.get(client_id)
+        if not session or 'expired_at' in session or \
+                (session.get('deadline') or session['end_time']) != deadline:
+            return
+        if not self._should_deliver_push(client_id):
+            self._recheck_expiry(client_id, deadline)
+            return
+        if not self._mark_session_expired(client_id):
+            # El cliente ya reportó el vencimiento: se bloqueó solo
+            return
+        print(f"[Expiración] Sesión de {client_id[:8]}... vencida en el servidor, enviando bloqueo")
+        self._notify_client(client_id, 'lock', {
+            'reason': 'deadline',
+            'deadline': deadline,
+            'time_limit_seconds': session['time_limit'],
+            # El cliente descarta el bloqueo si ya tiene una sesión más nueva
+            'version': self.clients_db[client_id].get('session_version', 0)
+        })
+    
+    def start_expiry_scheduler(self, stop_check=None):
+        """
+        Inicia el hilo que hace cumplir los deadlines como respaldo del bloqueo del
+        cliente. Duerme hasta el próximo vencimiento (o hasta que se agende uno
+        anterior); no recorre los clientes periódicamente.
+        """
+        def expiry_thread():
+            should_run = lambda: (stop_check is None or not stop_check())
+            while should_run():
+                with self._expiry_cond:
+                    heap = self._expiry_heap
+                    # Descartar entradas reemplazadas por un deadline más nuevo
+                    while heap and self._expiry_scheduled.get(heap[0][1]) != heap[0][2]:
+                        heapq.heappop(heap)
+                    delay = heap[0][0] - time.time() if heap else self.EXPIRY_MAX_WAIT
+                    if delay > 0:
+                        self._expiry_cond.wait(min(delay, self.EXPIRY_MAX_WAIT))
+                        continue
+                    _, client_id, deadline = heapq.heappop(heap)
+                    self._expiry_scheduled.pop(client_id, None)
+                try:
+                    self._enforce_expiry(client_id, deadline)
+                except Exception as e:
+                    print(f"[Expiración] Error: {e}")
+        
+        thread = threading.Thread(target=expiry_thread, daemon=True)
+        thread.start()
+        return thread
+    
     # ==================== SERVER CONFIG ====================
     
     def get_server_config(self):
         """Obtiene la configuración del servidor."""
         return self.server_config.copy()
     
-    def set_server_config(self, broadcast_interval=None):
+    def set_server_config(self, broadcast_interval=None, broadcast_max_interval=None,
+                          discovery_mode=None, multicast_group=None, multicast_ttl=None,
+                          replication_factor=None):
         """
         Actualiza la configuración del servidor.
         
         Returns:
             dict con success, config, message
         """
+        updates = {}
+        
         if broadcast_interval is not None:
             broadcast_interval = int(broadcast_interval)
             if broadcast_interval < 1:
@@ -750,8 +1915,65 @@ class ClientManager:
                     'success': False,
                     'message': 'El intervalo de broadcast debe ser al menos 1 segundo'
                 }
-            self.server_config['broadcast_interval'] = broadcast_interval
-            print(f"[Config] Intervalo de broadcast actualizado a {broadcast_interval} segundos")
+            updates['broadcast_interval'] = broadcast_interval
+        
+        if broadcast_max_interval is not None:
+            broadcast_max_interval = int(broadcast_max_interval)
+            if broadcast_max_interval < updates.get('broadcast_interval', self.server_config['broadcast_interval']):
+                return {
+                    'success': False,
+                    'message': 'El intervalo máximo no puede ser menor al intervalo de broadcast'
+                }
+            updates['broadcast_max_interval'] = broadcast_max_interval
+        
+        if discovery_mode is not None:
+            if discovery_mode not in self.DISCOVERY_MODES:
+                return {
+                    'success': False,
+                    'message': f"Modo de descubrimiento inválido. Opciones: {', '.join(self.DISCOVERY_MODES)}"
+                }
+            updates['discovery_mode'] = discovery_mode
+        
+        if multicast_group is not None:
+            try:
+                is_multicast = ipaddress.IPv4Address(multicast_group).is_multicast
+            except ValueError:
+                is_multicast = False
+            if not is_multicast:
+                return {
+                    'success': False,
+                    'message': 'El grupo multicast debe ser una dirección IPv4 entre 224.0.0.0 y 239.255.255.255'
+                }
+            updates['multicast_group'] = multicast_group
+        
+        if multicast_ttl is not None:
+            multicast_ttl = int(multicast_ttl)
+            if not 1 <= multicast_ttl <= 32:
+                return {
+                    'success': False,
+                    'message': 'El TTL multicast debe estar entre 1 y 32'
+                }
+            updates['multicast_ttl'] = multicast_ttl
+        
+        if replication_factor is not None:
+            replication_factor = int(replication_factor)
+            if not 1 <= replication_factor <= 5:
+                return {
+                    'success': False,
+                    'message': 'El factor de replicación debe estar entre 1 y 5'
+                }
+            updates['replication_factor'] = replication_factor
+        
+        # Mantener max >= intervalo si solo se subió el intervalo
+        interval = updates.get('broadcast_interval', self.server_config['broadcast_interval'])
+        if updates.get('broadcast_max_interval', self.server_config['broadcast_max_interval']) < interval:
+            updates['broadcast_max_interval'] = interval
+        
+        if updates:
+            self.server_config.update(updates)
+            for key, value in updates.items():
+                print(f"[Config] {key} actualizado a {value}")
+            self._discovery_reset.set()
         
         return {
             'success': True,
@@ -759,6 +1981,38 @@ class ClientManager:
             'message': 'Configuración actualizada correctamente'
         }
     
+    # ==================== RECUPERACIÓN EN FRÍO ====================
+    
+    def _note_client_recovered(self, is_reregister):
+        """Cuenta un cliente existente que volvió a registrarse tras el arranque."""
+        if is_reregister:
+            self._recovery['recovered_clients'] += 1
+            self._recovery['last_recovered_at'] = datetime.now()
+    
+    def is_recovering(self):
+        """
+        True mientras la flota se re-sincroniza tras el arranque: al menos durante
+        la ventana de jitter y hasta RECOVERY_SETTLE_SECONDS sin nuevos re-registros.
+        """
+        now = datetime.now()
+        started_at = self._recovery['started_at']
+        last = self._recovery['last_recovered_at'] or started_at
+        if (now - started_at).total_seconds() < self.RECOVERY_RESYNC_WINDOW:
+            return True
+        return (now - last).total_seconds() < self.RECOVERY_SETTLE_SECONDS
+    
+    def get_recovery_status(self):
+        """Progreso de la recuperación de estado tras el arranque (para /api/health)."""
+        last = self._recovery['last_recovered_at']
+        return {
+            'epoch': self.recovery_epoch,
+            'started_at': self._recovery['started_at'].isoformat(),
+            'in_progress': self.is_recovering(),
+            'recovered_clients': self._recovery['recovered_clients'],
+            'last_recovered_at': last.isoformat() if last else None,
+            'resync_window': self.RECOVERY_RESYNC_WINDOW
+        }
+    
     # ==================== UTILITIES ====================
     
     def get_stats(self):
@@ -911,32 +2165,24 @@ class ClientManager:
     
     def start_broadcast(self, host_ip_override=None, stop_check=None):
         """
-        Inicia un thread de broadcast UDP para anunciar la presencia del servidor.
+        Inicia un thread de anuncios UDP para anunciar la presencia del servidor.
         Los clientes escuchan en el puerto 5001 y se registran automáticamente.
         
+        Según server_config['discovery_mode'] anuncia por broadcast de subred, por
+        un grupo multicast (atraviesa segmentos ruteados según multicast_ttl) o ambos.
+        El envío es adaptativo: una ráfaga al iniciar, al reanudar o al cambiar la IP
+        local o la config, y después el intervalo se duplica desde broadcast_interval
+        hasta broadcast_max_interval.
+        
         Args:
             host_ip_override: IP explícita (ej: Docker HOST_IP). Si None, se auto-detecta.
             stop_check: Callable que retorna True cuando se debe detener el broadcast.
                          Si None, corre indefinidamente.
         """
         def broadcast_thread():
-            DISCOVERY_PORT = 5001
+            DISCOVERY_PORT = self.DISCOVERY_PORT
             
             try:
-                local_ip = host_ip_override or self.get_local_ip()
-                if local_ip == "127.0.0.1" or not local_ip:
-                    print(f"[Broadcast] IP no valida para broadcast: {local_ip}")
-                    return
-                
-                server_url = f"http://{local_ip}:{self.server_port}"
-                server_info_data = {
-                    'url': server_url,
-                    'ip': local_ip,
-                    'port': self.server_port
-                }
-                
-                broadcast_addr = self.get_broadcast_address(local_ip)
-                
                 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
                 try:
@@ -944,17 +2190,15 @@ class ClientManager:
                 except Exception as bind_error:
                     print(f"[Broadcast] Advertencia al hacer bind: {bind_error}")
                 
-                config = self.get_server_config()
-                print(f"[Broadcast] Iniciando anuncios en {local_ip}:{self.server_port}")
-                print(f"[Broadcast] Direccion de broadcast: {broadcast_addr}:{DISCOVERY_PORT}")
-                print(f"[Broadcast] Intervalo: {config['broadcast_interval']}s")
-                
-                broadcast_targets = [broadcast_addr]
-                if broadcast_addr != "255.255.255.255":
-                    broadcast_targets.append("255.255.255.255")
+                local_ip = None
+                packet = None
+                broadcast_targets = []
+                multicast_target = None
+                interval = 1
+                burst_remaining = 0
                 
-                last_client_count = 0
                 broadcasts_paused = False
+                last_client_count = 0
                 last_error_logged = 0
                 
                 should_run = lambda: (stop_check is None or not stop_check())
@@ -962,59 +2206,122 @@ class ClientManager:
                 while should_run():
                     try:
                         config = self.get_server_config()
-                        num_clients = len(self.clients_db)
+                        current_ip = host_ip_override or self.get_local_ip()
                         
-                        if num_clients > 0:
+                        # Cambio de red o de config: recalcular paquete/destinos y hacer ráfaga
+                        if current_ip != local_ip or self._discovery_reset.is_set():
+                            self._discovery_reset.clear()
+                            local_ip = current_ip
+                            if local_ip == "127.0.0.1" or not local_ip:
+                                print(f"[Broadcast] IP no valida para broadcast: {local_ip}")
+                                packet = None
+                            else:
+                                # El paquete se arma una sola vez por red/config
+                                packet = json.dumps({
+                                    'url': f"http://{local_ip}:{self.server_port}",
+                                    'ip': local_ip,
+                                    'port': self.server_port,
+                                    'epoch': self.recovery_epoch,
+                                    'resync_window': self.RECOVERY_RESYNC_WINDOW
+                                }).encode('utf-8')
+                                
+                                mode = config.get('discovery_mode', 'broadcast')
+                                broadcast_targets = []
+                                multicast_target = None
+                                if mode in ('broadcast', 'both'):
+                                    broadcast_addr = self.get_broadcast_address(local_ip)
+                                    broadcast_targets = [broadcast_addr]
+                                    if broadcast_addr != "255.255.255.255":
+                                        broadcast_targets.append("255.255.255.255")
+                                if mode in ('multicast', 'both'):
+                                    multicast_target = config.get('multicast_group', self.DEFAULT_MULTICAST_GROUP)
+                                    try:
+                                        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                                        int(config.get('multicast_ttl', 1)))
+                                        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                                        socket.inet_aton(local_ip))
+                                    except OSError as e:
+                                        print(f"[Broadcast] No se pudo configurar multicast: {e}")
+                                
+                                print(f"[Broadcast] Anunciando {local_ip}:{self.server_port} (modo: {mode})")
+                                if broadcast_targets:
+                                    print(f"[Broadcast] Direccion de broadcast: {broadcast_targets[0]}:{DISCOVERY_PORT}")
+                                if multicast_target:
+                                    print(f"[Broadcast] Grupo multicast: {multicast_target}:{DISCOVERY_PORT} (TTL {config.get('multicast_ttl', 1)})")
+                            
+                            interval = config['broadcast_interval']
+                            burst_remaining = self.DISCOVERY_BURST_COUNT
+                        
+                        if packet is None:
+                            self._discovery_reset.wait(config['broadcast_interval'])
+                            continue
+                        
+                        # Solo el líder anuncia (evita anuncios duplicados en la malla) y
+                        # solo si no hay clientes. Durante la recuperación anuncian todos,
+                        # aunque ya haya clientes, para que toda la flota vea la nueva época
+                        if not self.is_leader() and not self.is_recovering():
+                            if not broadcasts_paused:
+                                print(f"[Broadcast] Líder: {self.get_leader()}. Anuncios pausados en este servidor.")
+                                broadcasts_paused = True
+                            self._discovery_reset.wait(config['broadcast_interval'])
+                            continue
+                        
+                        num_clients = len(self.clients_db)
+                        if num_clients > 0 and not self.is_recovering():
                             if not broadcasts_paused:
                                 print(f"[Broadcast] {num_clients} cliente(s) conectado(s). Broadcasts pausados.")
                                 broadcasts_paused = True
                             elif num_clients != last_client_count:
                                 print(f"[Broadcast] {num_clients} cliente(s) conectado(s).")
                             last_client_count = num_clients
-                            time.sleep(config['broadcast_interval'])
+                            self._discovery_reset.wait(config['broadcast_interval'])
                             continue
-                        else:
-                            if broadcasts_paused:
-                                print(f"[Broadcast] Sin clientes. Reanudando broadcasts UDP.")
-                                broadcasts_paused = False
-                            last_client_count = 0
+                        elif broadcasts_paused:
+                            print(f"[Broadcast] Sin clientes. Reanudando broadcasts UDP.")
+                            broadcasts_paused = False
+                            interval = config['broadcast_interval']
+                            burst_remaining = self.DISCOVERY_BURST_COUNT
+                        last_client_count = 0
                         
-                        message = json.dumps(server_info_data).encode('utf-8')
                         sent = False
+                        send_error = None
                         for target_addr in broadcast_targets:
                             try:
-                                sock.sendto(message, (target_addr, DISCOVERY_PORT))
+                                sock.sendto(packet, (target_addr, DISCOVERY_PORT))
+                                self.metrics.broadcast_packets.inc('broadcast')
                                 sent = True
                                 break
-                            except OSError:
-                                continue
+                            except OSError as e:
+                                send_error = e
+                        if multicast_target:
+                            try:
+                                sock.sendto(packet, (multicast_target, DISCOVERY_PORT))
+                                self.metrics.broadcast_packets.inc('multicast')
+                                sent = True
+                            except OSError as e:
+                                send_error = e
                         
                         if sent:
                             last_error_logged = 0
                         else:
-                            try:
-                                sock.close()
-                            except Exception:
-                                pass
-                            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-                            sock.bind(('', 0))
-                            try:
-                                sock.sendto(message, ('255.255.255.255', DISCOVERY_PORT))
-                                last_error_logged = 0
-                            except OSError as e:
-                                now = time.time()
-                                if now - last_error_logged > 30:
-                                    print(f"[Broadcast] No se pudo enviar broadcast: {e}")
-                                    last_error_logged = now
+                            now = time.time()
+                            if now - last_error_logged > 30:
+                                print(f"[Broadcast] No se pudo enviar anuncio: {send_error}")
+                                last_error_logged = now
                         
-                        time.sleep(config['broadcast_interval'])
+                        if burst_remaining > 0:
+                            burst_remaining -= 1
+                            delay = self.DISCOVERY_BURST_INTERVAL
+                        else:
+                            delay = interval
+                            interval = min(interval * 2, config.get('broadcast_max_interval', interval))
+                        self._discovery_reset.wait(delay)
                     except Exception as e:
                         now = time.time()
                         if now - last_error_logged > 30:
                             print(f"[Broadcast] Error: {e}")
                             last_error_logged = now
-                        time.sleep(config.get('broadcast_interval', 1))
+                        time.sleep(self.server_config.get('broadcast_interval', 1))
             except Exception as e:
                 print(f"[Broadcast] Error en thread de broadcast: {e}")
                 import traceback
@@ -1024,6 +2331,100 @@ class ClientManager:
         thread.start()
         return thread
     
+    def build_discovery_offer(self, local_ip):
+        """
+        Construye la respuesta a un probe de descubrimiento: URL del servidor,
+        carga actual (clientes registrados) y versión del protocolo.
+        """
+        return {
+            'type': 'offer',
+            'url': f"http://{local_ip}:{self.server_port}",
+            'ip': local_ip,
+            'port': self.server_port,
+            'load': len(self.clients_db),
+            'active_sessions': len(self.client_sessions),
+            'version': self.DISCOVERY_PROTOCOL_VERSION,
+            'epoch': self.recovery_epoch,
+            'resync_window': self.RECOVERY_RESYNC_WINDOW
+        }
+    
+    def start_discovery_responder(self, host_ip_override=None, stop_check=None):
+        """
+        Inicia un thread que responde probes de descubrimiento UDP.
+        Un cliente recién iniciado envía {"type": "discover"} por broadcast al
+        puerto DISCOVERY_QUERY_PORT y cada servidor le responde por unicast,
+        así no depende de que el servidor esté emitiendo broadcasts.
+        
+        Args:
+            host_ip_override: IP explícita a anunciar (ej: Docker HOST_IP).
+            stop_check: Callable que retorna True cuando se debe detener.
+        """
+        def responder_thread():
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                except Exception:
+                    pass
+                sock.bind(('', self.DISCOVERY_QUERY_PORT))
+                sock.settimeout(1.0)
+                print(f"[Discovery] Respondiendo probes en UDP {self.DISCOVERY_QUERY_PORT}")
+                # Aceptar también probes enviados al grupo multicast (redes ruteadas)
+                group = self.server_config.get('multicast_group', self.DEFAULT_MULTICAST_GROUP)
+                try:
+                    membership = socket.inet_aton(group) + socket.inet_aton('0.0.0.0')
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+                except OSError as e:
+                    print(f"[Discovery] No se pudo unir al grupo multicast {group}: {e}")
+            except Exception as e:
+                print(f"[Discovery] No se pudo iniciar el responder de probes: {e}")
+                return
+            
+            should_run = lambda: (stop_check is None or not stop_check())
+            last_error_logged = 0
+            
+            while should_run():
+                try:
+                    data, addr = sock.recvfrom(1024)
+                except socket.timeout:
+                    continue
+                except Exception as e:
+                    now = time.time()
+                    if now - last_error_logged > 30:
+                        print(f"[Discovery] Error recibiendo probe: {e}")
+                        last_error_logged = now
+                    continue
+                
+                try:
+                    probe = json.loads(data.decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    continue
+                if not isinstance(probe, dict) or probe.get('type') != 'discover':
+                    continue
+                
+                local_ip = host_ip_override or self.get_local_ip()
+                if not local_ip or local_ip == "127.0.0.1":
+                    continue
+                
+                try:
+                    offer = json.dumps(self.build_discovery_offer(local_ip)).encode('utf-8')
+                    sock.sendto(offer, addr)
+                    self.metrics.discovery_offers.inc()
+                except OSError as e:
+                    now = time.time()
+                    if now - last_error_logged > 30:
+                        print(f"[Discovery] No se pudo responder probe de {addr[0]}: {e}")
+                        last_error_logged = now
+            
+            try:
+                sock.close()
+            except Exception:
+                pass
+        
+        thread = threading.Thread(target=responder_thread, daemon=True)
+        thread.start()
+        return thread
+    
     # ==================== SERIALIZATION ====================
     
     def to_json(self):
@@ -1033,7 +2434,9 @@ class ClientManager:
             'client_sessions': self.client_sessions,
             'client_configs': self.client_configs,
             'servers_db': self.servers_db,
-            'server_config': self.server_config
+            'server_config': self.server_config,
+            'client_history': self.client_history,
+            'client_commands': self.client_commands
         })
     
     def from_json(self, json_str):
@@ -1043,4 +2446,10 @@ class ClientManager:
         self.client_sessions = data.get('client_sessions', {})
         self.client_configs = data.get('client_configs', {})
         self.servers_db = data.get('servers_db', {})
-        self.server_config = data.get('server_config', {'broadcast_interval': 1})
+        # Un estado guardado por una versión anterior puede no tener todas las claves
+        self.server_config = self._default_server_config()
+        self.server_config.update(data.get('server_config') or {})
+        self.client_history = data.get('client_history', {})
+        self.client_commands = data.get('client_commands', {})
+        for client_id in list(self.client_sessions):
+            self._schedule_expiry(client_id)
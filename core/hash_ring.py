@@ -0,0 +1,79 @@
+"""
+CiberMonday - Anillo de hashing consistente
+Asigna cada client_id a R servidores "dueños". Al agregar o quitar un servidor
+solo cambia de dueño ~1/N de los clientes.
+"""
+
+import bisect
+import hashlib
+
+
+class HashRing:
+    """
+    Anillo de hashing consistente con nodos virtuales.
+
+    Cada servidor ocupa VNODES posiciones en el anillo para repartir la carga de
+    forma pareja. Los dueños de una clave son los primeros servidores distintos
+    que se encuentran recorriendo el anillo en sentido horario desde su hash.
+    """
+
+    VNODES = 160
+
+    def __init__(self, nodes=None, vnodes=None):
+        self.vnodes = vnodes or self.VNODES
+        self._nodes = set()
+        self._ring = []    # posiciones ordenadas
+        self._owners = {}  # posición -> nodo
+        for node in nodes or []:
+            self.add(node)
+
+    @staticmethod
+    def _hash(value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    @property
+    def nodes(self):
+        return set(self._nodes)
+
+    def add(self, node):
+        """Agrega un servidor al anillo."""
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self.vnodes):
+            position = self._hash(f"{node}#{i}")
+            bisect.insort(self._ring, position)
+            self._owners[position] = node
+
+    def remove(self, node):
+        """Quita un servidor del anillo."""
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        for i in range(self.vnodes):
+            position = self._hash(f"{node}#{i}")
+            index = bisect.bisect_left(self._ring, position)
+            if index < len(self._ring) and self._ring[index] == position:
+                del self._ring[index]
+            self._owners.pop(position, None)
+
+    def owners(self, key, count=1):
+        """
+        Servidores dueños de la clave, en orden de preferencia.
+
+        Args:
+            key: Clave a ubicar (ej: client_id)
+            count: Factor de replicación R (se acota a la cantidad de servidores)
+        """
+        if not self._ring:
+            return []
+        count = min(count, len(self._nodes))
+        result = []
+        index = bisect.bisect(self._ring, self._hash(key))
+        for step in range(len(self._ring)):
+            node = self._owners[self._ring[(index + step) % len(self._ring)]]
+            if node not in result:
+                result.append(node)
+                if len(result) == count:
+                    break
+        return result
@@ -0,0 +1,289 @@
+"""
+CiberMonday - Métricas estilo Prometheus
+Contadores, gauges e histogramas en memoria, expuestos en formato de texto de
+Prometheus (GET /api/metrics en el servidor Flask y en el de Android).
+
+Registrar un valor es un incremento bajo un lock; los gauges que dependen del
+estado (clientes activos, servidores vivos) se calculan recién al leer las
+métricas. Así el costo se puede dejar siempre activo en producción.
+"""
+
+import re
+import threading
+import time
+from datetime import datetime
+
+# Content-Type del formato de texto de Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Límites de los buckets de latencia HTTP (segundos)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_CLIENT_ROUTE = re.compile(r'^/api/client/[^/]+')
+
+
+def route_label(path):
+    """Ruta con el client_id reemplazado, igual que la regla de Flask."""
+    return _CLIENT_ROUTE.sub('/api/client/<client_id>', path)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base: una familia de series identificadas por los valores de sus labels."""
+
+    type = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # tupla de valores de labels -> valor
+
+    def remove(self, *labelvalues):
+        """Elimina una serie (ej: el cliente fue borrado)."""
+        with self._lock:
+            self._values.pop(tuple(map(str, labelvalues)), None)
+
+    def _samples(self):
+        """(sufijo, labelnames, labelvalues, valor) de cada serie."""
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield '', self.labelnames, labelvalues, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, names, values, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Valor que solo crece."""
+
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        key = tuple(map(str, labelvalues))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labelvalues):
+        return self._values.get(tuple(map(str, labelvalues)), 0)
+
+
+class Gauge(Metric):
+    """
+    Valor que sube y baja. Con callback, se calcula al leer las métricas:
+    el callback devuelve un número (sin labels) o {tupla de labels: valor}.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[tuple(map(str, labelvalues))] = value
+
+    def _samples(self):
+        if self.callback is None:
+            yield from super()._samples()
+            return
+        result = self.callback()
+        if not isinstance(result, dict):
+            result = {(): result}
+        for labelvalues, value in result.items():
+            yield '', self.labelnames, tuple(map(str, labelvalues)), value
+
+
+class Histogram(Metric):
+    """Distribución en buckets acumulativos (_bucket, _sum, _count)."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        key = tuple(map(str, labelvalues))
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Conteo por bucket (no acumulativo), suma y total
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        names = self.labelnames + ('le',)
+        for labelvalues, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', names, labelvalues + (_format_value(float(bound)),), cumulative
+            yield '_bucket', names, labelvalues + ('+Inf',), count
+            yield '_sum', self.labelnames, labelvalues, total
+            yield '_count', self.labelnames, labelvalues, count
+
+
+class MetricsRegistry:
+    """Conjunto de métricas de un proceso, en el orden en que se registraron."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), callback=None):
+        return self._add(Gauge(name, help_text, labelnames, callback))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        """Todas las métricas en formato de texto de Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Un gauge calculado que falla no debe tirar el resto
+                lines.append(f"# {metric.name} no disponible: {_escape(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+class ServerMetrics:
+    """
+    Métricas de un servidor CiberMonday. ClientManager registra los eventos
+    (push, sincronizaciones, reportes, anuncios) y la capa HTTP registra cada
+    request; el estado de clientes y servidores se lee del manager al exportar.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.started_at = time.time()
+        self.registry = registry = MetricsRegistry()
+
+        self.http_requests = registry.counter(
+            'cibermonday_http_requests_total', 'Requests HTTP atendidos',
+            ('method', 'route', 'status'))
+        self.http_latency = registry.histogram(
+            'cibermonday_http_request_duration_seconds', 'Duración de los requests HTTP',
+            ('method', 'route'))
+
+        self.push_attempts = registry.counter(
+            'cibermonday_push_attempts_total', 'Push HTTP intentados a clientes', ('type',))
+        self.push_success = registry.counter(
+            'cibermonday_push_success_total', 'Push confirmados por el cliente (HTTP 200)', ('type',))
+        self.push_failures = registry.counter(
+            'cibermonday_push_failures_total', 'Push fallidos (el comando queda en la cola)', ('type',))
+        self.push_retries = registry.counter(
+            'cibermonday_push_retries_total',
+            'Comandos reenviados en /status por no estar confirmados (sin la primera entrega)',
+            ('type',))
+
+        self.client_syncs = registry.counter(
+            'cibermonday_client_syncs_total', 'Consultas de estado (/status) por cliente', ('client',))
+        self.client_reports = registry.counter(
+            'cibermonday_client_reports_total', 'Reportes de sesión y batches por cliente', ('client',))
+
+        self.telemetry_samples = registry.counter(
+            'cibermonday_telemetry_samples_total', 'Muestras de telemetría recibidas de los clientes')
+
+        self.broadcast_packets = registry.counter(
+            'cibermonday_broadcast_packets_total', 'Anuncios UDP enviados', ('target',))
+        self.discovery_offers = registry.counter(
+            'cibermonday_discovery_offers_total', 'Respuestas a probes de descubrimiento')
+
+        registry.gauge('cibermonday_clients', 'Clientes registrados por estado', ('state',),
+                       callback=self._client_states)
+        registry.gauge('cibermonday_servers_known', 'Servidores en servers_db',
+                       callback=lambda: len(manager.servers_db))
+        registry.gauge('cibermonday_peer_up', 'Peer con contacto dentro del lease de líder (1/0)',
+                       ('peer',), callback=self._peer_health)
+        registry.gauge('cibermonday_replication_lag', 'Entradas del log pendientes de enviar a cada peer',
+                       ('peer',), callback=self._replication_lag)
+        registry.gauge('cibermonday_is_leader', 'Este servidor es el líder de la malla (1/0)',
+                       callback=lambda: int(manager.get_leader() == manager.local_server_url))
+        registry.gauge('cibermonday_uptime_seconds', 'Segundos desde que arrancó el servidor',
+                       callback=lambda: round(time.time() - self.started_at, 3))
+
+    # ==================== EVENTOS ====================
+
+    def observe_request(self, method, route, status, seconds):
+        self.http_requests.inc(method, route, status)
+        self.http_latency.observe(seconds, method, route)
+
+    def forget_client(self, client_id):
+        """Quita las series del cliente borrado (evita crecer sin límite)."""
+        self.client_syncs.remove(client_id)
+        self.client_reports.remove(client_id)
+
+    # ==================== GAUGES CALCULADOS ====================
+
+    def _client_states(self):
+        manager = self.manager
+        now = datetime.now()
+        active = expired = offline = 0
+        for client_id in list(manager.clients_db):
+            session = manager.client_sessions.get(client_id)
+            if session:
+                try:
+                    if datetime.fromisoformat(session['end_time']) > now:
+                        active += 1
+                    else:
+                        expired += 1
+                except (KeyError, TypeError, ValueError):
+                    pass
+            if not manager._is_client_connected(client_id):
+                offline += 1
+        return {('registered',): len(manager.clients_db), ('active',): active,
+                ('expired',): expired, ('offline',): offline}
+
+    def _peer_health(self):
+        manager = self.manager
+        me = manager.local_server_url
+        live = manager._live_peers()
+        return {(server['url'],): int(server['url'] in live)
+                for server in list(manager.servers_db.values())
+                if server.get('url') and server['url'] != me}
+
+    def _replication_lag(self):
+        peers = self.manager.get_replication_status()['peers']
+        return {(url,): peer['lag'] for url, peer in peers.items()}
+
+    def render(self):
+        return self.registry.render()
@@ -0,0 +1,295 @@
+"""
+CiberMonday - Perfilado bajo demanda del servidor
+Herramientas para ver en qué gasta tiempo y memoria el proceso sin reiniciarlo:
+
+- Muestreo: un thread toma las pilas de todos los threads cada pocos ms durante
+  N segundos y las acumula en formato "folded" (una línea `a;b;c cantidad` por
+  pila), el que leen flamegraph.pl, speedscope e inferno.
+- Por request: cProfile alrededor de un único request marcado con el header
+  X-CiberMonday-Profile o el parámetro ?profile=1.
+- Memoria: snapshots de tracemalloc y la diferencia contra el anterior.
+
+Todo está apagado salvo CIBERMONDAY_PROFILING=1. Apagado, el único costo por
+request es leer `profiler.enabled`; tracemalloc se activa recién con el primer
+snapshot porque encarece cada asignación mientras está activo.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+PROFILING_ENV = 'CIBERMONDAY_PROFILING'
+
+# Header / parámetro que piden cProfile para un request
+REQUEST_PROFILE_HEADER = 'X-CiberMonday-Profile'
+REQUEST_PROFILE_PARAM = 'profile'
+# Header de la respuesta con el id del perfil guardado
+PROFILE_ID_HEADER = 'X-CiberMonday-Profile-Id'
+
+FOLDED_CONTENT_TYPE = 'text/plain; charset=utf-8'
+
+DEFAULT_SAMPLE_SECONDS = 10
+MAX_SAMPLE_SECONDS = 300
+DEFAULT_SAMPLE_INTERVAL_MS = 5
+
+# Perfiles por request que se conservan (los más recientes)
+MAX_REQUEST_PROFILES = 20
+# Funciones por perfil de request (ordenadas por tiempo acumulado)
+REQUEST_PROFILE_LINES = 30
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    # ';' separa los frames en el formato folded
+    name = code.co_name.replace(';', ':')
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Muestreo de pilas de todos los threads en un thread aparte."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.finished_at = None
+        self.seconds = 0
+        self.interval = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=DEFAULT_SAMPLE_SECONDS, interval_ms=DEFAULT_SAMPLE_INTERVAL_MS):
+        """Arranca un muestreo de `seconds` segundos. Descarta el resultado anterior."""
+        try:
+            seconds = max(0.1, min(float(seconds), MAX_SAMPLE_SECONDS))
+            interval = max(0.001, float(interval_ms) / 1000)
+        except (TypeError, ValueError):
+            return {'success': False, 'message': 'seconds e interval_ms deben ser números'}
+        with self._lock:
+            if self.running:
+                return {'success': False, 'message': 'Ya hay un muestreo en curso'}
+            self.seconds = seconds
+            self.interval = interval
+            self.stacks = Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self.finished_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='cibermonday-profiler',
+                                            daemon=True)
+            self._thread.start()
+        print(f"[Profiling] Muestreo iniciado: {self.seconds:g}s cada {self.interval * 1000:g}ms")
+        return {'success': True, 'message': 'Muestreo iniciado', 'status': self.status()}
+
+    def stop(self):
+        """Corta el muestreo en curso (si hay) y espera a que termine."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self):
+        me = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f'thread-{ident}').replace(';', ':'))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+        self.finished_at = time.time()
+        print(f"[Profiling] Muestreo terminado: {self.samples} muestras, "
+              f"{len(self.stacks)} pilas distintas")
+
+    def folded(self):
+        """Resultado en formato folded (una pila por línea, la más frecuente primero)."""
+        stacks = self.stacks.copy()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def status(self):
+        return {
+            'running': self.running,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'seconds': self.seconds,
+            'interval_ms': self.interval * 1000,
+            'samples': self.samples,
+            'stacks': len(self.stacks)
+        }
+
+
+class MemoryTracker:
+    """Snapshots de tracemalloc y la diferencia entre el último y el anterior."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last = None
+        self.snapshots = 0
+
+    @staticmethod
+    def _snapshot():
+        # Sin los frames de tracemalloc mismo ni del import system
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+
+    @staticmethod
+    def _stat(stat, diff=False):
+        frame = stat.traceback[0]
+        entry = {'location': f"{frame.filename}:{frame.lineno}",
+                 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+        if diff:
+            entry['size_diff_kb'] = round(stat.size_diff / 1024, 1)
+            entry['count_diff'] = stat.count_diff
+        return entry
+
+    def snapshot(self, limit=20, frames=1):
+        """
+        Toma un snapshot. La primera vez activa tracemalloc (no hay diferencia
+        todavía); las siguientes devuelven también el crecimiento desde el anterior.
+        """
+        try:
+            limit = max(1, int(limit))
+        except (TypeError, ValueError):
+            return {'success': False, 'message': 'limit debe ser un número'}
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(max(1, int(frames)))
+                self._last = None
+                print("[Profiling] tracemalloc activado")
+            current = self._snapshot()
+            previous, self._last = self._last, current
+            self.snapshots += 1
+        size, peak = tracemalloc.get_traced_memory()
+        result = {
+            'success': True,
+            'traced_kb': round(size / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'top': [self._stat(s) for s in current.statistics('lineno')[:limit]],
+            'diff': None
+        }
+        if previous is not None:
+            result['diff'] = [self._stat(s, diff=True)
+                              for s in current.compare_to(previous, 'lineno')[:limit]]
+        else:
+            result['message'] = 'tracemalloc activado; el próximo snapshot incluye la diferencia'
+        return result
+
+    def stop(self):
+        """Apaga tracemalloc y descarta el snapshot guardado."""
+        with self._lock:
+            was_tracing = tracemalloc.is_tracing()
+            tracemalloc.stop()
+            self._last = None
+        if was_tracing:
+            print("[Profiling] tracemalloc desactivado")
+        return {'success': True, 'message': 'tracemalloc desactivado' if was_tracing
+                else 'tracemalloc no estaba activo'}
+
+    def status(self):
+        return {'tracing': tracemalloc.is_tracing(), 'snapshots': self.snapshots}
+
+
+class Profiler:
+    """
+    Punto de entrada de la capa HTTP (Flask y Android): muestreo, cProfile por
+    request y memoria. Con enabled=False las rutas responden error y los
+    requests no se inspeccionan.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.sampler = SamplingProfiler()
+        self.memory = MemoryTracker()
+        self.request_profiles = deque(maxlen=MAX_REQUEST_PROFILES)
+        self._request_seq = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        enabled = os.getenv(PROFILING_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+        if enabled:
+            print(f"[Profiling] Habilitado ({PROFILING_ENV}); rutas en /api/profile")
+        return cls(enabled=enabled)
+
+    def disabled_result(self):
+        return {'success': False,
+                'message': f'Perfilado deshabilitado (iniciar con {PROFILING_ENV}=1)'}
+
+    def status(self):
+        return {
+            'success': True,
+            'enabled': self.enabled,
+            'sampler': self.sampler.status(),
+            'memory': self.memory.status(),
+            'request_profiles': len(self.request_profiles)
+        }
+
+    # ==================== CPROFILE POR REQUEST ====================
+
+    def wants_request_profile(self, headers, query):
+        """True si el request pide cProfile (header o ?profile=1) y el perfilado está activo."""
+        if not self.enabled:
+            return False
+        flag = headers.get(REQUEST_PROFILE_HEADER) or query.get(REQUEST_PROFILE_PARAM)
+        if isinstance(flag, list):
+            flag = flag[0] if flag else None
+        return bool(flag) and str(flag).lower() not in ('0', 'false', 'no')
+
+    def begin_request(self):
+        """Activa cProfile en el thread actual. Retorna el perfil (None si no se pudo)."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Otro perfilador ya activo en este thread
+            print(f"[Profiling] No se pudo perfilar el request: {e}")
+            return None
+        return (profile, time.perf_counter())
+
+    def end_request(self, token, method, path, status):
+        """Detiene cProfile y guarda el resumen. Retorna el id del perfil."""
+        profile, started = token
+        profile.disable()
+        duration = time.perf_counter() - started
+        out = io.StringIO()
+        stats = pstats.Stats(profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(REQUEST_PROFILE_LINES)
+        with self._lock:
+            self._request_seq += 1
+            profile_id = self._request_seq
+            self.request_profiles.append({
+                'id': profile_id,
+                'time': time.time(),
+                'method': method,
+                'path': path,
+                'status': status,
+                'duration_ms': round(duration * 1000, 3),
+                'calls': stats.total_calls,
+                'stats': out.getvalue()
+            })
+        return profile_id
+
+    def get_request_profiles(self):
+        with self._lock:
+            return list(reversed(self.request_profiles))
@@ -0,0 +1,248 @@
+"""
+CiberMonday - Telemetría de la flota
+Los clientes mandan, en el header X-CiberMonday-Telemetry del /status de cada
+sync, un JSON compacto con la salud de su sincronización: latencia por
+servidor, fallas, estado de cada servidor, atraso del loop de sync, memoria del
+proceso y offset de reloj. Acá se guardan las últimas muestras de cada cliente
+(buffer circular, acotado también en cantidad de clientes) y se arma la vista
+de /api/fleet-health con los clientes que se salen de la norma.
+
+Formato de una muestra (claves cortas: viaja en un header en cada sync):
+    {"v": 1, "seq": 12, "lag_ms": 3, "rss_kb": 41200, "fail": 0, "failovers": 1,
+     "home": "http://192.168.1.10:5000",
+     "srv": {"http://192.168.1.10:5000": {"ms": 12, "sync_ms": 40, "ok": 1,
+                                          "to": 0, "off_ms": -3.5, "fails": 0}}}
+"""
+
+import collections
+import json
+import statistics
+import threading
+import time
+
+TELEMETRY_HEADER = 'X-CiberMonday-Telemetry'
+
+# Tamaño máximo aceptado de una muestra (bytes del header)
+MAX_TELEMETRY_BYTES = 4096
+# Muestras por cliente y clientes como máximo
+SAMPLES_PER_CLIENT = 30
+MAX_CLIENTS = 2000
+# Servidores por muestra que se guardan
+MAX_SERVERS_PER_SAMPLE = 16
+
+# Umbrales absolutos: por debajo nunca es outlier aunque la flota sea muy pareja
+LATENCY_FLOOR_MS = 250
+LOOP_LAG_FLOOR_MS = 1000
+CLOCK_SKEW_MS = 2000
+# Memoria: además de atípica, al menos esta proporción sobre la mediana de la flota
+RSS_MIN_RATIO = 1.5
+# Sin telemetría en este tiempo = cliente silencioso
+STALE_SECONDS = 300
+# Modified z-score (mediana/MAD) a partir del cual un valor es atípico
+OUTLIER_Z = 3.5
+
+
+def _number(value):
+    """Número finito o None (las muestras vienen de la red)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if value != value or value in (float('inf'), float('-inf')):
+        return None
+    return value
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _robust_threshold(values):
+    """Límite superior mediana + OUTLIER_Z * MAD escalado (None con menos de 3 valores)."""
+    if len(values) < 3:
+        return None
+    median = statistics.median(values)
+    mad = statistics.median(abs(v - median) for v in values)
+    if mad == 0:
+        return None
+    return median + OUTLIER_Z * 1.4826 * mad
+
+
+class FleetTelemetry:
+    """Últimas muestras de telemetría de cada cliente y la vista de salud de la flota."""
+
+    def __init__(self, samples_per_client=SAMPLES_PER_CLIENT, max_clients=MAX_CLIENTS):
+        self.samples_per_client = samples_per_client
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        # client_id -> deque de muestras; OrderedDict para descartar el menos reciente
+        self._samples = collections.OrderedDict()
+        self.rejected = 0
+
+    # ==================== INGESTA ====================
+
+    def parse(self, raw):
+        """Muestra normalizada desde el header (str/bytes JSON) o un dict. None si es inválida."""
+        if isinstance(raw, (str, bytes)):
+            if len(raw) > MAX_TELEMETRY_BYTES:
+                return None
+            try:
+                raw = json.loads(raw)
+            except ValueError:
+                return None
+        if not isinstance(raw, dict):
+            return None
+
+        servers = {}
+        srv = raw.get('srv')
+        for url, info in list(srv.items() if isinstance(srv, dict) else ())[:MAX_SERVERS_PER_SAMPLE]:
+            if not isinstance(url, str) or not isinstance(info, dict):
+                continue
+            servers[url[:200]] = {key: _number(info.get(key))
+                                  for key in ('ms', 'sync_ms', 'ok', 'to', 'off_ms', 'fails')}
+        home = raw.get('home')
+        return {
+            'received_at': time.time(),
+            'seq': _number(raw.get('seq')),
+            'lag_ms': _number(raw.get('lag_ms')),
+            'rss_kb': _number(raw.get('rss_kb')),
+            'fail': _number(raw.get('fail')),
+            'failovers': _number(raw.get('failovers')),
+            'home': home[:200] if isinstance(home, str) else None,
+            'servers': servers
+        }
+
+    def ingest(self, client_id, raw):
+        """Agrega una muestra del cliente. Retorna True si se aceptó."""
+        sample = self.parse(raw)
+        with self._lock:
+            if sample is None:
+                self.rejected += 1
+                return False
+            samples = self._samples.get(client_id)
+            if samples is None:
+                samples = self._samples[client_id] = collections.deque(
+                    maxlen=self.samples_per_client)
+                while len(self._samples) > self.max_clients:
+                    self._samples.popitem(last=False)
+            else:
+                self._samples.move_to_end(client_id)
+            samples.append(sample)
+        return True
+
+    def forget(self, client_id):
+        with self._lock:
+            self._samples.pop(client_id, None)
+
+    def samples(self, client_id):
+        """Muestras guardadas del cliente, la más vieja primero."""
+        with self._lock:
+            return list(self._samples.get(client_id, ()))
+
+    # ==================== VISTA DE LA FLOTA ====================
+
+    @staticmethod
+    def _summarize(samples):
+        """Valores de un cliente: la última muestra más tendencias de la ventana."""
+        last = samples[-1]
+        servers = last['servers']
+        latencies = [s['sync_ms'] if s['sync_ms'] is not None else s['ms']
+                     for s in servers.values() if s['ok']]
+        latencies = [v for v in latencies if v is not None]
+        offsets = [s['off_ms'] for s in servers.values() if s['off_ms'] is not None]
+        failovers = [s['failovers'] for s in samples if s['failovers'] is not None]
+        return {
+            'samples': len(samples),
+            'last_seen': last['received_at'],
+            'home': last['home'],
+            'latency_ms': min(latencies) if latencies else None,
+            'clock_offset_ms': max(offsets, key=abs) if offsets else None,
+            'loop_lag_ms': last['lag_ms'],
+            'rss_kb': last['rss_kb'],
+            'consecutive_failures': last['fail'],
+            'failovers': last['failovers'],
+            'failovers_window': (failovers[-1] - failovers[0]) if len(failovers) > 1 else 0,
+            'servers_down': sorted(url for url, s in servers.items() if s['ok'] == 0),
+            'servers': servers
+        }
+
+    def fleet_health(self, names=None):
+        """
+        Salud de la flota: resumen por cliente, percentiles de la flota y los
+        clientes atípicos con el motivo.
+
+        Args:
+            names: dict client_id -> nombre (para mostrar)
+        """
+        names = names or {}
+        with self._lock:
+            windows = {cid: list(samples) for cid, samples in self._samples.items() if samples}
+        clients = {cid: self._summarize(samples) for cid, samples in windows.items()}
+
+        def values(key):
+            return [c[key] for c in clients.values() if c[key] is not None]
+
+        latency_limit = _robust_threshold(values('latency_ms'))
+        lag_limit = _robust_threshold(values('loop_lag_ms'))
+        rss_limit = _robust_threshold(values('rss_kb'))
+        if rss_limit is not None:
+            rss_limit = max(rss_limit, RSS_MIN_RATIO * statistics.median(values('rss_kb')))
+        now = time.time()
+
+        for client_id, summary in clients.items():
+            reasons = []
+            latency = summary['latency_ms']
+            if latency is not None and latency > LATENCY_FLOOR_MS and \
+                    (latency_limit is None or latency > latency_limit):
+                reasons.append(f"sync lento ({latency:.0f} ms)")
+            offset = summary['clock_offset_ms']
+            if offset is not None and abs(offset) > CLOCK_SKEW_MS:
+                reasons.append(f"reloj desfasado ({offset / 1000:+.1f} s)")
+            lag = summary['loop_lag_ms']
+            if lag is not None and lag > LOOP_LAG_FLOOR_MS and (lag_limit is None or lag > lag_limit):
+                reasons.append(f"loop de sync atrasado ({lag:.0f} ms)")
+            if rss_limit is not None and summary['rss_kb'] is not None and summary['rss_kb'] > rss_limit:
+                reasons.append(f"memoria alta ({summary['rss_kb'] / 1024:.0f} MB)")
+            if summary['failovers_window'] > 0:
+                reasons.append(f"{summary['failovers_window']:.0f} cambio(s) de servidor")
+            if summary['consecutive_failures']:
+                reasons.append(f"{summary['consecutive_failures']:.0f} sync fallidos seguidos")
+            if summary['servers_down']:
+                reasons.append(f"{len(summary['servers_down'])} servidor(es) sin responder")
+            if now - summary['last_seen'] > STALE_SECONDS:
+                reasons.append(f"sin telemetría hace {now - summary['last_seen']:.0f} s")
+            summary['client_id'] = client_id
+            summary['name'] = names.get(client_id)
+            summary['outlier'] = bool(reasons)
+            summary['reasons'] = reasons
+
+        def fleet_stats(key):
+            data = values(key)
+            return {'p50': _percentile(data, 0.5), 'p95': _percentile(data, 0.95),
+                    'max': max(data) if data else None}
+
+        ordered = sorted(clients.values(), key=lambda c: (not c['outlier'], c['name'] or c['client_id']))
+        return {
+            'success': True,
+            'generated_at': now,
+            'clients_reporting': len(clients),
+            'outliers': sum(1 for c in ordered if c['outlier']),
+            'rejected_samples': self.rejected,
+            'fleet': {
+                'latency_ms': fleet_stats('latency_ms'),
+                'loop_lag_ms': fleet_stats('loop_lag_ms'),
+                'rss_kb': fleet_stats('rss_kb'),
+                'clock_offset_ms': {
+                    'max_abs': max((abs(v) for v in values('clock_offset_ms')), default=None)
+                }
+            },
+            'thresholds': {
+                'latency_ms': max(LATENCY_FLOOR_MS, latency_limit or 0),
+                'loop_lag_ms': max(LOOP_LAG_FLOOR_MS, lag_limit or 0),
+                'rss_kb': rss_limit,
+                'clock_skew_ms': CLOCK_SKEW_MS
+            },
+            'clients': ordered
+        }
@@ -0,0 +1,203 @@
+"""
+CiberMonday - Grabación del tráfico de la API
+Graba cada request (método, ruta, body, status y duración) en un log JSON por
+líneas que rota por tamaño; los archivos rotados se comprimen con gzip. El
+replayer (benchmarks/replay_traffic.py) los vuelve a enviar contra un servidor
+local para reproducir la carga real del ciber.
+
+Apagado salvo CIBERMONDAY_TRAFFIC_LOG=<archivo>. Formato de cada línea:
+    {"t": 1792377000.123, "m": "POST", "p": "/api/client/<id>/report-session",
+     "c": "<id>", "s": 200, "d": 1.84, "b": {...}, "h": {...}}
+t = inicio (epoch), d = duración en ms, c = client_id (de la ruta, del body o el
+que asignó el servidor en /api/register), b = body
+JSON (o "braw" si no es JSON), h = headers que cambian la respuesta (telemetría).
+"""
+
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+TRAFFIC_LOG_ENV = 'CIBERMONDAY_TRAFFIC_LOG'
+TRAFFIC_MAX_MB_ENV = 'CIBERMONDAY_TRAFFIC_MAX_MB'
+TRAFFIC_BACKUPS_ENV = 'CIBERMONDAY_TRAFFIC_BACKUPS'
+
+DEFAULT_MAX_MB = 20
+DEFAULT_BACKUPS = 5
+
+# Rutas de observabilidad: no son tráfico del ciber
+EXCLUDED_PREFIXES = ('/api/metrics', '/api/profile', '/static/')
+# Headers que se graban (el resto no cambia lo que hace el servidor)
+RECORDED_HEADERS = ('X-CiberMonday-Telemetry',)
+# Bodies más grandes se graban truncados como texto
+MAX_BODY_BYTES = 64 * 1024
+
+_CLIENT_ID_PATH = re.compile(r'^/api/client/([^/?]+)')
+
+
+def client_id_of(path, body=None):
+    """client_id del request: de la ruta o, en /api/register, del body."""
+    match = _CLIENT_ID_PATH.match(path)
+    if match:
+        return match.group(1)
+    if isinstance(body, dict) and isinstance(body.get('client_id'), str):
+        return body['client_id']
+    return None
+
+
+def rotated_paths(path):
+    """Archivos del log, del más viejo al más nuevo (los rotados y el actual)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    base = os.path.basename(path)
+    numbered = []
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        match = re.match(re.escape(base) + r'\.(\d+)(\.gz)?$', name)
+        if match:
+            numbered.append((int(match.group(1)), os.path.join(directory, name)))
+    result = [p for _, p in sorted(numbered, reverse=True)]
+    if os.path.exists(path):
+        result.append(path)
+    return result
+
+
+def read_log(paths):
+    """Itera las entradas de uno o más archivos del log (planos o .gz)."""
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Última línea cortada (el servidor se cerró escribiendo)
+                    continue
+
+
+class TrafficRecorder:
+    """Escribe el log de tráfico y lo rota al pasar max_bytes."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, backups=DEFAULT_BACKUPS):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backups = max(1, backups)
+        self.recorded = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+    @classmethod
+    def from_env(cls):
+        """Recorder según CIBERMONDAY_TRAFFIC_LOG, o None si no está configurado."""
+        path = os.getenv(TRAFFIC_LOG_ENV)
+        if not path:
+            return None
+        try:
+            max_mb = float(os.getenv(TRAFFIC_MAX_MB_ENV, DEFAULT_MAX_MB))
+            backups = int(os.getenv(TRAFFIC_BACKUPS_ENV, DEFAULT_BACKUPS))
+        except ValueError:
+            max_mb, backups = DEFAULT_MAX_MB, DEFAULT_BACKUPS
+        try:
+            recorder = cls(path, int(max_mb * 1024 * 1024), backups)
+        except OSError as e:
+            print(f"[Tráfico] No se pudo abrir {path}: {e}")
+            return None
+        print(f"[Tráfico] Grabando requests en {recorder.path} "
+              f"(rota cada {max_mb:g} MB, {recorder.backups} archivo(s))")
+        return recorder
+
+    @staticmethod
+    def should_record(path):
+        return not path.startswith(EXCLUDED_PREFIXES)
+
+    def record(self, method, path, body, status, seconds, headers=None, started_at=None,
+               client_id=None):
+        """
+        Graba un request ya atendido.
+
+        Args:
+            path: ruta con query string
+            body: bytes del body (b'' si no hay)
+            seconds: duración del request
+            headers: mapping con los headers del request
+            started_at: time.time() del inicio (default: ahora - seconds)
+            client_id: ID asignado en la respuesta (registro de un cliente nuevo)
+        """
+        entry = {
+            't': round(started_at if started_at is not None else time.time() - seconds, 3),
+            'm': method,
+            'p': path,
+            's': status,
+            'd': round(seconds * 1000, 3)
+        }
+        if body:
+            try:
+                entry['b'] = json.loads(body)
+            except ValueError:
+                entry['braw'] = body[:MAX_BODY_BYTES].decode('utf-8', 'replace')
+        client_id = client_id_of(path, entry.get('b')) or client_id
+        if client_id:
+            entry['c'] = client_id
+        if headers is not None:
+            kept = {name: headers.get(name) for name in RECORDED_HEADERS if headers.get(name)}
+            if kept:
+                entry['h'] = kept
+        line = json.dumps(entry, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(line)
+                self._file.flush()
+            except OSError as e:
+                print(f"[Tráfico] Error escribiendo el log, grabación detenida: {e}")
+                self._file.close()
+                self._file = None
+                return
+            self._size += len(line.encode('utf-8'))
+            self.recorded += 1
+            if self._size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        """log -> log.1.gz -> log.2.gz ... (se llama con el lock tomado)."""
+        self._file.close()
+        oldest = f"{self.path}.{self.backups}.gz"
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}.gz"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}.gz")
+        pending = f"{self.path}.1"
+        os.replace(self.path, pending)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = 0
+        # Comprimir fuera del lock para no frenar los requests
+        threading.Thread(target=self._compress, args=(pending,), daemon=True).start()
+
+    @staticmethod
+    def _compress(source):
+        try:
+            with open(source, 'rb') as src, gzip.open(f"{source}.gz", 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(source)
+        except OSError as e:
+            print(f"[Tráfico] No se pudo comprimir {source}: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def status(self):
+        return {'path': self.path, 'recorded': self.recorded, 'size_bytes': self._size,
+                'max_bytes': self.max_bytes, 'backups': self.backups}
@@ -10,6 +10,9 @@ import sys
 import requests
 import os
 
+# Grupo multicast de descubrimiento (modo 'multicast' o 'both' del servidor)
+MULTICAST_GROUP = os.getenv('CIBERMONDAY_MULTICAST_GROUP', '239.255.77.77')
+
 def get_local_ip():
     """Obtiene la IP local"""
     try:
@@ -55,7 +58,7 @@ def test_server_connectivity(server_ip, port=5000):
 def test_broadcast_listening(duration=15):
     """Escucha broadcasts UDP durante un tiempo determinado"""
     print(f"\n{'='*60}")
-    print(f"2. Escuchando broadcasts UDP en puerto 5001 ({duration} segundos)")
+    print(f"2. Escuchando anuncios UDP (broadcast y multicast) en puerto 5001 ({duration} segundos)")
     print(f"{'='*60}")
     
     try:
@@ -66,6 +69,12 @@ def test_broadcast_listening(duration=15):
         sock.settimeout(1.0)
         
         print(f"   ✅ Socket UDP creado y vinculado al puerto 5001")
+        try:
+            membership = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            print(f"   ✅ Unido al grupo multicast {MULTICAST_GROUP}")
+        except OSError as e:
+            print(f"   ⚠️  No se pudo unir al grupo multicast {MULTICAST_GROUP}: {e}")
         print(f"   Escuchando broadcasts desde la red local...")
         
         start_time = time.time()
@@ -111,6 +120,7 @@ def test_broadcast_listening(duration=15):
             print(f"     - El servidor no está enviando broadcasts")
             print(f"     - El servidor tiene clientes conectados (broadcasts pausados)")
             print(f"     - Firewall bloqueando UDP")
+            print(f"     - Modo multicast con otro grupo (CIBERMONDAY_MULTICAST_GROUP) o TTL insuficiente")
             print(f"     - Problemas de red")
             return False, {}
             
@@ -5,21 +5,28 @@ import functools
 # Agregar el directorio padre al path para poder importar core
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template
 from flask_cors import CORS
 from datetime import datetime
 import json
+import time
 import urllib.request
 import urllib.error
 
 from core import ClientManager
+from core.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from core.telemetry import TELEMETRY_HEADER
+from core.traffic import TrafficRecorder
+from core.profiling import (Profiler, PROFILE_ID_HEADER, FOLDED_CONTENT_TYPE,
+                            DEFAULT_SAMPLE_SECONDS, DEFAULT_SAMPLE_INTERVAL_MS)
 
 app = Flask(__name__, template_folder='templates')
 CORS(app)
 
 # Instancia única del gestor de clientes/servidores
 _port = int(os.getenv('PORT', 5000))
-manager = ClientManager(server_port=_port)
+manager = ClientManager(server_port=_port,
+                        commands_path=ClientManager.default_commands_path(_port))
 
 # ==================== ADMIN ACCESS CONTROL ====================
 
@@ -48,6 +55,157 @@ def admin_only(f):
     return decorated
 
 
+# ==================== MÉTRICAS ====================
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_metrics(response):
+    """Cuenta el request y su latencia por la regla de la ruta (no la URL con IDs)."""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'other'
+        manager.metrics.observe_request(request.method, route, response.status_code,
+                                        time.perf_counter() - started)
+    return response
+
+
+@app.route('/api/metrics', methods=['GET'])
+@admin_only
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus."""
+    return Response(manager.metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+# ==================== PERFILADO ====================
+
+# Apagado salvo CIBERMONDAY_PROFILING=1 (ver core/profiling.py)
+profiler = Profiler.from_env()
+
+
+def profiling_only(f):
+    """Decorator que rechaza la ruta si el perfilado no está habilitado."""
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        if not profiler.enabled:
+            return jsonify(profiler.disabled_result()), 403
+        return f(*args, **kwargs)
+    return decorated
+
+
+@app.before_request
+def _start_request_profile():
+    if profiler.enabled and _is_admin_request() and \
+            profiler.wants_request_profile(request.headers, request.args):
+        g.request_profile = profiler.begin_request()
+
+
+@app.after_request
+def _finish_request_profile(response):
+    token = g.pop('request_profile', None)
+    if token is not None:
+        profile_id = profiler.end_request(token, request.method, request.path,
+                                          response.status_code)
+        response.headers[PROFILE_ID_HEADER] = str(profile_id)
+    return response
+
+
+@app.route('/api/profile', methods=['GET'])
+@admin_only
+def profile_status():
+    """Estado del muestreo, de tracemalloc y cantidad de perfiles por request."""
+    return jsonify(profiler.status())
+
+
+@app.route('/api/profile/start', methods=['POST'])
+@admin_only
+@profiling_only
+def profile_start():
+    """Arranca el muestreo de pilas (`seconds`, `interval_ms`)."""
+    data = request.get_json(silent=True) or {}
+    result = profiler.sampler.start(
+        seconds=data.get('seconds', DEFAULT_SAMPLE_SECONDS),
+        interval_ms=data.get('interval_ms', DEFAULT_SAMPLE_INTERVAL_MS)
+    )
+    return jsonify(result), 200 if result['success'] else 400
+
+
+@app.route('/api/profile/stop', methods=['POST'])
+@admin_only
+@profiling_only
+def profile_stop():
+    """Corta el muestreo y devuelve el perfil en formato folded."""
+    profiler.sampler.stop()
+    return Response(profiler.sampler.folded(), content_type=FOLDED_CONTENT_TYPE)
+
+
+@app.route('/api/profile/flamegraph', methods=['GET'])
+@admin_only
+@profiling_only
+def profile_flamegraph():
+    """Último muestreo (terminado o en curso) en formato folded."""
+    return Response(profiler.sampler.folded(), content_type=FOLDED_CONTENT_TYPE)
+
+
+@app.route('/api/profile/requests', methods=['GET'])
+@admin_only
+@profiling_only
+def profile_requests():
+    """Perfiles cProfile de los últimos requests marcados, el más nuevo primero."""
+    return jsonify({'success': True, 'profiles': profiler.get_request_profiles()})
+
+
+@app.route('/api/profile/memory/snapshot', methods=['POST'])
+@admin_only
+@profiling_only
+def profile_memory_snapshot():
+    """Snapshot de tracemalloc y crecimiento desde el anterior (`limit`)."""
+    data = request.get_json(silent=True) or {}
+    result = profiler.memory.snapshot(limit=data.get('limit', 20))
+    return jsonify(result), 200 if result['success'] else 400
+
+
+@app.route('/api/profile/memory/stop', methods=['POST'])
+@admin_only
+@profiling_only
+def profile_memory_stop():
+    """Apaga tracemalloc."""
+    return jsonify(profiler.memory.stop())
+
+
+# ==================== GRABACIÓN DE TRÁFICO ====================
+
+# Apagado salvo CIBERMONDAY_TRAFFIC_LOG=<archivo> (ver core/traffic.py)
+traffic_recorder = TrafficRecorder.from_env()
+
+
+@app.before_request
+def _start_traffic_record():
+    if traffic_recorder is not None and traffic_recorder.should_record(request.path):
+        g.traffic_started = (time.time(), time.perf_counter())
+
+
+@app.after_request
+def _record_traffic(response):
+    started = g.pop('traffic_started', None)
+    if started is not None:
+        path = request.path
+        if request.query_string:
+            path += '?' + request.query_string.decode('utf-8', 'replace')
+        client_id = None
+        if request.path == '/api/register':
+            # El replay sigue al cliente nuevo con el ID que le asignó el servidor
+            client_id = (response.get_json(silent=True) or {}).get('client_id')
+        traffic_recorder.record(request.method, path, request.get_data(cache=True),
+                                response.status_code, time.perf_counter() - started[1],
+                                headers=request.headers, started_at=started[0],
+                                client_id=client_id)
+    return response
+
+
 # ==================== CLIENT ROUTES ====================
 
 @app.route('/api/register', methods=['POST'])
@@ -106,7 +264,11 @@ def set_client_time(client_id):
 @app.route('/api/client/<client_id>/status', methods=['GET'])
 def get_client_status(client_id):
     """Obtiene el estado actual de un cliente, incluyendo su configuración."""
-    client_data = manager.get_client_status(client_id)
+    # ack: último comando aplicado por el cliente (confirma su cola de comandos)
+    # La telemetría del cliente viaja en un header del mismo request
+    client_data = manager.get_client_status(client_id, ack_seq=request.args.get('ack'),
+                                            ack_queue=request.args.get('queue'),
+                                            telemetry=request.headers.get(TELEMETRY_HEADER))
     if client_data is None:
         return jsonify({'success': False, 'message': 'Cliente no encontrado'}), 404
     
@@ -149,7 +311,8 @@ def set_client_config(client_id):
         custom_name=data.get('custom_name'),
         max_server_timeouts=data.get('max_server_timeouts'),
         lock_recheck_interval=data.get('lock_recheck_interval'),
-        notify_client=not from_client
+        notify_client=not from_client,
+        version=data.get('version') if from_client else None
     )
     
     status = 200 if result['success'] else (404 if 'no encontrado' in result['message'] else 400)
@@ -163,12 +326,33 @@ def report_client_session(client_id):
     result = manager.report_session(
         client_id,
         data.get('remaining_seconds', 0),
-        data.get('time_limit_seconds')
+        data.get('time_limit_seconds'),
+        data.get('end_ts'),
+        data.get('version')
     )
     status = 200 if result['success'] else (404 if 'no encontrado' in result['message'] else 400)
     return jsonify(result), status
 
 
+@app.route('/api/client/<client_id>/report-batch', methods=['POST'])
+def report_client_batch(client_id):
+    """Recibe en un solo request las transiciones acumuladas por el cliente (outbox)."""
+    data = request.json or {}
+    result = manager.ingest_events(client_id, data.get('events', []))
+    status = 200 if result['success'] else 404
+    return jsonify(result), status
+
+
+@app.route('/api/client/<client_id>/history', methods=['GET'])
+@admin_only
+def get_client_history(client_id):
+    """Obtiene el historial de transiciones reportadas por el cliente."""
+    history = manager.get_client_history(client_id)
+    if history is None:
+        return jsonify({'success': False, 'message': 'Cliente no encontrado'}), 404
+    return jsonify({'success': True, 'history': history}), 200
+
+
 @app.route('/api/client/<client_id>/stop', methods=['POST'])
 @admin_only
 def stop_client_session(client_id):
@@ -196,7 +380,14 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'active_clients': stats['active_clients'],
-        'total_clients': stats['total_clients']
+        'total_clients': stats['total_clients'],
+        'epoch': manager.recovery_epoch,
+        'recovery': manager.get_recovery_status(),
+        # El servidor replica el estado a sus peers: basta sincronizar con uno
+        'replication': True,
+        'leader': manager.get_leader_status(),
+        # Reloj del servidor para que el cliente estime su offset (estilo NTP)
+        'server_time': time.time()
     }), 200
 
 
@@ -232,7 +423,12 @@ def set_server_config():
     """Actualiza la configuración del servidor."""
     data = request.json
     result = manager.set_server_config(
-        broadcast_interval=data.get('broadcast_interval')
+        broadcast_interval=data.get('broadcast_interval'),
+        broadcast_max_interval=data.get('broadcast_max_interval'),
+        discovery_mode=data.get('discovery_mode'),
+        multicast_group=data.get('multicast_group'),
+        multicast_ttl=data.get('multicast_ttl'),
+        replication_factor=data.get('replication_factor')
     )
     status = 200 if result['success'] else 400
     return jsonify(result), status
@@ -258,7 +454,8 @@ def register_server_endpoint():
     result['known_servers'] = manager.get_servers()
     
     # Si se agregó un nuevo servidor y hay clientes conectados, notificarlos
-    if not server_exists and len(manager.clients_db) > 0:
+    # Solo el líder avisa a los clientes y sincroniza la malla (evita trabajo duplicado)
+    if not server_exists and len(manager.clients_db) > 0 and manager.is_leader():
         _notify_clients_new_server(server_url, data)
         manager._sync_with_other_servers()
     
@@ -292,12 +489,56 @@ def sync_servers_endpoint():
     }), 200
 
 
+@app.route('/api/replicate', methods=['POST'])
+def replicate_endpoint():
+    """
+    Recibe entradas del log de cambios de otro servidor (replicación de estado).
+    Responde con la época local para que el emisor detecte reinicios.
+    Solo acepta servidores de la malla (ver ClientManager.is_replication_peer).
+    """
+    if not manager.is_replication_peer(request.remote_addr,
+                                       request.headers.get(manager.MESH_SECRET_HEADER)):
+        return jsonify({
+            'success': False,
+            'message': 'Acceso denegado. Solo servidores de la malla pueden replicar.'
+        }), 403
+    data = request.json or {}
+    result = manager.apply_replication(
+        data.get('origin'),
+        data.get('epoch'),
+        data.get('entries', []),
+        claimed_leader=data.get('leader')
+    )
+    return jsonify(result), 200
+
+
+@app.route('/api/replication-status', methods=['GET'])
+@admin_only
+def replication_status_endpoint():
+    """Cursor y atraso de la replicación hacia cada peer."""
+    return jsonify({
+        'success': True,
+        'replication': manager.get_replication_status()
+    }), 200
+
+
+@app.route('/api/fleet-health', methods=['GET'])
+@admin_only
+def fleet_health_endpoint():
+    """
+    Salud de la sincronización de la flota (telemetría de los clientes).
+    ?client=<id> devuelve las muestras guardadas de ese cliente.
+    """
+    result = manager.get_fleet_health(request.args.get('client'))
+    return jsonify(result), 200 if result['success'] else 404
+
+
 @app.route('/api/force-sync', methods=['POST'])
 @admin_only
 def force_sync_endpoint():
     """Fuerza una sincronización completa con todos los servidores conocidos."""
     try:
-        manager._sync_with_other_servers()
+        manager._sync_with_other_servers(force=True)
         return jsonify({
             'success': True,
             'message': 'Sincronización forzada completada',
@@ -365,6 +606,9 @@ def broadcast_server_presence(server_port=5000):
     if host_ip:
         print(f"[Broadcast] Usando IP del host desde HOST_IP: {host_ip}")
     manager.start_broadcast(host_ip_override=host_ip)
+    manager.start_discovery_responder(host_ip_override=host_ip)
+    manager.start_replication()
+    manager.start_expiry_scheduler()
 
 
 if __name__ == '__main__':
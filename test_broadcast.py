@@ -2,13 +2,29 @@
 """
 Script para escuchar y mostrar los broadcasts UDP del servidor CiberMonday.
 Simula lo que hace el cliente cuando escucha broadcasts en el puerto 5001.
+
+Uso:
+    python test_broadcast.py                    # mostrar cada anuncio recibido
+    python test_broadcast.py --measure 60       # contar anuncios y probes durante 60 s
+    python test_broadcast.py --measure 60 --json trafico.json
+
+Con --measure también escucha el puerto de probes (5003) y resume mensajes y
+bytes por emisor. benchmarks/mesh_convergence.py usa DiscoveryTrafficCounter.
 """
 
+import argparse
+import os
 import socket
 import json
+import threading
+import time
 from datetime import datetime
 
 DISCOVERY_PORT = 5001
+# Puerto donde los clientes envían probes {"type": "discover"}
+DISCOVERY_QUERY_PORT = 5003
+# Grupo multicast usado por los servidores en modo 'multicast' o 'both'
+MULTICAST_GROUP = os.getenv('CIBERMONDAY_MULTICAST_GROUP', '239.255.77.77')
 
 def listen_for_broadcasts():
     """Escucha broadcasts UDP del servidor"""
@@ -21,9 +37,14 @@ def listen_for_broadcasts():
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         sock.bind(('', DISCOVERY_PORT))
+        try:
+            membership = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            print(f"[WARN] No se pudo unir al grupo multicast {MULTICAST_GROUP}: {e}")
         
         print("=" * 60)
-        print(f"Escuchando broadcasts UDP en puerto {DISCOVERY_PORT}...")
+        print(f"Escuchando broadcasts UDP en puerto {DISCOVERY_PORT} (multicast {MULTICAST_GROUP})...")
         print("Presiona Ctrl+C para salir")
         print("=" * 60)
         print()
@@ -82,5 +103,121 @@ def listen_for_broadcasts():
                 pass
         print(f"\nTotal de broadcasts recibidos: {broadcast_count}")
 
+class DiscoveryTrafficCounter:
+    """
+    Cuenta el tráfico UDP de descubrimiento visible desde esta máquina: anuncios
+    de los servidores (DISCOVERY_PORT) y probes de los clientes (DISCOVERY_QUERY_PORT).
+    Los sockets usan SO_REUSEADDR, así se escucha junto a clientes y servidores.
+    Las ofertas (respuesta unicast a un probe) solo le llegan al cliente que
+    preguntó: se ven en el /api/diagnostic del cliente (offers_received).
+    """
+
+    def __init__(self, announce_port=DISCOVERY_PORT, probe_port=DISCOVERY_QUERY_PORT,
+                 multicast_group=MULTICAST_GROUP):
+        self.ports = {'anuncios': announce_port, 'probes': probe_port}
+        self.multicast_group = multicast_group
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.started_at = None
+        self.counts = {kind: {'messages': 0, 'bytes': 0, 'senders': {}} for kind in self.ports}
+
+    def _open(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', port))
+        try:
+            membership = socket.inet_aton(self.multicast_group) + socket.inet_aton('0.0.0.0')
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            print(f"[WARN] No se pudo unir al grupo multicast {self.multicast_group}: {e}")
+        sock.settimeout(0.5)
+        return sock
+
+    def _listen(self, kind, sock):
+        while not self._stop.is_set():
+            try:
+                data, addr = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            # Anuncios: el emisor es la URL anunciada. Probes: la dirección del cliente
+            sender = f"{addr[0]}:{addr[1]}"
+            if kind == 'anuncios':
+                try:
+                    sender = json.loads(data.decode('utf-8')).get('url') or sender
+                except (ValueError, UnicodeDecodeError, AttributeError):
+                    pass
+            with self._lock:
+                entry = self.counts[kind]
+                entry['messages'] += 1
+                entry['bytes'] += len(data)
+                entry['senders'][sender] = entry['senders'].get(sender, 0) + 1
+        sock.close()
+
+    def start(self):
+        """Abre los sockets y empieza a contar (lanza OSError si no se pueden abrir)."""
+        sockets = {kind: self._open(port) for kind, port in self.ports.items()}
+        self.started_at = time.time()
+        for kind, sock in sockets.items():
+            thread = threading.Thread(target=self._listen, args=(kind, sock), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(2)
+
+    def snapshot(self):
+        """Copia de los contadores: {'anuncios'|'probes': {messages, bytes, senders}}."""
+        with self._lock:
+            return {kind: {'messages': entry['messages'], 'bytes': entry['bytes'],
+                           'senders': dict(entry['senders'])}
+                    for kind, entry in self.counts.items()}
+
+
+def measure_discovery_traffic(seconds, json_path=None):
+    """Cuenta anuncios y probes durante `seconds` (Ctrl+C corta antes) e imprime el resumen."""
+    counter = DiscoveryTrafficCounter()
+    try:
+        counter.start()
+    except OSError as e:
+        print(f"[ERROR] No se pudieron abrir los puertos {DISCOVERY_PORT}/{DISCOVERY_QUERY_PORT}: {e}")
+        return 1
+    print(f"Contando tráfico de descubrimiento durante {seconds}s "
+          f"(UDP {DISCOVERY_PORT} y {DISCOVERY_QUERY_PORT}, multicast {MULTICAST_GROUP})...")
+    try:
+        time.sleep(seconds)
+    except KeyboardInterrupt:
+        print("\nMedición interrumpida")
+    counter.stop()
+    elapsed = time.time() - counter.started_at
+    result = counter.snapshot()
+
+    print("=" * 60)
+    print(f"{'tipo':<10} {'mensajes':>9} {'bytes':>10} {'msg/s':>8} {'emisores':>9}")
+    for kind, entry in result.items():
+        print(f"{kind:<10} {entry['messages']:>9} {entry['bytes']:>10} "
+              f"{entry['messages'] / elapsed:>8.2f} {len(entry['senders']):>9}")
+    for kind, entry in result.items():
+        for sender, count in sorted(entry['senders'].items(), key=lambda item: -item[1]):
+            print(f"  {kind:<8} {sender:<40} {count:>6}")
+    print("=" * 60)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump({'seconds': elapsed, 'traffic': result}, f, indent=2)
+    return 0
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Escucha el descubrimiento UDP de CiberMonday')
+    parser.add_argument('--measure', type=float, metavar='SEGUNDOS',
+                        help='Contar anuncios y probes durante SEGUNDOS en vez de mostrarlos')
+    parser.add_argument('--json', help='Guardar el resumen de --measure en este archivo JSON')
+    args = parser.parse_args()
+    if args.measure:
+        raise SystemExit(measure_discovery_traffic(args.measure, args.json))
     listen_for_broadcasts()